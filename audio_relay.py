@@ -0,0 +1,161 @@
+import asyncio
+import time
+from collections import deque
+
+from constants import AUDIO_SAMPLE_RATE, AUDIO_RELAY_FRAME_MS, AUDIO_RELAY_MAX_WAIT_MS, AUDIO_RELAY_MAX_BUFFER_MS
+from tracing import percentile
+
+# Per-session relay for pcm16 audio between the browser and the realtime API.
+# Small chunks are coalesced into frames, one send is in flight at a time,
+# and a bounded buffer either drops the oldest audio when the receiver falls
+# behind (push) or makes the producer wait for room (put).
+
+BYTES_PER_SAMPLE = 2
+
+
+def as_bytes(data):
+    return data.tobytes() if hasattr(data, "tobytes") else bytes(data)
+
+
+class AudioRelay:
+    """Relay of one direction. max_buffer_ms=None leaves the buffer unbounded."""
+
+    def __init__(self, send, name, sample_rate=AUDIO_SAMPLE_RATE, frame_ms=AUDIO_RELAY_FRAME_MS,
+                 max_wait_ms=AUDIO_RELAY_MAX_WAIT_MS, max_buffer_ms=AUDIO_RELAY_MAX_BUFFER_MS):
+        self._send = send
+        self.name = name
+        self.bytes_per_ms = sample_rate * BYTES_PER_SAMPLE / 1000
+        self.frame_bytes = max(BYTES_PER_SAMPLE, self._align(frame_ms * self.bytes_per_ms))
+        self.max_buffer_bytes = (None if max_buffer_ms is None
+                                 else max(self.frame_bytes, self._align(max_buffer_ms * self.bytes_per_ms)))
+        self.max_wait = max_wait_ms / 1000
+        self._buffer = bytearray()
+        # (arrival time, bytes still buffered) of every pushed chunk, oldest first
+        self._arrivals = deque()
+        self._ready = asyncio.Event()
+        # Set whenever buffered audio is sent or dropped, for producers waiting in put
+        self._drained = asyncio.Event()
+        # put waits in arrival order, so audio is never reordered
+        self._put_lock = asyncio.Lock()
+        # Bumped by clear, so audio waiting in put when the buffer is cleared is dropped too
+        self._epoch = 0
+        self._closed = False
+        self._latencies = deque(maxlen=500)
+        self.frames = 0
+        self.dropped_bytes = 0
+        self.max_depth_bytes = 0
+        self.waits = 0
+        self._task = asyncio.get_running_loop().create_task(self._pump())
+
+    @staticmethod
+    def _align(size):
+        # Whole samples only, 0 for less than one
+        return int(size) // BYTES_PER_SAMPLE * BYTES_PER_SAMPLE
+
+    def push(self, data):
+        """Queue audio without waiting; with a bounded buffer the oldest audio is dropped when it is full"""
+        if self._closed or not len(data):
+            return
+        self._append(as_bytes(data))
+        overflow = 0 if self.max_buffer_bytes is None else len(self._buffer) - self.max_buffer_bytes
+        if overflow > 0:
+            overflow += overflow % BYTES_PER_SAMPLE
+            self._consume(overflow)
+            self.dropped_bytes += overflow
+        self.max_depth_bytes = max(self.max_depth_bytes, len(self._buffer))
+
+    def _append(self, data):
+        self._buffer += data
+        self._arrivals.append([time.perf_counter(), len(data)])
+        self._ready.set()
+
+    async def put(self, data):
+        """Queue audio, waiting while a bounded buffer has no room for it instead of dropping"""
+        data = as_bytes(data)
+        epoch = self._epoch
+        async with self._put_lock:
+            while (self.max_buffer_bytes is not None and self._buffer and not self._closed
+                   and len(self._buffer) + len(data) > self.max_buffer_bytes):
+                self.waits += 1
+                self._drained.clear()
+                await self._drained.wait()
+            if epoch != self._epoch:
+                self.dropped_bytes += len(data)
+            elif not self._closed and len(data):
+                # A chunk larger than the whole buffer is still queued whole, once the buffer is empty
+                self._append(data)
+                self.max_depth_bytes = max(self.max_depth_bytes, len(self._buffer))
+
+    def clear(self):
+        """Drop buffered audio, e.g. when the user interrupts the answer"""
+        self._epoch += 1
+        self.dropped_bytes += len(self._buffer)
+        self._consume(len(self._buffer))
+
+    def _consume(self, size):
+        del self._buffer[:size]
+        self._drained.set()
+        while size and self._arrivals:
+            taken = min(size, self._arrivals[0][1])
+            self._arrivals[0][1] -= taken
+            size -= taken
+            if not self._arrivals[0][1]:
+                self._arrivals.popleft()
+
+    async def _pump(self):
+        while True:
+            if not self._buffer:
+                if self._closed:
+                    return
+                self._ready.clear()
+                await self._ready.wait()
+                continue
+            if len(self._buffer) < self.frame_bytes and not self._closed:
+                # Wait for a full frame, but never hold audio longer than max_wait
+                wait = self._arrivals[0][0] + self.max_wait - time.perf_counter()
+                if wait > 0:
+                    self._ready.clear()
+                    try:
+                        await asyncio.wait_for(self._ready.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+            size = min(self.frame_bytes, self._align(len(self._buffer)))
+            if not size:
+                # Half a sample: wait for the rest, or drop it once closed
+                if self._closed:
+                    self.clear()
+                else:
+                    self._ready.clear()
+                    await self._ready.wait()
+                continue
+            frame = bytes(self._buffer[:size])
+            oldest = self._arrivals[0][0]
+            self._consume(size)
+            try:
+                await self._send(frame)
+            except Exception as e:
+                print(f"Audio relay {self.name}: send failed: {e}")
+                continue
+            self.frames += 1
+            self._latencies.append(time.perf_counter() - oldest)
+
+    async def close(self, flush=True):
+        if not flush:
+            self.clear()
+        self._closed = True
+        self._ready.set()
+        self._drained.set()
+        await self._task
+
+    def stats(self):
+        latencies = sorted(self._latencies)
+        return {
+            "depth_ms": round(len(self._buffer) / self.bytes_per_ms),
+            "max_depth_ms": round(self.max_depth_bytes / self.bytes_per_ms),
+            "frames": self.frames,
+            "dropped_ms": round(self.dropped_bytes / self.bytes_per_ms),
+            "waits": self.waits,
+            "latency_p50_ms": round(1000 * percentile(latencies, 50)) if latencies else None,
+            "latency_p95_ms": round(1000 * percentile(latencies, 95)) if latencies else None,
+        }
@@ -0,0 +1,242 @@
+"""Measure the Immersive Mode voice loop against a scripted realtime stand-in.
+
+Usage:
+    python benchmarks/bench_realtime.py [--audio question.wav] [--turns 10] [--script script.json]
+        [--tool-args '{"tool_name": {"query": "..."}}'] [--playout-ms 200]
+
+A recorded question (mono pcm16 24 kHz wav, a tone by default) is fed through
+the immersive_chainlit.py handlers in 100 ms frames, as the browser sends it,
+with silence in between like an open microphone. The app talks to
+realtime_stub.py, which detects the end of speech with its VAD and answers
+after scripted delays. Without --script the turns alternate between a spoken
+answer and a call to each of the immersive_tools tools, with string arguments
+filled in with the question text.
+
+Reported per turn and as percentiles:
+- speech end to first audio: from the last voiced frame handed to
+  on_audio_chunk to the first frame given to send_audio_chunk, so it includes
+  the stand-in VAD's --vad-silence-ms
+- tool latency: the app's tool:<name> spans and the stand-in's round trip from
+  the function call to its output
+- output jitter: RFC 3550 interarrival jitter of the audio frames, the largest
+  gap, and how often playback with a --playout-ms buffer would run dry
+Results go to benchmarks/results/realtime-<time>/.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_retrieval import git_revision  # noqa: E402
+from load_test import (FRAME_MS, free_port, keep_mic_open, read_pcm16, read_spans, recording_emitter,  # noqa: E402
+                       start_stub, stream_audio, wait_for_answer)
+from realtime_stub import SAMPLE_RATE, rms, tone  # noqa: E402
+
+DEFAULT_QUESTION = "What did the speakers say about building agents?"
+VAD_THRESHOLD = 500.0
+
+
+def trim_trailing_silence(pcm):
+    """The recording up to its last voiced frame; the rest is replaced by the open microphone"""
+    frame_bytes = SAMPLE_RATE * 2 * FRAME_MS // 1000
+    end = len(pcm)
+    while end > 0 and rms(pcm[max(0, end - frame_bytes):end]) < VAD_THRESHOLD:
+        end -= frame_bytes
+    if end <= 0:
+        raise ValueError("the recording has no speech loud enough for the stand-in VAD")
+    return pcm[:end]
+
+
+def stream_jitter(frames, playout_ms):
+    """Jitter of audio frames [(arrival, bytes)] relative to their media time.
+
+    Playback starts playout_ms after the first frame; a frame arriving after its
+    playback time is an underrun, and playback waits for it.
+    """
+    if not frames:
+        return None
+    jitter = 0.0
+    max_gap = 0.0
+    underruns = 0
+    playback_start = frames[0][0] + playout_ms / 1000
+    media = 0.0
+    previous = None
+    for arrival, size in frames:
+        transit = arrival - media
+        if previous is not None:
+            jitter += (abs(transit - previous[1]) - jitter) / 16
+            max_gap = max(max_gap, arrival - previous[0])
+        due = playback_start + media
+        if arrival > due:
+            underruns += 1
+            playback_start += arrival - due
+        previous = (arrival, transit)
+        media += size / 2 / SAMPLE_RATE
+    return {"jitter_ms": round(1000 * jitter, 2), "max_gap_ms": round(1000 * max_gap, 1),
+            "underruns": underruns, "audio_seconds": round(media, 3)}
+
+
+def tool_arguments(tool_def, question, overrides):
+    """Arguments for a tool call: overrides, or the question for every required string parameter"""
+    if tool_def["name"] in overrides:
+        return overrides[tool_def["name"]]
+    parameters = tool_def.get("parameters", {})
+    defaults = {"string": question, "integer": 0, "number": 0, "boolean": False, "array": [], "object": {}}
+    return {name: defaults.get(parameters.get("properties", {}).get(name, {}).get("type"), question)
+            for name in parameters.get("required", [])}
+
+
+def default_script(tool_defs, question, overrides, args):
+    answer = {"first_audio_delay": args.first_audio_delay, "response_seconds": args.response_seconds,
+              "chunk_jitter_ms": args.chunk_jitter_ms}
+    script = []
+    for tool_def in tool_defs:
+        script += [answer, {**answer, "tool_call": {"name": tool_def["name"],
+                                                    "arguments": tool_arguments(tool_def, question, overrides)}}]
+    return script or [answer]
+
+
+def summarize_values(values):
+    from tracing import PERCENTILES, percentile
+
+    values = sorted(values)
+    return {"count": len(values), **{f"p{pct}": percentile(values, pct) for pct in PERCENTILES},
+            "max": values[-1] if values else None}
+
+
+async def run_session(app, speech, args):
+    import chainlit as cl
+    from chainlit.context import init_http_context
+
+    context = init_http_context()
+    emitter = context.emitter = recording_emitter(context.session)
+    elapsed = [0]
+    turns = []
+    await app.start()
+    # Measure warm turns; the index load is reported by the app's own spans
+    if indexes_task := cl.user_session.get("indexes_task"):
+        await indexes_task
+    if not await app.on_audio_start():
+        raise RuntimeError("could not connect to the realtime stand-in")
+    mic = asyncio.create_task(keep_mic_open(app, elapsed))
+    try:
+        for turn in range(args.turns):
+            mic.cancel()
+            await asyncio.gather(mic, return_exceptions=True)
+            await stream_audio(app, speech, elapsed)
+            speech_end = time.perf_counter()
+            mic = asyncio.create_task(keep_mic_open(app, elapsed))
+            record = {"turn": turn, "ts": time.time()}
+            try:
+                first_audio, last_audio = await wait_for_answer(emitter, speech_end, args.timeout, args.settle)
+                frames = [frame for frame in emitter.audio_frames if frame[0] >= speech_end]
+                record.update(first_audio=round(first_audio, 4), answer_end=round(last_audio, 4),
+                              **stream_jitter(frames, args.playout_ms))
+            except TimeoutError as e:
+                record["error"] = str(e)
+            turns.append(record)
+            print(f"Turn {turn}: {record}")
+            await asyncio.sleep(args.pause)
+    finally:
+        mic.cancel()
+        await app.on_end()
+    return turns
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--audio", help=f"mono pcm16 {SAMPLE_RATE} Hz wav of a spoken question, a tone by default")
+    parser.add_argument("--question", default=DEFAULT_QUESTION, help="text used for tool call arguments")
+    parser.add_argument("--turns", type=int, default=10)
+    parser.add_argument("--script", help="JSON list of scripted responses, see realtime_stub.py")
+    parser.add_argument("--tool-args", default="{}", help="JSON object of arguments per tool name")
+    parser.add_argument("--first-audio-delay", type=float, default=0.4)
+    parser.add_argument("--response-seconds", type=float, default=3.0)
+    parser.add_argument("--chunk-jitter-ms", type=float, default=0.0, help="stand-in delay added to audio chunks")
+    parser.add_argument("--vad-silence-ms", type=int, default=500)
+    parser.add_argument("--playout-ms", type=float, default=200.0, help="browser playback buffer for underruns")
+    parser.add_argument("--settle", type=float, default=0.5, help="quiet seconds after which an answer is complete")
+    parser.add_argument("--pause", type=float, default=1.0, help="seconds between turns")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--output", default=os.path.join(BENCH_DIR, "results"))
+    args = parser.parse_args()
+
+    os.chdir(REPO_DIR)
+    from dotenv import load_dotenv
+    load_dotenv()
+    run_dir = os.path.join(args.output, time.strftime("realtime-%Y%m%d-%H%M%S"))
+    os.makedirs(run_dir, exist_ok=True)
+    spans_path, stub_log = os.path.join(run_dir, "spans.jsonl"), os.path.join(run_dir, "stub_events.jsonl")
+
+    # Tools are searched with the real indexes and embeddings
+    from video_index.video_processing.immersive_tools import tools
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+    else:
+        script = default_script([tool_def for tool_def, _ in tools], args.question, json.loads(args.tool_args), args)
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as f:
+        json.dump(script, f)
+    port = free_port()
+    stub = start_stub("realtime_stub.py", port, ["--script", f.name, "--log", stub_log,
+                                                 "--vad-silence-ms", str(args.vad_silence_ms)])
+    # Must be set before the app creates its realtime clients and tracer
+    os.environ.update({"RECALL_REALTIME_URL": f"ws://127.0.0.1:{port}", "RECALL_TRACE_LOG_PATH": spans_path})
+    speech = trim_trailing_silence(read_pcm16(args.audio) if args.audio else tone(2.0))
+
+    import immersive_chainlit as app
+    start_ts = time.time()
+    try:
+        turns = asyncio.run(run_session(app, speech, args))
+    finally:
+        stub.terminate()
+        os.unlink(f.name)
+
+    completed = [turn for turn in turns if "error" not in turn]
+    spans = read_spans(spans_path, start_ts, time.time())
+    tool_spans, round_trips = {}, {}
+    for span in spans:
+        if span["app"] == app.TRACE_APP and span["stage"].startswith("tool:"):
+            tool_spans.setdefault(span["stage"][len("tool:"):], []).append(span["seconds"])
+    for event in read_spans(stub_log, start_ts, time.time()):
+        round_trips.setdefault(event["name"], []).append(event["seconds"])
+    summary = {
+        "revision": git_revision(),
+        "created_at": time.time(),
+        "config": {key: value for key, value in vars(args).items() if key != "output"},
+        "turns": len(turns),
+        "errors": len(turns) - len(completed),
+        "speech_end_to_first_audio": summarize_values(turn["first_audio"] for turn in completed),
+        "jitter_ms": summarize_values(turn["jitter_ms"] for turn in completed),
+        "max_gap_ms": summarize_values(turn["max_gap_ms"] for turn in completed),
+        "underruns": sum(turn["underruns"] for turn in completed),
+        "tools": {name: {"handler": summarize_values(tool_spans.get(name, [])),
+                         "round_trip": summarize_values(round_trips.get(name, []))}
+                  for name in sorted(set(tool_spans) | set(round_trips))},
+        "script": script,
+    }
+    with open(os.path.join(run_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    with open(os.path.join(run_dir, "turns.jsonl"), "w") as f:
+        for turn in turns:
+            f.write(json.dumps(turn) + "\n")
+
+    first_audio = summary["speech_end_to_first_audio"]
+    print(f"{len(completed)}/{len(turns)} turns answered. Speech end to first audio "
+          f"p50 {first_audio['p50']}s p99 {first_audio['p99']}s, jitter p99 {summary['jitter_ms']['p99']} ms, "
+          f"{summary['underruns']} underrun(s) with a {args.playout_ms:.0f} ms buffer")
+    for name, stats in summary["tools"].items():
+        print(f"tool {name}: handler p50 {stats['handler']['p50']}s, round trip p50 {stats['round_trip']['p50']}s")
+    print(f"Results written to {run_dir}")
+
+
+if __name__ == "__main__":
+    main()
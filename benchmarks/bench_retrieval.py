@@ -0,0 +1,238 @@
+"""Replay a fixed question set through retrieval and answering, with a local
+stand-in for the OpenAI API.
+
+Usage:
+    python benchmarks/bench_retrieval.py --questions questions.jsonl [--concurrency 4] [--k 5]
+        [--output benchmarks/results] [--baseline benchmarks/results/<run>/summary.json]
+
+Each line of the question file is a JSON object:
+    {"media_label": "LLM Agents Bootcamp", "question": "...",
+     "video": "optional video stem", "timestamps": [[start, end], ...]}
+where timestamps are the labeled answer segments in seconds.
+
+Every question goes through search_knowledge_base -> get_media_indices ->
+get_mm_llm_response, the same stages as a Knowledge Base chat turn, without
+the retrieval cache. Chat completions are served by benchmarks/openai_stub.py
+with a fixed time to first token, so the LLM stages measure our overhead and
+not the model. Embeddings are forwarded to the real API when OPENAI_API_KEY is
+set, otherwise hash embeddings are used and recall@k is meaningless.
+
+Writes summary.json (config, per-stage percentiles, throughput, recall@k, peak
+memory) and questions.jsonl (one row per question) to a run directory. With
+--baseline, stage p95s that regressed by more than --max-regression are
+reported and the exit status is 1.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from openai_stub import start_stub  # noqa: E402
+
+TRACE_APP = "bench"
+
+
+class NullContainer:
+    """Accepts the streamlit calls made on a response container and drops them"""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: None
+
+
+def load_questions(path):
+    with open(path) as f:
+        questions = [json.loads(line) for line in f if line.strip()]
+    for i, question in enumerate(questions):
+        question.setdefault("id", i)
+    return questions
+
+
+def overlaps(segment, labels, tolerance):
+    start, end = segment[0], segment[-1]
+    return any(start <= label_end + tolerance and end >= label_start - tolerance
+               for label_start, label_end in labels)
+
+
+def first_hit(text_results, question, tolerance):
+    """1-based rank of the first result overlapping a labeled segment, or None"""
+    for rank, doc in enumerate(text_results, 1):
+        if question.get("video") and Path(doc["file_path"]).parent.name != question["video"]:
+            continue
+        if any(overlaps(segment, question["timestamps"], tolerance) for segment in doc["timestamps"]):
+            return rank
+    return None
+
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+async def ask(question, knowledge_base, registry, tracer, executor, args):
+    from video_index.rags.text_rag import search_knowledge_base, get_media_indices, get_mm_llm_response
+
+    loop = asyncio.get_running_loop()
+    media_label = question["media_label"]
+    turn = tracer.start_turn(TRACE_APP, "bench", media_label)
+    indexes = {media_label: await registry.aget(media_label, knowledge_base.get(media_label, {}).get("index_version"))}
+    img_docs, text_docs = await loop.run_in_executor(
+        executor, turn.traced("search", search_knowledge_base), question["question"], media_label, indexes)
+    media_future = loop.run_in_executor(
+        executor, turn.traced("media_lookup", get_media_indices),
+        question["question"], text_docs, img_docs, media_label, indexes)
+    with turn.span("llm"):
+        response_text, _ = await get_mm_llm_response(
+            question["question"], text_docs, img_docs, media_label, indexes,
+            turn.first_token_probe(NullContainer(), "llm_first_token"))
+    _, text_results = await media_future
+    turn.end()
+    rank = first_hit(text_results or [], question, args.tolerance)
+    return {"id": question["id"], "media_label": media_label, "question": question["question"],
+            "rank": rank, "hit": rank is not None and rank <= args.k,
+            "results": len(text_results or []), "answer_chars": len(response_text or ""),
+            "spans": {span["stage"]: span["seconds"] for span in tracer.recent_spans(turn.turn_id)}}
+
+
+async def run(questions, args, tracer):
+    from index_registry import get_index_registry
+    from recall_utils import load_state
+    from constants import KNOWLEDGE_BASE_PATH
+
+    knowledge_base = load_state(KNOWLEDGE_BASE_PATH)
+    registry = get_index_registry()
+    # Index loading is a one-off cost, keep it out of the per-question numbers
+    load_start = time.perf_counter()
+    await asyncio.gather(*(registry.aget(label, knowledge_base.get(label, {}).get("index_version"))
+                           for label in {q["media_label"] for q in questions}))
+    index_load = time.perf_counter() - load_start
+
+    executor = ThreadPoolExecutor(max_workers=args.concurrency * 2, thread_name_prefix="bench")
+    semaphore = asyncio.Semaphore(args.concurrency)
+    rows = []
+
+    async def bounded(question):
+        async with semaphore:
+            try:
+                rows.append(await ask(question, knowledge_base, registry, tracer, executor, args))
+            except Exception as e:
+                print(f"Question {question['id']} failed: {e}")
+                rows.append({"id": question["id"], "media_label": question["media_label"],
+                             "question": question["question"], "error": str(e)})
+
+    start = time.perf_counter()
+    await asyncio.gather(*(bounded(question) for _ in range(args.repeat) for question in questions))
+    elapsed = time.perf_counter() - start
+    executor.shutdown()
+    return rows, elapsed, index_load
+
+
+def summarize(rows, elapsed, index_load, tracer, stub_config, args):
+    answered = [row for row in rows if "error" not in row]
+    ranks = [row["rank"] for row in answered]
+    return {
+        "revision": git_revision(),
+        "created_at": time.time(),
+        "config": {"questions": args.questions, "k": args.k, "concurrency": args.concurrency,
+                   "repeat": args.repeat, "tolerance": args.tolerance, "stub_ttft": args.ttft,
+                   "stub_tokens_per_second": args.tokens_per_second,
+                   "real_embeddings": bool(stub_config.upstream_key)},
+        "questions": len(rows),
+        "errors": len(rows) - len(answered),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_qps": round(len(answered) / elapsed, 3) if elapsed else None,
+        "index_load_seconds": round(index_load, 3),
+        f"recall_at_{args.k}": round(sum(row["hit"] for row in answered) / len(answered), 4) if answered else None,
+        "mrr": round(sum(1 / rank for rank in ranks if rank) / len(answered), 4) if answered else None,
+        "stages": {stage: stats for (_, stage), stats in sorted(tracer.percentiles(TRACE_APP).items())},
+        "peak_rss_mb": round(peak_rss_mb(), 1),
+        "stub_requests": stub_config.requests,
+    }
+
+
+def compare(summary, baseline, max_regression):
+    """Stages whose p95 grew by more than max_regression, as printable lines"""
+    regressions = []
+    for stage, stats in summary["stages"].items():
+        before = baseline.get("stages", {}).get(stage, {}).get("p95")
+        if before and stats["p95"] > before * (1 + max_regression):
+            regressions.append(f"{stage} p95 {before:.3f}s -> {stats['p95']:.3f}s")
+    recall_key = f"recall_at_{summary['config']['k']}"
+    if baseline.get(recall_key) is not None and summary[recall_key] is not None \
+            and summary[recall_key] < baseline[recall_key]:
+        regressions.append(f"{recall_key} {baseline[recall_key]} -> {summary[recall_key]}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--questions", required=True, help="JSONL question set")
+    parser.add_argument("--k", type=int, default=5, help="cutoff for recall@k")
+    parser.add_argument("--tolerance", type=float, default=5.0, help="seconds of slack when matching timestamps")
+    parser.add_argument("--concurrency", type=int, default=1, help="questions in flight at once")
+    parser.add_argument("--repeat", type=int, default=1, help="times each question is asked")
+    parser.add_argument("--ttft", type=float, default=0.3, help="stub seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--output", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "results"))
+    parser.add_argument("--baseline", help="summary.json of an earlier run to compare with")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed relative p95 growth")
+    args = parser.parse_args()
+
+    questions = load_questions(args.questions)
+    _, stub_config, base_url = start_stub(ttft=args.ttft, tokens_per_second=args.tokens_per_second,
+                                          upstream_key=os.getenv("OPENAI_API_KEY"))
+    if not stub_config.upstream_key:
+        print("OPENAI_API_KEY is not set, using hash embeddings: recall@k will not be meaningful")
+    # Must be set before video_index creates its OpenAI clients
+    os.environ["OPENAI_BASE_URL"] = os.environ["OPENAI_API_BASE"] = base_url
+    os.environ["OPENAI_API_KEY"] = "stub"
+
+    from tracing import Tracer
+    run_dir = os.path.join(args.output, time.strftime("%Y%m%d-%H%M%S"))
+    os.makedirs(run_dir, exist_ok=True)
+    tracer = Tracer(window=len(questions) * args.repeat, log_path=os.path.join(run_dir, "spans.jsonl"),
+                    metrics_port=0)
+    rows, elapsed, index_load = asyncio.run(run(questions, args, tracer))
+    summary = summarize(rows, elapsed, index_load, tracer, stub_config, args)
+
+    with open(os.path.join(run_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    with open(os.path.join(run_dir, "questions.jsonl"), "w") as f:
+        for row in sorted(rows, key=lambda row: row["id"]):
+            f.write(json.dumps(row) + "\n")
+
+    print(f"{summary['questions']} questions in {summary['elapsed_seconds']}s "
+          f"({summary['throughput_qps']} q/s), {summary['errors']} errors, "
+          f"recall@{args.k} {summary[f'recall_at_{args.k}']}, peak RSS {summary['peak_rss_mb']} MB")
+    for stage, stats in summary["stages"].items():
+        print(f"{stage:<16} p50 {stats['p50']:7.3f}s   p95 {stats['p95']:7.3f}s   p99 {stats['p99']:7.3f}s")
+    print(f"Results written to {run_dir}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(summary, json.load(f), args.max_regression)
+        for line in regressions:
+            print(f"Regression: {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Compare the moviepy re-encode path of generate_videoclips with the stream copy path.
+
+Usage:
+    python benchmarks/bench_videoclips.py [--video path.mp4] [--clips 3] [--clip-length 30] [--concat]
+
+Without --video a synthetic 1280x720 h264/aac source is generated first.
+"""
+import argparse
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from clip_cache import get_clip_cache  # noqa: E402
+from fast_clips import FFMPEG_BINARY  # noqa: E402
+from recall_utils import generate_videoclips  # noqa: E402
+
+
+def make_source(path, duration):
+    cmd = [FFMPEG_BINARY, "-v", "error", "-y",
+           "-f", "lavfi", "-i", "testsrc2=size=1280x720:rate=30",
+           "-f", "lavfi", "-i", "sine=frequency=440:sample_rate=44100",
+           "-t", str(duration), "-c:v", "libx264", "-g", "150", "-pix_fmt", "yuv420p", "-c:a", "aac", path]
+    subprocess.run(cmd, check=True)
+
+
+def cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+def run(label, out_dir, video_data, concat, fast):
+    wall_start, cpu_start = time.perf_counter(), cpu_seconds()
+    _, clip_paths = generate_videoclips(out_dir, video_data, concat=concat, fast=fast)
+    wall, cpu = time.perf_counter() - wall_start, cpu_seconds() - cpu_start
+    size = sum(os.path.getsize(p) for p in clip_paths)
+    print(f"{label:<12} wall {wall:7.2f}s   cpu {cpu:7.2f}s   output {size / 1e6:7.1f} MB")
+    return wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--video", help="source mp4, a synthetic one is generated when omitted")
+    parser.add_argument("--duration", type=int, default=600, help="length of the synthetic source in seconds")
+    parser.add_argument("--clips", type=int, default=3)
+    parser.add_argument("--clip-length", type=float, default=30)
+    parser.add_argument("--concat", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        video = args.video
+        if not video:
+            video = os.path.join(tmp, "source.mp4")
+            print(f"Generating a {args.duration}s synthetic source...")
+            make_source(video, args.duration)
+            duration = args.duration
+        else:
+            duration = ffmpeg_parse_infos(video)["duration"]
+
+        rng = random.Random(args.seed)
+        video_data = []
+        for _ in range(args.clips):
+            start = rng.uniform(0, max(duration - args.clip_length, 0))
+            video_data.append({'video_file': video, 'timestamps': [round(start, 3), round(start + args.clip_length, 3)]})
+        print(f"{args.clips} clip(s) of {args.clip_length}s, concat={args.concat}")
+
+        moviepy_wall = run("moviepy", tmp, video_data, args.concat, fast=False)
+        fast_wall = run("stream copy", tmp, video_data, args.concat, fast=True)
+        print(f"speedup      {moviepy_wall / fast_wall:.1f}x")
+        run("cached", tmp, video_data, args.concat, fast=True)
+        print(f"clip cache   {get_clip_cache(tmp).stats()}")
+
+
+if __name__ == "__main__":
+    main()
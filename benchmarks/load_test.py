@@ -0,0 +1,424 @@
+"""Ramp up concurrent simulated users against the Knowledge Base page or the
+Immersive Mode app, with local stand-ins for the LLM, TTS and realtime API.
+
+Usage:
+    python benchmarks/load_test.py --app streamlit [--users 1,2,4,8,16] [--turns 3]
+        [--questions questions.jsonl] [--voice-share 0.3] [--audio speech.wav]
+    python benchmarks/load_test.py --app chainlit [--users 1,2,4,8] ...
+
+The apps run in this process, as they would in one server process:
+pages/1_Knowledge_Base.py through streamlit's AppTest, one per session, and
+immersive_chainlit.py through its chainlit handlers, one chat context per
+session. openai_stub.py and realtime_stub.py run as subprocesses so their CPU
+is not counted. Each user picks an event, asks questions with a think time in
+between and, for a --voice-share of the turns, speaks: the recording goes
+through the shared speech-to-text service on the Knowledge Base page (the
+question text is still sent, and the answer is spoken) and is streamed to the
+realtime stub in Immersive Mode.
+
+Every step reports p50/p99 turn latency, error rate, CPU use and RSS growth,
+plus the apps' own stage percentiles from their trace spans. The ramp stops
+after the first step over --slo or --max-error-rate. Results go to
+benchmarks/results/load-<time>/. Chat turns are saved to the chat store like
+any other session, so run it against a staging copy of the data.
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import threading
+import time
+import wave
+from contextlib import contextmanager
+from types import SimpleNamespace
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from bench_retrieval import git_revision, load_questions  # noqa: E402
+from realtime_stub import SAMPLE_RATE, tone  # noqa: E402
+
+KNOWLEDGE_BASE_PAGE = os.path.join(REPO_DIR, "pages", "1_Knowledge_Base.py")
+SERVER_APPS = {"streamlit": "knowledge_base", "chainlit": "immersive"}
+FRAME_MS = 100
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_stub(script, port, extra_args, env=None):
+    process = subprocess.Popen([sys.executable, os.path.join(BENCH_DIR, script), "--port", str(port), *extra_args],
+                               env=env, stdout=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"{script} exited with {process.returncode}")
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError(f"{script} did not start listening on {port}")
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        # Peak instead of current RSS where /proc is not available
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+def cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def read_pcm16(path):
+    """Mono pcm16 samples of a wav file, which must already be at the realtime sample rate"""
+    with wave.open(path) as wav:
+        if wav.getnchannels() != 1 or wav.getsampwidth() != 2 or wav.getframerate() != SAMPLE_RATE:
+            raise ValueError(f"{path} must be mono 16-bit {SAMPLE_RATE} Hz audio")
+        return wav.readframes(wav.getnframes())
+
+
+def as_wav(pcm):
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(SAMPLE_RATE)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+
+def default_questions(knowledge_base):
+    return [{"media_label": label, "question": question}
+            for label in knowledge_base
+            for question in (f"What are the key takeaways from {label}?",
+                             f"Who were the speakers at {label} and what did they talk about?")]
+
+
+# Knowledge Base page
+
+def streamlit_user(user, users, args, questions, speech, records):
+    from streamlit.testing.v1 import AppTest
+    from stt_service import get_stt_service
+
+    rng = random.Random(args.seed * 1000 + user)
+    at = AppTest.from_file(KNOWLEDGE_BASE_PAGE, default_timeout=args.timeout)
+    try:
+        at.run()
+        media_label = rng.choice(sorted({q["media_label"] for q in questions}))
+        # The event may be on a later page of the grid, so search for it first
+        at.text_input[0].input(media_label).run()
+        at.button(key=media_label).click().run()
+    except Exception as e:
+        records.append({"users": users, "user": user, "voice": False, "seconds": None,
+                        "error": f"session setup: {e}"})
+        return
+    asked = [q for q in questions if q["media_label"] == media_label]
+    for _ in range(args.turns):
+        voice = rng.random() < args.voice_share
+        record = {"users": users, "user": user, "voice": voice, "media_label": media_label}
+        start = time.perf_counter()
+        try:
+            if voice:
+                get_stt_service().transcribe(speech)
+                at.session_state["recording"] = True
+            at.chat_input[0].set_value(rng.choice(asked)["question"]).run()
+            if at.exception:
+                raise RuntimeError(at.exception[0].value)
+        except Exception as e:
+            record["error"] = str(e)
+        record["seconds"] = round(time.perf_counter() - start, 4)
+        records.append(record)
+        time.sleep(args.think * rng.uniform(0.5, 1.5))
+
+
+def run_streamlit(args, questions, speech, ramp):
+    speech = as_wav(speech)
+    for users in args.users:
+        with ramp.step(users) as records:
+            threads = [threading.Thread(target=streamlit_user, args=(user, users, args, questions, speech, records),
+                                        name=f"user-{user}") for user in range(users)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+
+# Immersive Mode
+
+def recording_emitter(session):
+    from chainlit.emitter import BaseChainlitEmitter
+
+    class RecordingEmitter(BaseChainlitEmitter):
+        """Keeps the arrival time and size of every audio frame sent to the browser"""
+
+        def __init__(self, session):
+            super().__init__(session)
+            self.audio_frames = []  # (perf_counter, bytes)
+
+        async def send_audio_chunk(self, chunk):
+            self.audio_frames.append((time.perf_counter(), len(chunk.data)))
+
+    return RecordingEmitter(session)
+
+
+async def stream_audio(app, pcm, elapsed):
+    import chainlit as cl
+
+    frame_bytes = SAMPLE_RATE * 2 * FRAME_MS // 1000
+    for offset in range(0, len(pcm), frame_bytes):
+        await app.on_audio_chunk(cl.InputAudioChunk(isStart=elapsed[0] == 0, mimeType="pcm16",
+                                                    elapsedTime=elapsed[0], data=pcm[offset:offset + frame_bytes]))
+        elapsed[0] += FRAME_MS
+        await asyncio.sleep(FRAME_MS / 1000)
+
+
+async def keep_mic_open(app, elapsed):
+    # A real microphone keeps sending silence between questions
+    silence = bytes(SAMPLE_RATE * 2 * FRAME_MS // 1000)
+    while True:
+        await stream_audio(app, silence, elapsed)
+
+
+async def wait_for_answer(emitter, since, timeout, settle):
+    """(first audio, last audio) seconds after since, once the answer has gone quiet for settle seconds"""
+    deadline = since + timeout
+    while time.perf_counter() < deadline:
+        times = [t for t, _ in emitter.audio_frames if t >= since]
+        if times and time.perf_counter() - times[-1] >= settle:
+            return times[0] - since, times[-1] - since
+        await asyncio.sleep(0.02)
+    raise TimeoutError(f"no complete answer within {timeout}s")
+
+
+async def chainlit_user(app, user, users, args, questions, speech, records):
+    from chainlit.context import init_http_context
+
+    rng = random.Random(args.seed * 1000 + user)
+    context = init_http_context()
+    emitter = context.emitter = recording_emitter(context.session)
+    elapsed = [0]
+    mic = None
+    try:
+        await app.start()
+        for _ in range(args.turns):
+            voice = rng.random() < args.voice_share
+            record = {"users": users, "user": user, "voice": voice}
+            try:
+                if voice:
+                    if mic is None:
+                        if not await app.on_audio_start():
+                            raise RuntimeError("could not connect to the realtime API")
+                    else:
+                        mic.cancel()
+                        await asyncio.gather(mic, return_exceptions=True)
+                    await stream_audio(app, speech, elapsed)
+                    since = time.perf_counter()
+                    mic = asyncio.create_task(keep_mic_open(app, elapsed))
+                else:
+                    since = time.perf_counter()
+                    await app.on_message(SimpleNamespace(content=rng.choice(questions)["question"],
+                                                         elements=[]))
+                first_audio, last_audio = await wait_for_answer(emitter, since, args.timeout, args.settle)
+                record.update(first_audio=round(first_audio, 4), seconds=round(last_audio, 4))
+            except Exception as e:
+                record.update(seconds=None, error=str(e) or type(e).__name__)
+            records.append(record)
+            await asyncio.sleep(args.think * rng.uniform(0.5, 1.5))
+    except Exception as e:
+        records.append({"users": users, "user": user, "voice": False, "seconds": None,
+                        "error": f"session setup: {e}"})
+    finally:
+        if mic:
+            mic.cancel()
+        await app.on_end()
+
+
+def run_chainlit(args, questions, speech, ramp):
+    import immersive_chainlit as app
+
+    # One event loop for the whole ramp, since pooled realtime sessions are bound to it
+    async def run_steps():
+        for users in args.users:
+            with ramp.step(users) as records:
+                await asyncio.gather(*(chainlit_user(app, user, users, args, questions, speech, records)
+                                       for user in range(users)))
+
+    asyncio.run(run_steps())
+
+
+# Reporting
+
+class StopRamp(Exception):
+    """Raised after a step over the latency or error budget"""
+
+
+class Ramp:
+    def __init__(self, server_app, spans_path, slo, max_error_rate):
+        self.server_app = server_app
+        self.spans_path = spans_path
+        self.slo = slo
+        self.max_error_rate = max_error_rate
+        self.steps = []
+        self.turns = []
+
+    @contextmanager
+    def step(self, users):
+        """Measure one step of the ramp; yields the list its turns are recorded in"""
+        records = []
+        ts, wall, cpu, rss = time.time(), time.perf_counter(), cpu_seconds(), current_rss_mb()
+        yield records
+        step = summarize_step(users, records, time.perf_counter() - wall, cpu_seconds() - cpu, rss,
+                              current_rss_mb(), read_spans(self.spans_path, ts, time.time()), self.server_app)
+        self.steps.append(step)
+        self.turns.extend(records)
+        print_step(step)
+        if not self.within_budget(step):
+            print(f"Stopping the ramp: over the {self.slo}s p99 or {self.max_error_rate:.0%} error budget")
+            raise StopRamp()
+
+    def within_budget(self, step):
+        p99 = step["turn_seconds"]["p99"]
+        return p99 is not None and p99 <= self.slo and step["error_rate"] <= self.max_error_rate
+
+
+def summarize_step(users, records, wall, cpu, rss_before, rss_after, spans, server_app):
+    from tracing import PERCENTILES, percentile
+
+    latencies = sorted(r["seconds"] for r in records if r.get("seconds") is not None and "error" not in r)
+    first_audio = sorted(r["first_audio"] for r in records if "first_audio" in r)
+    errors = [r for r in records if "error" in r]
+    stages = {}
+    for span in spans:
+        if span["app"] == server_app:
+            stages.setdefault(span["stage"], []).append(span["seconds"])
+    return {
+        "users": users,
+        "turns": len(records),
+        "errors": len(errors),
+        "error_rate": round(len(errors) / len(records), 4) if records else None,
+        "sample_errors": sorted({r["error"] for r in errors})[:5],
+        "turn_seconds": {f"p{pct}": percentile(latencies, pct) for pct in PERCENTILES},
+        "first_audio_seconds": {f"p{pct}": percentile(first_audio, pct) for pct in PERCENTILES},
+        "throughput_tps": round(len(latencies) / wall, 3) if wall else None,
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(cpu, 3),
+        "cpu_utilization": round(cpu / wall, 3) if wall else None,
+        "rss_mb_before": round(rss_before, 1),
+        "rss_mb_after": round(rss_after, 1),
+        "rss_mb_growth": round(rss_after - rss_before, 1),
+        "server_stages": {stage: {"count": len(values), **{f"p{pct}": percentile(sorted(values), pct)
+                                                           for pct in PERCENTILES}}
+                          for stage, values in sorted(stages.items())},
+    }
+
+
+def read_spans(path, start_ts, end_ts):
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        spans = [json.loads(line) for line in f if line.strip()]
+    return [span for span in spans if start_ts <= span["ts"] <= end_ts]
+
+
+def print_step(step):
+    p50, p99 = step["turn_seconds"]["p50"], step["turn_seconds"]["p99"]
+    latency = f"p50 {p50:6.2f}s  p99 {p99:6.2f}s" if p50 is not None else "no completed turns"
+    print(f"{step['users']:>4} users  {step['turns']:>4} turns  {latency}  errors {step['error_rate']:.1%}  "
+          f"cpu {step['cpu_utilization']:.2f}  rss {step['rss_mb_after']:.0f} MB ({step['rss_mb_growth']:+.0f})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=sorted(SERVER_APPS), required=True)
+    parser.add_argument("--users", default="1,2,4,8,16", help="comma separated concurrent users per step")
+    parser.add_argument("--turns", type=int, default=3, help="questions asked by each user")
+    parser.add_argument("--think", type=float, default=2.0, help="mean seconds between a user's questions")
+    parser.add_argument("--questions", help="JSONL question set, see bench_retrieval.py")
+    parser.add_argument("--voice-share", type=float, default=0.0, help="share of the turns that are spoken")
+    parser.add_argument("--audio", help=f"mono pcm16 {SAMPLE_RATE} Hz wav spoken on voice turns, a tone by default")
+    parser.add_argument("--timeout", type=float, default=120.0, help="seconds before a turn counts as failed")
+    parser.add_argument("--settle", type=float, default=0.5,
+                        help="quiet seconds after which a spoken answer is complete")
+    parser.add_argument("--slo", type=float, default=10.0, help="p99 turn seconds that end the ramp")
+    parser.add_argument("--max-error-rate", type=float, default=0.05)
+    parser.add_argument("--ttft", type=float, default=0.3, help="stand-in LLM seconds before the first token")
+    parser.add_argument("--first-audio-delay", type=float, default=0.4,
+                        help="stand-in realtime seconds before a response's audio")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=os.path.join(BENCH_DIR, "results"))
+    args = parser.parse_args()
+    args.users = [int(n) for n in args.users.split(",")]
+
+    os.chdir(REPO_DIR)
+    from dotenv import load_dotenv
+    load_dotenv()
+    run_dir = os.path.join(args.output, time.strftime("load-%Y%m%d-%H%M%S"))
+    os.makedirs(run_dir, exist_ok=True)
+    spans_path = os.path.join(run_dir, "spans.jsonl")
+
+    openai_port, realtime_port = free_port(), free_port()
+    stub_env = {**os.environ, "RECALL_STUB_UPSTREAM_KEY": os.getenv("OPENAI_API_KEY", "")}
+    stubs = [start_stub("openai_stub.py", openai_port, ["--ttft", str(args.ttft)], stub_env),
+             start_stub("realtime_stub.py", realtime_port, ["--first-audio-delay", str(args.first_audio_delay)])]
+    # Must be set before the apps create their clients and tracer
+    os.environ.update({"OPENAI_BASE_URL": f"http://127.0.0.1:{openai_port}/v1",
+                       "OPENAI_API_BASE": f"http://127.0.0.1:{openai_port}/v1",
+                       "OPENAI_API_KEY": "stub",
+                       "RECALL_REALTIME_URL": f"ws://127.0.0.1:{realtime_port}",
+                       "RECALL_TRACE_LOG_PATH": spans_path})
+
+    from recall_utils import load_state
+    from constants import KNOWLEDGE_BASE_PATH
+    questions = load_questions(args.questions) if args.questions else default_questions(load_state(KNOWLEDGE_BASE_PATH))
+    if args.app == "chainlit":
+        from constants import immersive_demo_labels
+        questions = [q for q in questions if q["media_label"] in immersive_demo_labels] or questions
+    speech = read_pcm16(args.audio) if args.audio else tone(2.0)
+
+    ramp = Ramp(SERVER_APPS[args.app], spans_path, args.slo, args.max_error_rate)
+    print(f"Ramping {args.app} through {args.users} users, {args.turns} turns each")
+    try:
+        if args.app == "streamlit":
+            run_streamlit(args, questions, speech, ramp)
+        else:
+            run_chainlit(args, questions, speech, ramp)
+    except StopRamp:
+        pass
+    finally:
+        for stub in stubs:
+            stub.terminate()
+
+    within = [step["users"] for step in ramp.steps if ramp.within_budget(step)]
+    summary = {"revision": git_revision(), "created_at": time.time(), "app": args.app,
+               "config": {key: value for key, value in vars(args).items() if key != "output"},
+               "max_users_within_slo": max(within, default=None), "steps": ramp.steps}
+    with open(os.path.join(run_dir, "summary.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+    with open(os.path.join(run_dir, "turns.jsonl"), "w") as f:
+        for record in ramp.turns:
+            f.write(json.dumps(record) + "\n")
+    print(f"Handled up to {summary['max_users_within_slo']} concurrent users within the SLO. "
+          f"Results written to {run_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,187 @@
+"""Local stand-in for the OpenAI API, for benchmarks that should not depend on
+the real model's latency or cost.
+
+Serves /v1/chat/completions (streamed or not) with a canned answer at a
+configurable time to first token and token rate, /v1/audio/speech with silent
+audio as long as the text would take to say, and /v1/embeddings. Embedding
+requests are forwarded to the real API when an upstream key is given, since
+the event indexes were built with real embeddings; otherwise deterministic
+hash embeddings are returned, which only exercise the plumbing.
+
+Usage:
+    python benchmarks/openai_stub.py --port 8765 [--ttft 0.3] [--tokens-per-second 60] [--tts-delay 0.3]
+"""
+import argparse
+import hashlib
+import io
+import json
+import math
+import os
+import threading
+import time
+import urllib.request
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = ("Based on the event recording, the speakers covered this topic in detail. "
+          "They described the main idea, gave an example from their own work, "
+          "and closed with the trade-offs they saw in practice.")
+EMBEDDING_DIMENSIONS = 1536
+SPEECH_WORDS_PER_SECOND = 2.5
+SPEECH_SAMPLE_RATE = 24000
+
+
+def hash_embedding(text, dimensions=EMBEDDING_DIMENSIONS):
+    """Deterministic unit vector for a text"""
+    values = []
+    counter = 0
+    while len(values) < dimensions:
+        digest = hashlib.sha256(f"{counter}:{text}".encode()).digest()
+        values.extend(byte / 127.5 - 1 for byte in digest)
+        counter += 1
+    values = values[:dimensions]
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+class StubConfig:
+    def __init__(self, ttft=0.3, tokens_per_second=60.0, tts_delay=0.3, upstream_key=None,
+                 upstream_url="https://api.openai.com/v1"):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.tts_delay = tts_delay
+        self.upstream_key = upstream_key
+        self.upstream_url = upstream_url
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+def make_handler(config):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, format, *args):
+            pass
+
+        def _json(self, status, body):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            with config.lock:
+                config.requests += 1
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if self.path.endswith("/chat/completions"):
+                self._chat(body)
+            elif self.path.endswith("/embeddings"):
+                self._embeddings(body)
+            elif self.path.endswith("/audio/speech"):
+                self._speech(body)
+            else:
+                self._json(404, {"error": {"message": f"{self.path} is not served by the stub"}})
+
+        def _chat(self, body):
+            model = body.get("model", "stub")
+            tokens = [word + " " for word in ANSWER.split()]
+            time.sleep(config.ttft)
+            if not body.get("stream"):
+                time.sleep(len(tokens) / config.tokens_per_second)
+                self._json(200, {
+                    "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()), "model": model,
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": ANSWER}}],
+                    "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+                })
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i, token in enumerate(tokens + [None]):
+                delta = {"content": token} if token is not None else {}
+                if i == 0:
+                    delta["role"] = "assistant"
+                chunk = {"id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+                         "model": model, "choices": [{"index": 0, "delta": delta,
+                                                      "finish_reason": None if token is not None else "stop"}]}
+                self._chunk(f"data: {json.dumps(chunk)}\n\n")
+                if token is not None:
+                    time.sleep(1 / config.tokens_per_second)
+            self._chunk("data: [DONE]\n\n")
+            self._chunk("")
+
+        def _chunk(self, text):
+            data = text.encode()
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        def _speech(self, body):
+            time.sleep(config.tts_delay)
+            seconds = max(len(body.get("input", "").split()) / SPEECH_WORDS_PER_SECOND, 0.1)
+            buffer = io.BytesIO()
+            with wave.open(buffer, "wb") as wav:
+                wav.setnchannels(1)
+                wav.setsampwidth(2)
+                wav.setframerate(SPEECH_SAMPLE_RATE)
+                wav.writeframes(b"\0" * 2 * int(seconds * SPEECH_SAMPLE_RATE))
+            data = buffer.getvalue()
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/wav")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def _embeddings(self, body):
+            if config.upstream_key:
+                request = urllib.request.Request(
+                    f"{config.upstream_url}/embeddings", data=json.dumps(body).encode(),
+                    headers={"Authorization": f"Bearer {config.upstream_key}", "Content-Type": "application/json"})
+                with urllib.request.urlopen(request, timeout=60) as response:
+                    self._json(response.status, json.loads(response.read()))
+                return
+            inputs = body.get("input", [])
+            if isinstance(inputs, str):
+                inputs = [inputs]
+            self._json(200, {
+                "object": "list", "model": body.get("model", "stub"),
+                "data": [{"object": "embedding", "index": i, "embedding": hash_embedding(str(text))}
+                         for i, text in enumerate(inputs)],
+                "usage": {"prompt_tokens": 0, "total_tokens": 0},
+            })
+
+    return Handler
+
+
+def start_stub(port=0, **config_kwargs):
+    """Serve the stub on a background thread; returns (server, config, base_url)"""
+    config = StubConfig(**config_kwargs)
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(config))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="openai-stub", daemon=True).start()
+    return server, config, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=60.0)
+    parser.add_argument("--tts-delay", type=float, default=0.3, help="seconds before speech audio is returned")
+    parser.add_argument("--upstream-key", default=os.getenv("RECALL_STUB_UPSTREAM_KEY"),
+                        help="forward embedding requests to the real API with this key")
+    args = parser.parse_args()
+    server, _, base_url = start_stub(args.port, ttft=args.ttft, tokens_per_second=args.tokens_per_second,
+                                     tts_delay=args.tts_delay, upstream_key=args.upstream_key)
+    print(f"OpenAI stub listening on {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
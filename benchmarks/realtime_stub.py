@@ -0,0 +1,267 @@
+"""Local stand-in for the OpenAI Realtime API websocket, for load and latency
+tests of Immersive Mode.
+
+Speaks enough of the realtime protocol for RealtimeClient: session updates,
+input audio with a simple energy based server VAD, conversation items,
+responses and function calls. Every response is a tone streamed as pcm16 audio
+deltas at real time pace, after a configurable delay.
+
+With --script, responses follow a JSON list of entries, used in turn:
+    [{"first_audio_delay": 0.4, "response_seconds": 2, "chunk_jitter_ms": 30},
+     {"first_audio_delay": 0.2, "tool_call": {"name": "...", "arguments": {...}}}]
+An entry with a tool_call answers with that function call first, and speaks
+once the client has sent the call's output. Tool round trips are written to
+--log as JSONL.
+
+Usage:
+    python benchmarks/realtime_stub.py --port 8766 [--first-audio-delay 0.4] [--response-seconds 2]
+        [--script script.json] [--log events.jsonl]
+
+Point the app at it with RECALL_REALTIME_URL=ws://127.0.0.1:8766.
+"""
+import argparse
+import asyncio
+import base64
+import itertools
+import json
+import math
+import random
+import struct
+import time
+
+import websockets
+
+SAMPLE_RATE = 24000
+_ids = itertools.count(1)
+
+
+def new_id(prefix):
+    return f"{prefix}_stub{next(_ids)}"
+
+
+def tone(seconds, frequency=220.0, amplitude=8000, sample_rate=SAMPLE_RATE):
+    """pcm16 mono sine wave"""
+    count = int(seconds * sample_rate)
+    return struct.pack(f"<{count}h", *(int(amplitude * math.sin(2 * math.pi * frequency * i / sample_rate))
+                                       for i in range(count)))
+
+
+def rms(pcm):
+    count = len(pcm) // 2
+    if not count:
+        return 0.0
+    samples = struct.unpack(f"<{count}h", pcm[:count * 2])
+    return math.sqrt(sum(s * s for s in samples) / count)
+
+
+class StubConfig:
+    def __init__(self, first_audio_delay=0.4, response_seconds=2.0, chunk_ms=100,
+                 vad_threshold=500.0, vad_silence_ms=500, script=None, log_path=None):
+        self.first_audio_delay = first_audio_delay
+        self.response_seconds = response_seconds
+        self.chunk_ms = chunk_ms
+        self.vad_threshold = vad_threshold
+        self.vad_silence_ms = vad_silence_ms
+        self.script = script or []
+        self.log_path = log_path
+        self.connections = 0
+        self.responses = 0
+
+    def log(self, event, **fields):
+        if self.log_path:
+            with open(self.log_path, "a") as f:
+                f.write(json.dumps({"event": event, "ts": time.time(), **fields}) + "\n")
+
+
+class Connection:
+    """Protocol state of one client websocket"""
+
+    def __init__(self, websocket, config):
+        self.websocket = websocket
+        self.config = config
+        self.session = {"id": new_id("sess"), "object": "realtime.session", "modalities": ["text", "audio"],
+                        "turn_detection": {"type": "server_vad"}, "tools": []}
+        self.last_item_id = None
+        self.response_task = None
+        self.audio_ms = 0.0
+        self.speech_item_id = None
+        self.silence_ms = 0.0
+        self.script_position = 0
+        self.pending_calls = {}  # call_id -> (name, sent at)
+        self.follow_up = None
+
+    async def send(self, event_type, **fields):
+        await self.websocket.send(json.dumps({"event_id": new_id("event"), "type": event_type, **fields}))
+
+    async def serve(self):
+        await self.send("session.created", session=self.session)
+        try:
+            async for raw in self.websocket:
+                event = json.loads(raw)
+                handler = getattr(self, "on_" + event["type"].replace(".", "_"), None)
+                if handler:
+                    await handler(event)
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            if self.response_task:
+                self.response_task.cancel()
+
+    async def on_session_update(self, event):
+        self.session.update(event.get("session", {}))
+        await self.send("session.updated", session=self.session)
+
+    async def on_conversation_item_create(self, event):
+        item = {"id": new_id("item"), "object": "realtime.item", "status": "completed", **event["item"]}
+        if item.get("type") == "function_call_output" and item.get("call_id") in self.pending_calls:
+            name, sent = self.pending_calls.pop(item["call_id"])
+            self.config.log("tool_round_trip", name=name, seconds=round(time.perf_counter() - sent, 4))
+        await self.add_item(item)
+
+    async def add_item(self, item):
+        await self.send("conversation.item.created", previous_item_id=self.last_item_id, item=item)
+        self.last_item_id = item["id"]
+
+    async def on_response_create(self, event):
+        self.start_response()
+
+    async def on_response_cancel(self, event):
+        if self.response_task:
+            self.response_task.cancel()
+
+    async def on_input_audio_buffer_append(self, event):
+        pcm = base64.b64decode(event["audio"])
+        chunk_ms = 1000 * len(pcm) / 2 / SAMPLE_RATE
+        self.audio_ms += chunk_ms
+        if (self.session.get("turn_detection") or {}).get("type") != "server_vad":
+            return
+        if rms(pcm) >= self.config.vad_threshold:
+            self.silence_ms = 0.0
+            if self.speech_item_id is None:
+                self.speech_item_id = new_id("item")
+                await self.send("input_audio_buffer.speech_started", audio_start_ms=int(self.audio_ms - chunk_ms),
+                                item_id=self.speech_item_id)
+                if self.response_task and not self.response_task.done():
+                    self.response_task.cancel()
+        elif self.speech_item_id is not None:
+            self.silence_ms += chunk_ms
+            if self.silence_ms >= self.config.vad_silence_ms:
+                await self.end_speech()
+
+    async def end_speech(self):
+        item_id, self.speech_item_id = self.speech_item_id, None
+        await self.send("input_audio_buffer.speech_stopped", audio_end_ms=int(self.audio_ms), item_id=item_id)
+        await self.send("input_audio_buffer.committed", previous_item_id=self.last_item_id, item_id=item_id)
+        await self.add_item({"id": item_id, "object": "realtime.item", "type": "message", "status": "completed",
+                             "role": "user", "content": [{"type": "input_audio", "transcript": None}]})
+        self.start_response()
+
+    def start_response(self):
+        if self.response_task and not self.response_task.done():
+            self.response_task.cancel()
+        self.response_task = asyncio.create_task(self.respond())
+
+    def next_entry(self):
+        if not self.config.script:
+            return {}
+        entry = self.config.script[self.script_position % len(self.config.script)]
+        self.script_position += 1
+        return entry
+
+    async def respond(self):
+        self.config.responses += 1
+        # The response after a function call output speaks the answer of the same entry
+        if self.follow_up is not None:
+            entry, self.follow_up = self.follow_up, None
+        else:
+            entry = self.next_entry()
+        response_id = new_id("resp")
+        await self.send("response.created", response={"id": response_id, "object": "realtime.response",
+                                                      "status": "in_progress", "output": []})
+        await asyncio.sleep(entry.get("first_audio_delay", self.config.first_audio_delay))
+        if entry.get("tool_call"):
+            self.follow_up = {key: value for key, value in entry.items() if key != "tool_call"}
+            await self.call_tool(response_id, entry["tool_call"])
+        else:
+            await self.stream_audio(response_id, entry.get("response_seconds", self.config.response_seconds),
+                                    entry.get("chunk_jitter_ms", 0))
+
+    async def call_tool(self, response_id, tool_call):
+        arguments = json.dumps(tool_call.get("arguments", {}))
+        item = {"id": new_id("item"), "object": "realtime.item", "type": "function_call", "status": "in_progress",
+                "name": tool_call["name"], "call_id": new_id("call"), "arguments": ""}
+        where = {"response_id": response_id, "item_id": item["id"], "output_index": 0, "call_id": item["call_id"]}
+        await self.send("response.output_item.added", response_id=response_id, output_index=0, item=item)
+        await self.add_item(item)
+        await self.send("response.function_call_arguments.delta", **where, delta=arguments)
+        await self.send("response.function_call_arguments.done", **where, arguments=arguments)
+        item.update(status="completed", arguments=arguments)
+        self.pending_calls[item["call_id"]] = (item["name"], time.perf_counter())
+        await self.send("response.output_item.done", response_id=response_id, output_index=0, item=item)
+        await self.send("response.done", response={"id": response_id, "object": "realtime.response",
+                                                   "status": "completed", "output": [item]})
+
+    async def stream_audio(self, response_id, seconds, jitter_ms=0):
+        item = {"id": new_id("item"), "object": "realtime.item", "type": "message", "status": "in_progress",
+                "role": "assistant", "content": []}
+        where = {"response_id": response_id, "item_id": item["id"], "output_index": 0}
+        await self.send("response.output_item.added", response_id=response_id, output_index=0, item=item)
+        await self.add_item(item)
+        await self.send("response.content_part.added", **where, content_index=0,
+                        part={"type": "audio", "transcript": ""})
+        transcript = "This is a stand-in answer from the load test server."
+        await self.send("response.audio_transcript.delta", **where, content_index=0, delta=transcript)
+        chunk_seconds = self.config.chunk_ms / 1000
+        chunk = base64.b64encode(tone(chunk_seconds)).decode()
+        start = time.perf_counter()
+        for i in range(max(1, round(seconds / chunk_seconds))):
+            await self.send("response.audio.delta", **where, content_index=0, delta=chunk)
+            # Chunks keep real time pace on average, each delayed by up to jitter_ms
+            due = start + (i + 1) * chunk_seconds + random.uniform(0, jitter_ms / 1000)
+            await asyncio.sleep(max(0.0, due - time.perf_counter()))
+        await self.send("response.audio.done", **where, content_index=0)
+        await self.send("response.audio_transcript.done", **where, content_index=0, transcript=transcript)
+        content = [{"type": "audio", "transcript": transcript}]
+        await self.send("response.content_part.done", **where, content_index=0, part=content[0])
+        item.update(status="completed", content=content)
+        await self.send("response.output_item.done", response_id=response_id, output_index=0, item=item)
+        await self.send("response.done", response={"id": response_id, "object": "realtime.response",
+                                                   "status": "completed", "output": [item]})
+
+
+async def serve(port, config, ready=None):
+    async def handler(websocket, path=None):
+        config.connections += 1
+        await Connection(websocket, config).serve()
+
+    async with websockets.serve(handler, "127.0.0.1", port, max_size=None) as server:
+        port = server.sockets[0].getsockname()[1]
+        print(f"Realtime stub listening on ws://127.0.0.1:{port}")
+        if ready:
+            ready(port)
+        await asyncio.Future()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--first-audio-delay", type=float, default=0.4, help="seconds before a response's audio")
+    parser.add_argument("--response-seconds", type=float, default=2.0, help="length of each spoken response")
+    parser.add_argument("--vad-silence-ms", type=int, default=500, help="silence that ends the user's speech")
+    parser.add_argument("--script", help="JSON list of scripted responses")
+    parser.add_argument("--log", help="JSONL file for tool round trips")
+    args = parser.parse_args()
+    script = None
+    if args.script:
+        with open(args.script) as f:
+            script = json.load(f)
+    config = StubConfig(first_audio_delay=args.first_audio_delay, response_seconds=args.response_seconds,
+                        vad_silence_ms=args.vad_silence_ms, script=script, log_path=args.log)
+    try:
+        asyncio.run(serve(args.port, config))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+import threading
+from functools import lru_cache
+
+from chat_store import conversation_generation, load_messages, load_summary, save_summary
+from constants import CONTEXT_TOKEN_BUDGET, CONTEXT_SUMMARY_MODEL, CONTEXT_TOKENIZER_MODEL
+
+# Token-budgeted LLM context for a chat session: the system prompt, a rolling
+# summary of older turns and as many recent turns as fit in the budget.
+# Turns that fall out of the window are folded into the summary in the
+# background, so building the context never waits for the summarizer; until
+# the summary covers them, older turns that still fit are sent verbatim.
+
+# Per-message overhead of the chat format
+MESSAGE_OVERHEAD_TOKENS = 4
+SUMMARY_PREFIX = "Summary of the earlier conversation: "
+
+try:
+    import tiktoken
+    try:
+        _encoding = tiktoken.encoding_for_model(CONTEXT_TOKENIZER_MODEL)
+    except KeyError:
+        _encoding = tiktoken.get_encoding("cl100k_base")
+except ImportError:
+    _encoding = None
+
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+
+@lru_cache(maxsize=4096)
+def count_tokens(text):
+    if _encoding is None:
+        # Roughly four characters per token for English
+        return len(text) // 4 + 1
+    return len(_encoding.encode(text, disallowed_special=()))
+
+
+def message_tokens(message):
+    return count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+
+
+def build_context(session_id, budget=CONTEXT_TOKEN_BUDGET):
+    """Return (messages, report) for the session within the token budget.
+
+    report holds the tokens sent, the turns kept and the last message seq that
+    fell out of the window, which summarize_in_background folds into the summary.
+    """
+    # Read first, so a clear after this point makes the summary of this context stale
+    generation = conversation_generation(session_id)
+    turns = {}
+    for seq, turn, message in load_messages(session_id):
+        # Image and video entries only hold file paths for the page
+        if not (message.get("is_image") or message.get("is_video")):
+            turns.setdefault(turn, []).append((seq, message))
+    # Turn 0 holds the system prompt and greeting of the chat
+    head = [message for _, message in turns.pop(0, [])]
+    through_seq, summary = load_summary(session_id)
+    summary_messages = [{"role": "system", "content": SUMMARY_PREFIX + summary}] if summary else []
+    used = sum(message_tokens(message) for message in head + summary_messages)
+
+    kept = []
+    window_full = False
+    for turn in sorted(turns, reverse=True):
+        turn_tokens = sum(message_tokens(message) for _, message in turns[turn])
+        summarized = turns[turn][-1][0] <= through_seq
+        # The current turn is always sent, even when it alone exceeds the budget
+        if kept and used + turn_tokens > budget:
+            window_full = True
+            continue
+        # Past the window only turns the summary misses are worth their tokens
+        if window_full and summarized:
+            continue
+        kept.insert(0, turn)
+        used += turn_tokens
+    dropped = [seq for turn in turns if turn not in kept for seq, _ in turns[turn]]
+    messages = head + summary_messages + [message for turn in kept for _, message in turns[turn]]
+    report = {
+        "tokens": used,
+        "budget": budget,
+        "turns_sent": len(kept),
+        "turns_summarized": len(turns) - len(kept),
+        "summary_through_seq": through_seq,
+        "dropped_through_seq": max(dropped, default=0),
+        "generation": generation,
+    }
+    return messages, report
+
+
+def _fold_summary(session_id, through_seq, generation):
+    from openai import OpenAI
+    if conversation_generation(session_id) != generation:
+        return
+    previous_seq, summary = load_summary(session_id)
+    if through_seq <= previous_seq:
+        return
+    new_messages = [message for seq, turn, message in load_messages(session_id)
+                    if previous_seq < seq <= through_seq and turn > 0
+                    and not (message.get("is_image") or message.get("is_video"))
+                    and message.get("role") in {"user", "assistant", "system"}]
+    transcript = "\n".join(f"{message['role']}: {message['content']}" for message in new_messages)
+    response = OpenAI().chat.completions.create(model=CONTEXT_SUMMARY_MODEL, messages=[
+        {"role": "system", "content": "Update the running summary of a conversation with the new messages. "
+                                      "Keep the facts, names, numbers and open questions; stay under 250 words."},
+        {"role": "user", "content": f"Running summary:\n{summary or '(empty)'}\n\nNew messages:\n{transcript}"},
+    ])
+    # The chat may have been cleared while the summary was written
+    if not save_summary(session_id, through_seq, response.choices[0].message.content.strip(), generation):
+        print(f"Dropped a summary of a cleared chat of {session_id}")
+
+
+def summarize_in_background(session_id, report, executor):
+    """Fold the turns that fell out of the window into the summary, once per session at a time"""
+    if report["dropped_through_seq"] <= report["summary_through_seq"]:
+        return
+    with _summarizing_lock:
+        if session_id in _summarizing:
+            return
+        _summarizing.add(session_id)
+
+    def run():
+        try:
+            _fold_summary(session_id, report["dropped_through_seq"], report["generation"])
+        except Exception as e:
+            print(f"Could not update the chat summary of {session_id}: {e}")
+        finally:
+            with _summarizing_lock:
+                _summarizing.discard(session_id)
+
+    executor.submit(run)
@@ -0,0 +1,145 @@
+import json
+import threading
+import time
+
+from constants import CHAT_STORE_DB_PATH, CHAT_STORE_RETENTION_SECONDS
+from kb_store import open_connection
+
+# Chat messages of the Knowledge Base sessions, kept in SQLite instead of
+# Streamlit session state. Messages are numbered per session and grouped in
+# turns, a turn starting at each user message, so the page can load only
+# the turns it renders.
+
+_local = threading.local()
+_pruned = False
+_pruned_lock = threading.Lock()
+
+
+def _connect(db_path=CHAT_STORE_DB_PATH):
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    if db_path not in conns:
+        conn = open_connection(db_path)
+        conn.execute("""CREATE TABLE IF NOT EXISTS messages (
+            session_id TEXT NOT NULL,
+            seq INTEGER NOT NULL,
+            turn INTEGER NOT NULL,
+            data TEXT NOT NULL,
+            created_at REAL NOT NULL,
+            PRIMARY KEY (session_id, seq))""")
+        conn.execute("CREATE INDEX IF NOT EXISTS messages_created_at ON messages (created_at)")
+        conn.execute("""CREATE TABLE IF NOT EXISTS summaries (
+            session_id TEXT PRIMARY KEY,
+            through_seq INTEGER NOT NULL,
+            summary TEXT NOT NULL,
+            created_at REAL NOT NULL)""")
+        # Bumped when a session's chat is cleared, so work started on the old conversation is dropped
+        conn.execute("""CREATE TABLE IF NOT EXISTS generations (
+            session_id TEXT PRIMARY KEY,
+            generation INTEGER NOT NULL,
+            created_at REAL NOT NULL)""")
+        conns[db_path] = conn
+        _prune_once(conn)
+    return conns[db_path]
+
+
+def _prune_once(conn):
+    # Sessions have no end event, so old messages are dropped when a process first opens the store
+    global _pruned
+    with _pruned_lock:
+        if _pruned:
+            return
+        _pruned = True
+    cutoff = time.time() - CHAT_STORE_RETENTION_SECONDS
+    conn.execute("DELETE FROM messages WHERE created_at < ?", (cutoff,))
+    conn.execute("DELETE FROM summaries WHERE created_at < ?", (cutoff,))
+    conn.execute("DELETE FROM generations WHERE created_at < ?", (cutoff,))
+
+
+def append_message(session_id, message):
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        seq, turn = conn.execute("SELECT COALESCE(MAX(seq), 0), COALESCE(MAX(turn), 0) FROM messages "
+                                 "WHERE session_id = ?", (session_id,)).fetchone()
+        if message.get("role") == "user":
+            turn += 1
+        conn.execute("INSERT INTO messages (session_id, seq, turn, data, created_at) VALUES (?, ?, ?, ?, ?)",
+                     (session_id, seq + 1, turn, json.dumps(message), time.time()))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def load_messages(session_id, from_turn=0, to_turn=None):
+    """Messages of the turns from_turn..to_turn, as (seq, turn, message) in order"""
+    rows = _connect().execute(
+        "SELECT seq, turn, data FROM messages WHERE session_id = ? AND turn >= ? AND turn <= ? ORDER BY seq",
+        (session_id, from_turn, to_turn if to_turn is not None else 2 ** 62)).fetchall()
+    return [(seq, turn, json.loads(data)) for seq, turn, data in rows]
+
+
+def session_messages(session_id):
+    """Every message of the session, e.g. to send as LLM context"""
+    return [message for _, _, message in load_messages(session_id)]
+
+
+def turn_count(session_id):
+    return _connect().execute("SELECT COALESCE(MAX(turn), 0) FROM messages WHERE session_id = ?",
+                              (session_id,)).fetchone()[0]
+
+
+def clear_messages(session_id):
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+        conn.execute("DELETE FROM summaries WHERE session_id = ?", (session_id,))
+        conn.execute("""INSERT INTO generations (session_id, generation, created_at) VALUES (?, 1, ?)
+            ON CONFLICT(session_id) DO UPDATE SET generation = generation + 1, created_at = excluded.created_at""",
+                     (session_id, time.time()))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def conversation_generation(session_id):
+    """Number of times the session's chat was cleared"""
+    row = _connect().execute("SELECT generation FROM generations WHERE session_id = ?", (session_id,)).fetchone()
+    return row[0] if row else 0
+
+
+def reset_messages(session_id, messages):
+    clear_messages(session_id)
+    for message in messages:
+        append_message(session_id, message)
+
+
+def load_summary(session_id):
+    """(through_seq, summary) of the messages folded into the rolling summary so far"""
+    row = _connect().execute("SELECT through_seq, summary FROM summaries WHERE session_id = ?",
+                             (session_id,)).fetchone()
+    return row if row else (0, "")
+
+
+def save_summary(session_id, through_seq, summary, generation):
+    """Store a summary unless the chat was cleared since generation; returns whether it was stored"""
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        if conversation_generation(session_id) != generation:
+            conn.execute("ROLLBACK")
+            return False
+        conn.execute(
+            """INSERT INTO summaries (session_id, through_seq, summary, created_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(session_id) DO UPDATE SET through_seq = excluded.through_seq, summary = excluded.summary,
+            created_at = excluded.created_at WHERE excluded.through_seq > summaries.through_seq""",
+            (session_id, through_seq, summary, time.time()))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    return True
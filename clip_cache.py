@@ -0,0 +1,186 @@
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from constants import CLIP_CACHE_MAX_MB, CLIP_CACHE_TMP_MAX_AGE_SECONDS, CLIP_CACHE_EVICT_MIN_AGE_SECONDS
+
+# Content-addressed cache for rendered clips. A clip is stored as <key>.mp4
+# where the key hashes the source file identity, the timestamp window and the
+# encoding parameters, so a popular answer is only rendered once.
+
+# Renders write <key>.mp4.<pid>-<thread id>.tmp.mp4 and rename it when done
+_TMP_PID_RE = re.compile(r"\.(\d+)-\d+\.tmp\.mp4$")
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def is_abandoned_tmp(path, max_age=CLIP_CACHE_TMP_MAX_AGE_SECONDS):
+    """True for a render left by a process that is gone, or older than max_age"""
+    if time.time() - os.path.getmtime(path) > max_age:
+        return True
+    match = _TMP_PID_RE.search(os.path.basename(path))
+    return match is not None and not _pid_alive(int(match.group(1)))
+
+
+def clip_key(video_data, concat, encoding):
+    """Hash the sources (path, size, mtime), timestamp windows and encoding parameters"""
+    parts = []
+    for v in video_data:
+        stat = os.stat(v['video_file'])
+        parts.append([os.path.realpath(v['video_file']), stat.st_size, stat.st_mtime_ns,
+                      [round(float(t), 3) for t in v['timestamps']]])
+    payload = json.dumps({"clips": parts, "concat": concat, "encoding": encoding}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+class ClipCache:
+    """Returns existing clips on a hit, renders each missing clip once even under
+    concurrent requests, and evicts least recently used clips beyond the disk quota.
+    """
+
+    def __init__(self, cache_dir, max_bytes, min_age=CLIP_CACHE_EVICT_MIN_AGE_SECONDS):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.min_age = min_age
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> size in bytes, least recently used first
+        self._inflight = {}  # key -> Future resolving to the clip path
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bytes_saved = 0
+        os.makedirs(cache_dir, exist_ok=True)
+        # Clips left by earlier runs count towards the quota as well
+        existing = sorted(glob.glob(os.path.join(cache_dir, "*.mp4")), key=os.path.getatime)
+        for path in existing:
+            if ".tmp." in os.path.basename(path):
+                # Other processes sharing the directory may still be rendering
+                try:
+                    if is_abandoned_tmp(path):
+                        os.remove(path)
+                except FileNotFoundError:
+                    pass
+                continue
+            self._entries[os.path.splitext(os.path.basename(path))[0]] = os.path.getsize(path)
+        with self._lock:
+            self._evict()
+
+    def path_for(self, key):
+        return os.path.join(self.cache_dir, key + ".mp4")
+
+    def _evict(self, keep=()):
+        # Caller must hold the lock. Clips in keep, or used by any process within
+        # min_age (hits touch the file), are left even if the quota stays exceeded.
+        used = sum(self._entries.values())
+        now = time.time()
+        for key in list(self._entries):
+            if used <= self.max_bytes:
+                break
+            if key in keep:
+                continue
+            try:
+                if now - os.path.getmtime(self.path_for(key)) < self.min_age:
+                    continue
+                os.remove(self.path_for(key))
+            except FileNotFoundError:
+                pass
+            used -= self._entries.pop(key)
+
+    def get_many(self, keys, render_fn):
+        """Return the clip path for each key. render_fn receives [(position, tmp_path)]
+        for the keys this call has to render and must write each tmp_path.
+        """
+        paths = [None] * len(keys)
+        waiting = []
+        owned = []
+        with self._lock:
+            for position, key in enumerate(keys):
+                path = self.path_for(key)
+                if key in self._entries and os.path.exists(path):
+                    self.hits += 1
+                    self.bytes_saved += self._entries[key]
+                    self._entries.move_to_end(key)
+                    os.utime(path)
+                    paths[position] = path
+                elif key in self._inflight:
+                    self.coalesced += 1
+                    waiting.append((position, self._inflight[key]))
+                else:
+                    self.misses += 1
+                    future = Future()
+                    self._inflight[key] = future
+                    owned.append((position, key, future))
+
+        if owned:
+            suffix = f".{os.getpid()}-{threading.get_ident()}.tmp.mp4"
+            pending = [(position, self.path_for(key) + suffix) for position, key, _ in owned]
+            try:
+                render_fn(pending)
+                with self._lock:
+                    for (position, key, future), (_, tmp_path) in zip(owned, pending):
+                        path = self.path_for(key)
+                        os.replace(tmp_path, path)
+                        self._entries[key] = os.path.getsize(path)
+                        self._entries.move_to_end(key)
+                        self._inflight.pop(key, None)
+                        future.set_result(path)
+                        paths[position] = path
+                    self._evict(keep=set(keys))
+            except Exception as e:
+                with self._lock:
+                    for position, key, future in owned:
+                        self._inflight.pop(key, None)
+                        if not future.done():
+                            future.set_exception(e)
+                for _, tmp_path in pending:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                raise
+
+        for position, future in waiting:
+            path = future.result()
+            paths[position] = path
+            with self._lock:
+                self.bytes_saved += self._entries.get(os.path.splitext(os.path.basename(path))[0], 0)
+        return paths
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.coalesced
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+                "bytes_saved": self.bytes_saved,
+                "clips": len(self._entries),
+                "disk_bytes": sum(self._entries.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_clip_cache(cache_dir):
+    """Return the clip cache for a directory, shared by the whole process"""
+    cache_dir = os.path.abspath(cache_dir)
+    with _caches_lock:
+        if cache_dir not in _caches:
+            _caches[cache_dir] = ClipCache(cache_dir, CLIP_CACHE_MAX_MB * 1024 * 1024)
+        return _caches[cache_dir]
@@ -1,5 +1,116 @@
 # list of global constants
+import os
 
 KNOWLEDGE_BASE_PATH = "knowledge_base.json"
 demo_media_labels = {"LLM Agents Bootcamp"}
 immersive_demo_labels = {"LLM Agents Bootcamp"}
+
+# Index registry shared by every session in the process
+INDEX_REGISTRY_MEMORY_BUDGET_MB = int(os.getenv("RECALL_INDEX_MEMORY_BUDGET_MB", "4096"))
+INDEX_REGISTRY_BUILD_WORKERS = int(os.getenv("RECALL_INDEX_BUILD_WORKERS", "2"))
+
+# Disk quota for rendered answer clips in ./temp/video_clips
+CLIP_CACHE_MAX_MB = int(os.getenv("RECALL_CLIP_CACHE_MAX_MB", "2048"))
+# Clips used more recently than this are not evicted, another request may be serving them
+CLIP_CACHE_EVICT_MIN_AGE_SECONDS = int(os.getenv("RECALL_CLIP_CACHE_EVICT_MIN_AGE_SECONDS", "300"))
+# Unfinished renders of a live process are only removed once they are this old
+CLIP_CACHE_TMP_MAX_AGE_SECONDS = int(os.getenv("RECALL_CLIP_CACHE_TMP_MAX_AGE_SECONDS", "3600"))
+
+# Media ingestion pipeline
+INGEST_DOWNLOAD_WORKERS = int(os.getenv("RECALL_INGEST_DOWNLOAD_WORKERS", "4"))
+INGEST_PROCESS_WORKERS = int(os.getenv("RECALL_INGEST_PROCESS_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Downloaded videos allowed to wait for processing at once
+INGEST_MAX_PENDING = int(os.getenv("RECALL_INGEST_MAX_PENDING", "4"))
+# Background ingestion jobs, run by ingest_worker.py outside the web apps
+INGEST_JOBS_DB_PATH = "ingest_jobs.db"
+INGEST_JOB_WORKERS = int(os.getenv("RECALL_INGEST_JOB_WORKERS", "1"))
+INGEST_WORKER_STALE_SECONDS = 60
+# Merge per-video tag candidates instead of regenerating tags over the whole event
+INCREMENTAL_EVENT_TAGS = os.getenv("RECALL_INCREMENTAL_EVENT_TAGS", "1") == "1"
+# Tag candidates of an appended video come from the start of its transcript
+EVENT_TAGS_MODEL = os.getenv("RECALL_EVENT_TAGS_MODEL", "gpt-4o-mini")
+EVENT_TAGS_TRANSCRIPT_CHARS = int(os.getenv("RECALL_EVENT_TAGS_TRANSCRIPT_CHARS", "12000"))
+# Processed media by YouTube id or content hash, reused instead of ingesting twice
+MEDIA_FINGERPRINTS_DB_PATH = "media_fingerprints.db"
+
+# Retrieval results cached per event; similarity > 0 lets paraphrases hit the
+# cache through query embeddings
+RETRIEVAL_CACHE_TTL_SECONDS = int(os.getenv("RECALL_RETRIEVAL_CACHE_TTL_SECONDS", "1800"))
+RETRIEVAL_CACHE_MAX_ENTRIES = int(os.getenv("RECALL_RETRIEVAL_CACHE_MAX_ENTRIES", "256"))
+# (event, index_version) pairs kept, least recently used dropped first
+RETRIEVAL_CACHE_MAX_VERSIONS = int(os.getenv("RECALL_RETRIEVAL_CACHE_MAX_VERSIONS", "32"))
+RETRIEVAL_CACHE_SIMILARITY = float(os.getenv("RECALL_RETRIEVAL_CACHE_SIMILARITY", "0"))
+RETRIEVAL_CACHE_EMBEDDING_MODEL = os.getenv("RECALL_RETRIEVAL_CACHE_EMBEDDING_MODEL", "text-embedding-3-small")
+
+# Shared threads for the blocking retrieval, web search and TTS calls of chat turns
+CHAT_WORKERS = int(os.getenv("RECALL_CHAT_WORKERS", "8"))
+
+# Chat turn latency tracing: spans kept for the rolling percentiles, JSONL sink
+# (off unless a path is set; rotated to <path>.1 past TRACE_LOG_MAX_MB) and
+# Prometheus port (0 disables the endpoint)
+TRACE_WINDOW = int(os.getenv("RECALL_TRACE_WINDOW", "1000"))
+TRACE_LOG_PATH = os.getenv("RECALL_TRACE_LOG_PATH", "")
+TRACE_LOG_MAX_MB = float(os.getenv("RECALL_TRACE_LOG_MAX_MB", "50"))
+TRACE_METRICS_PORT = int(os.getenv("RECALL_METRICS_PORT", "0"))
+TRACE_DEBUG_PANEL = os.getenv("RECALL_TRACE_DEBUG_PANEL", "0") == "1"
+
+# Voice answers are synthesized sentence by sentence while the LLM streams
+TTS_STREAMING = os.getenv("RECALL_TTS_STREAMING", "1") == "1"
+# Shorter sentences are merged with the next one to avoid choppy speech
+TTS_MIN_SENTENCE_CHARS = int(os.getenv("RECALL_TTS_MIN_SENTENCE_CHARS", "24"))
+
+# Shared speech-to-text: Whisper model kept resident, with concurrent recordings
+# decoded together in batches
+STT_WHISPER_MODEL = os.getenv("RECALL_STT_WHISPER_MODEL", "base")
+STT_MAX_BATCH = int(os.getenv("RECALL_STT_MAX_BATCH", "8"))
+STT_BATCH_WAIT_MS = int(os.getenv("RECALL_STT_BATCH_WAIT_MS", "20"))
+
+# Pre-connected realtime sessions kept ready for Immersive Mode chats
+REALTIME_POOL_SIZE = int(os.getenv("RECALL_REALTIME_POOL_SIZE", "2"))
+# Pooled sessions older than this are replaced before the server times them out
+REALTIME_POOL_IDLE_SECONDS = int(os.getenv("RECALL_REALTIME_POOL_IDLE_SECONDS", "600"))
+REALTIME_POOL_CHECK_SECONDS = int(os.getenv("RECALL_REALTIME_POOL_CHECK_SECONDS", "15"))
+# Realtime API websocket, e.g. a local stand-in for load tests; unset uses the client default
+REALTIME_URL = os.getenv("RECALL_REALTIME_URL") or None
+
+# Immersive Mode audio relay: pcm16 chunks are coalesced into frames in both
+# directions. At most AUDIO_RELAY_MAX_BUFFER_MS of microphone audio is buffered,
+# the oldest is dropped beyond it. Answers arrive faster than real time, so at
+# most AUDIO_RELAY_OUTPUT_BUFFER_MS of them is buffered and the realtime
+# handler waits for room instead of dropping any
+AUDIO_SAMPLE_RATE = 24000
+AUDIO_RELAY_FRAME_MS = int(os.getenv("RECALL_AUDIO_RELAY_FRAME_MS", "100"))
+AUDIO_RELAY_MAX_WAIT_MS = int(os.getenv("RECALL_AUDIO_RELAY_MAX_WAIT_MS", "40"))
+AUDIO_RELAY_MAX_BUFFER_MS = int(os.getenv("RECALL_AUDIO_RELAY_MAX_BUFFER_MS", "3000"))
+AUDIO_RELAY_OUTPUT_BUFFER_MS = int(os.getenv("RECALL_AUDIO_RELAY_OUTPUT_BUFFER_MS", "5000"))
+
+# Title image thumbnails shown in the Knowledge Base event grid
+THUMBNAIL_SIZE = (480, 270)
+THUMBNAIL_QUALITY = int(os.getenv("RECALL_THUMBNAIL_QUALITY", "80"))
+EVENT_GRID_PAGE_SIZE = int(os.getenv("RECALL_EVENT_GRID_PAGE_SIZE", "12"))
+
+# Knowledge Base chat history, kept outside Streamlit session state
+CHAT_STORE_DB_PATH = "chat_history.db"
+CHAT_STORE_RETENTION_SECONDS = int(os.getenv("RECALL_CHAT_STORE_RETENTION_SECONDS", str(7 * 24 * 3600)))
+# Turns rendered when the chat is shown; older turns load on demand
+CHAT_HISTORY_EAGER_TURNS = int(os.getenv("RECALL_CHAT_HISTORY_EAGER_TURNS", "5"))
+# Tokens of chat history sent with follow-up LLM calls; older turns are summarized
+CONTEXT_TOKEN_BUDGET = int(os.getenv("RECALL_CONTEXT_TOKEN_BUDGET", "6000"))
+CONTEXT_SUMMARY_MODEL = os.getenv("RECALL_CONTEXT_SUMMARY_MODEL", "gpt-4o-mini")
+CONTEXT_TOKENIZER_MODEL = os.getenv("RECALL_CONTEXT_TOKENIZER_MODEL", "gpt-4o")
+
+# Cross-event search in the Knowledge Base chat
+FEDERATED_SEARCH_WORKERS = int(os.getenv("RECALL_FEDERATED_SEARCH_WORKERS", "16"))
+FEDERATED_SHARD_TIMEOUT_SECONDS = float(os.getenv("RECALL_FEDERATED_SHARD_TIMEOUT_SECONDS", "3"))
+FEDERATED_TOP_K = int(os.getenv("RECALL_FEDERATED_TOP_K", "8"))
+# Event indexes that are not resident a cross-event query loads and searches, if they fit the memory budget
+FEDERATED_LOAD_EVENTS = int(os.getenv("RECALL_FEDERATED_LOAD_EVENTS", "3"))
+
+# Web searches requested by the chat LLM, cached per (query, event); a turn
+# waits at most WEB_SEARCH_TIMEOUT_SECONDS for them
+WEB_SEARCH_CACHE_TTL_SECONDS = int(os.getenv("RECALL_WEB_SEARCH_CACHE_TTL_SECONDS", "3600"))
+WEB_SEARCH_CACHE_MAX_ENTRIES = int(os.getenv("RECALL_WEB_SEARCH_CACHE_MAX_ENTRIES", "512"))
+WEB_SEARCH_TIMEOUT_SECONDS = float(os.getenv("RECALL_WEB_SEARCH_TIMEOUT_SECONDS", "8"))
+WEB_SEARCH_WORKERS = int(os.getenv("RECALL_WEB_SEARCH_WORKERS", "8"))
+WEB_SEARCH_HTTP_TIMEOUT_SECONDS = float(os.getenv("RECALL_WEB_SEARCH_HTTP_TIMEOUT_SECONDS", "10"))
+WEB_SEARCH_HTTP_POOL_SIZE = int(os.getenv("RECALL_WEB_SEARCH_HTTP_POOL_SIZE", "10"))
@@ -0,0 +1,86 @@
+import bisect
+import os
+import threading
+
+from kb_store import get_store
+from thumbnails import event_thumbnail
+
+# Searchable view of the knowledge base for the event grid. It is built once
+# per knowledge base version and shared by every session, so a rerun only
+# pays for the query and the page it renders.
+
+
+def _words(text):
+    return text.lower().split()
+
+
+class EventCatalog:
+    def __init__(self, knowledge_base, version):
+        # Shared by every session, treat as read-only
+        self.knowledge_base = knowledge_base
+        self.version = version
+        self.events = {}  # media_label -> {"title", "tags", "image"}
+        self.order = {}  # media_label -> position in the knowledge base
+        self.tag_index = {}  # tag -> set of media_labels
+        prefixes = []
+        for position, (media_label, event_data) in enumerate(knowledge_base.items()):
+            tags = event_data.get("tags", [])
+            self.events[media_label] = {"title": media_label, "tags": tags, "image": self._image(media_label, event_data)}
+            self.order[media_label] = position
+            for tag in tags:
+                self.tag_index.setdefault(tag, set()).add(media_label)
+            prefixes.extend((word, media_label) for word in set(_words(media_label)))
+        self.all_tags = sorted(self.tag_index)
+        prefixes.sort()
+        self._words = [word for word, _ in prefixes]
+        self._word_labels = [media_label for _, media_label in prefixes]
+
+    @staticmethod
+    def _image(media_label, event_data):
+        # Small thumbnails keep the grid cheap; events ingested before them get one here
+        thumbnail = event_data.get("title_thumbnail")
+        if not (thumbnail and os.path.exists(thumbnail)):
+            thumbnail = event_thumbnail(event_data)
+        if thumbnail:
+            return os.path.join(os.getcwd(), thumbnail)
+        if event_data.get("title_image"):
+            return os.path.join(os.getcwd(), event_data["title_image"])
+        return f"https://via.placeholder.com/150?text={media_label.replace(' ', '+')}"
+
+    def _title_matches(self, text):
+        # Every word of the text must prefix a word of the title
+        matches = None
+        for query_word in _words(text):
+            start = bisect.bisect_left(self._words, query_word)
+            end = bisect.bisect_left(self._words, query_word + "\uffff", start)
+            labels = set(self._word_labels[start:end])
+            matches = labels if matches is None else matches & labels
+        return matches
+
+    def query(self, tags=(), match_all=False, text=""):
+        """media_labels with any (or all) of the tags whose title matches the text, in knowledge base order"""
+        matches = None
+        if tags:
+            tag_sets = [self.tag_index.get(tag, set()) for tag in tags]
+            matches = set.intersection(*tag_sets) if match_all else set.union(*tag_sets)
+        if text.strip():
+            title_matches = self._title_matches(text)
+            matches = title_matches if matches is None else matches & title_matches
+        if matches is None:
+            return list(self.events)
+        return sorted(matches, key=self.order.__getitem__)
+
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def get_catalog(file_path):
+    """Catalog of the current knowledge base, rebuilt only when the store version changes"""
+    store = get_store(file_path)
+    version = store.version()
+    with _catalogs_lock:
+        catalog = _catalogs.get(file_path)
+        if catalog is None or catalog.version != version:
+            catalog = _catalogs[file_path] = EventCatalog(store.snapshot(), version)
+        return catalog
@@ -0,0 +1,53 @@
+from collections import Counter
+
+# Event tags and title image merged from per-video candidates, so appending a
+# video to an event only needs candidates for that video.
+
+LEGACY_CANDIDATE_KEY = "__event__"
+
+
+def merge_event_tags(media_tags, max_tags=None):
+    """Merge per-video candidates into event-level tags and a title image.
+
+    media_tags maps a video path to {"tags": [...], "title_image": path, "weight": n}.
+    Tags are ranked by weighted votes, ties keep first-seen order. Each video's
+    image score is the share of its tags that made it into the event tags, and
+    the title image comes from the best scoring video.
+    Returns (tags, title_image, image_scores).
+    """
+    votes = Counter()
+    spelling = {}
+    for candidate in media_tags.values():
+        for tag in candidate.get("tags", []):
+            key = tag.strip().lower()
+            spelling.setdefault(key, tag.strip())
+            votes[key] += candidate.get("weight", 1)
+    if max_tags is None:
+        max_tags = max((len(c.get("tags", [])) for c in media_tags.values()), default=0)
+    position = {key: i for i, key in enumerate(spelling)}
+    ranked = sorted(votes, key=lambda key: (-votes[key], position[key]))[:max_tags]
+    tags = [spelling[key] for key in ranked]
+
+    selected = set(ranked)
+    image_scores = {}
+    for video_path, candidate in media_tags.items():
+        candidate_tags = {tag.strip().lower() for tag in candidate.get("tags", [])}
+        image_scores[video_path] = len(candidate_tags & selected) / len(candidate_tags) if candidate_tags else 0.0
+    title_image = None
+    for video_path in sorted(media_tags, key=lambda path: -image_scores[path]):
+        if media_tags[video_path].get("title_image"):
+            title_image = media_tags[video_path]["title_image"]
+            break
+    return tags, title_image, image_scores
+
+
+def seed_legacy_candidates(event_data):
+    """Candidates for an event ingested before per-video tags were kept"""
+    if event_data.get("media_tags") is not None or not event_data.get("tags"):
+        return event_data.get("media_tags") or {}
+    return {LEGACY_CANDIDATE_KEY: {
+        "tags": event_data["tags"],
+        "title_image": event_data.get("title_image"),
+        # The old tags summarize every video ingested so far
+        "weight": max(len(event_data.get("video_paths", [])), 1),
+    }}
@@ -0,0 +1,258 @@
+import os
+import re
+import subprocess
+import tempfile
+import threading
+from fractions import Fraction
+
+from moviepy.config import get_setting
+
+# Clip generation by stream copy. The span between the first and the last
+# keyframe inside a window is copied as-is, and only the partial GOPs at the
+# two edges are re-encoded so the cut stays frame accurate. The edges are
+# encoded with the source's profile, level and pixel format, and the pieces
+# are joined as MPEG-TS so every piece carries its own parameter sets.
+
+FFMPEG_BINARY = get_setting("FFMPEG_BINARY")
+
+# Edges shorter than this are dropped instead of re-encoded
+MIN_EDGE_SECONDS = 0.05
+# Windows of the same source closer than this are cut by one ffmpeg process.
+# Re-encoded edges make ffmpeg decode the gap too, so keep it short.
+MAX_SHARED_GAP_SECONDS = 5
+# Part of the clip cache key, bump when the cut changes so older clips are rendered again
+CUT_VERSION = 2
+# x264 profile producing each H.264 profile_idc
+X264_PROFILES = {66: "baseline", 77: "main", 100: "high", 110: "high10", 122: "high422", 244: "high444"}
+
+_TIME_BASE_RE = re.compile(r"config in time_base: (\d+)/(\d+)")
+_KEYFRAME_RE = re.compile(r"\bpts:\s*(-?\d+) .*\biskey:1")
+_START_RE = re.compile(r"Duration: .*?, start: (-?[0-9.]+)")
+_VIDEO_RE = re.compile(r"Stream #0:\d+.*?: Video: (\w+)")
+_PIX_FMT_RE = re.compile(r"Stream #0:\d+.*?: Video: .*?, ((?:yuvj?|nv|gray)\w*)")
+_SIZE_RE = re.compile(r"Stream #0:\d+.*?: Video: .*?, (\d{2,5}x\d{2,5})")
+_TBN_RE = re.compile(r"Stream #0:\d+.*?: Video: .*?, ([0-9.]+)(k?) tbn")
+_AUDIO_RE = re.compile(r"Stream #0:\d+.*?: Audio: (\w+)")
+# Logged by the trace_headers bitstream filter when it reads the SPS
+_PROFILE_IDC_RE = re.compile(r"\bprofile_idc\s+[01]+ = (\d+)")
+_LEVEL_IDC_RE = re.compile(r"\blevel_idc\s+[01]+ = (\d+)")
+
+_probe_cache = {}
+_probe_lock = threading.Lock()
+
+
+class SourceInfo:
+    def __init__(self, video_codec, pix_fmt, size, audio_codec, start_time, keyframes,
+                 profile_idc=None, level_idc=None, timescale=None):
+        self.video_codec = video_codec
+        self.pix_fmt = pix_fmt
+        self.size = size
+        self.profile_idc = profile_idc
+        self.level_idc = level_idc
+        self.timescale = timescale  # video stream time base denominator
+        self.audio_codec = audio_codec
+        self.start_time = start_time
+        self.keyframes = keyframes  # absolute pts times in seconds
+
+    @property
+    def supports_copy(self):
+        return (self.video_codec == "h264" and self.audio_codec in {"aac", None} and len(self.keyframes) > 1
+                and self.edge_encode_args() is not None)
+
+    def edge_encode_args(self):
+        """Encoder settings whose parameter sets match the copied spans, or None when unknown"""
+        profile = X264_PROFILES.get(self.profile_idc)
+        if profile is None or not self.level_idc or not self.pix_fmt:
+            return None
+        # Sample rate and channels are kept from the source
+        return ["-c:v", "libx264", "-preset", "veryfast", "-crf", "18", "-profile:v", profile,
+                "-level:v", f"{self.level_idc / 10:g}", "-pix_fmt", self.pix_fmt, "-c:a", "aac"]
+
+
+def probe_source(video_file):
+    """Read codecs, H.264 parameters and keyframe times, decoding keyframes only. Cached per file version."""
+    stat = os.stat(video_file)
+    cache_key = (os.path.realpath(video_file), stat.st_size, stat.st_mtime_ns)
+    with _probe_lock:
+        if cache_key in _probe_cache:
+            return _probe_cache[cache_key]
+
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-nostdin", "-v", "verbose", "-skip_frame", "nokey", "-i", video_file,
+           "-map", "0:v:0", "-an", "-vf", "showinfo", "-f", "null", "-",
+           # The first packet's headers, for the profile and level
+           "-map", "0:v:0", "-an", "-c:v", "copy", "-bsf:v", "trace_headers", "-frames:v", "1", "-f", "null", "-"]
+    output = subprocess.run(cmd, capture_output=True, text=True, errors="replace", check=True).stderr
+
+    video = _VIDEO_RE.search(output)
+    pix_fmt = _PIX_FMT_RE.search(output)
+    size = _SIZE_RE.search(output)
+    audio = _AUDIO_RE.search(output)
+    start = _START_RE.search(output)
+    time_base = _TIME_BASE_RE.search(output)
+    tbn = _TBN_RE.search(output)
+    profile_idc = _PROFILE_IDC_RE.search(output)
+    level_idc = _LEVEL_IDC_RE.search(output)
+    keyframes = []
+    if time_base:
+        tb = Fraction(int(time_base.group(1)), int(time_base.group(2)))
+        keyframes = sorted(float(int(pts) * tb) for pts in _KEYFRAME_RE.findall(output))
+    info = SourceInfo(
+        video_codec=video.group(1) if video else None,
+        pix_fmt=pix_fmt.group(1) if pix_fmt else None,
+        size=size.group(1) if size else None,
+        audio_codec=audio.group(1) if audio else None,
+        start_time=float(start.group(1)) if start else 0.0,
+        keyframes=keyframes,
+        profile_idc=int(profile_idc.group(1)) if profile_idc else None,
+        level_idc=int(level_idc.group(1)) if level_idc else None,
+        timescale=round(float(tbn.group(1)) * (1000 if tbn.group(2) else 1)) if tbn else None,
+    )
+    with _probe_lock:
+        _probe_cache[cache_key] = info
+    return info
+
+
+def plan_pieces(keyframes, start, end):
+    """Split [start, end] into ("encode" | "copy", start, end) pieces on keyframe boundaries"""
+    inner = [k for k in keyframes if start <= k <= end]
+    if len(inner) < 2:
+        return [("encode", start, end)]
+    first_key, last_key = inner[0], inner[-1]
+    pieces = []
+    if first_key - start > MIN_EDGE_SECONDS:
+        pieces.append(("encode", start, first_key))
+    pieces.append(("copy", first_key, last_key))
+    if end - last_key > MIN_EDGE_SECONDS:
+        pieces.append(("encode", last_key, end))
+    return pieces
+
+
+def _group_windows(windows):
+    # windows: list of (clip_index, start, end) for one source, grouped into
+    # runs that are close enough to share one decoding pass
+    runs = []
+    for window in sorted(windows, key=lambda w: w[1]):
+        if runs and window[1] - max(w[2] for w in runs[-1]) <= MAX_SHARED_GAP_SECONDS:
+            runs[-1].append(window)
+        else:
+            runs.append([window])
+    return runs
+
+
+def _cut_run(video_file, info, run, workdir, pieces_by_clip):
+    """Cut every piece of a run of windows with a single ffmpeg process"""
+    earliest = run[0][1]
+    seek_keys = [k for k in info.keyframes if k <= earliest]
+    origin = seek_keys[-1] if seek_keys else info.keyframes[0]
+
+    # -copyts keeps source timestamps so every output can be cut in absolute time
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-nostdin", "-v", "error", "-y", "-copyts",
+           "-ss", f"{origin - info.start_time + 0.001:.6f}", "-i", video_file]
+    for clip_index, start, end in run:
+        for kind, piece_start, piece_end in plan_pieces(info.keyframes, start, end):
+            piece_path = os.path.join(workdir, f"{clip_index:04d}_{piece_start:.3f}.ts")
+            cmd += ["-ss", f"{piece_start:.6f}", "-to", f"{piece_end:.6f}", "-map", "0:v:0", "-map", "0:a:0?"]
+            if kind == "copy":
+                cmd += ["-c", "copy", "-bsf:v", "h264_mp4toannexb"]
+            else:
+                cmd += info.edge_encode_args()
+            cmd += ["-avoid_negative_ts", "make_zero", piece_path]
+            pieces_by_clip.setdefault(clip_index, []).append((piece_start, piece_end, kind, piece_path))
+    subprocess.run(cmd, capture_output=True, check=True)
+
+
+def _concat(piece_paths, out_path, workdir, timescale):
+    list_path = os.path.join(workdir, os.path.basename(out_path) + ".txt")
+    with open(list_path, "w") as f:
+        for piece_path in piece_paths:
+            f.write(f"file '{piece_path}'\n")
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-nostdin", "-v", "error", "-y", "-f", "concat", "-safe", "0",
+           "-i", list_path, "-c", "copy", "-bsf:a", "aac_adtstoasc", "-movflags", "+faststart"]
+    if timescale:
+        # MPEG-TS pieces are in 1/90000, give the clip the source's time base back
+        cmd += ["-video_track_timescale", str(timescale)]
+    subprocess.run(cmd + [out_path], capture_output=True, check=True)
+
+
+def check_windows(pieces, keyframes):
+    """(offset, seconds) spans of a clip cut into plan_pieces that are worth decoding: every
+    re-encoded edge and the first GOP of every copied span, where a parameter
+    set mismatch would show. The rest of a copied span is the source's own bytes.
+    """
+    windows = []
+    offset = 0.0
+    for kind, piece_start, piece_end in pieces:
+        seconds = piece_end - piece_start
+        if kind == "copy":
+            later = [k for k in keyframes if k > piece_start]
+            if later:
+                seconds = min(seconds, later[0] - piece_start)
+        windows.append((offset, seconds))
+        offset += piece_end - piece_start
+    return windows
+
+
+def decodes_cleanly(path, windows):
+    """True when ffmpeg decodes the windows of the file without reporting an error"""
+    cmd = [FFMPEG_BINARY, "-hide_banner", "-nostdin", "-v", "error"]
+    for offset, seconds in windows:
+        cmd += ["-ss", f"{offset:.6f}", "-t", f"{seconds + 0.001:.6f}", "-i", path]
+    for input_index in range(len(windows)):
+        cmd += ["-map", f"{input_index}:v:0", "-map", f"{input_index}:a:0?", "-f", "null", "-"]
+    result = subprocess.run(cmd, capture_output=True, text=True, errors="replace")
+    if result.returncode != 0 or result.stderr.strip():
+        print(f"{path} does not decode cleanly: {result.stderr.strip()[:500]}")
+        return False
+    return True
+
+
+def cut_clips(video_data, out_paths, concat=False):
+    """Write each clip of video_data (or their concatenation) to out_paths without
+    decoding the copied spans. Returns False when a source cannot be stream copied,
+    or when a joined clip does not decode cleanly where its pieces meet; the caller
+    then re-encodes.
+    """
+    infos = {}
+    for v in video_data:
+        if v['video_file'] not in infos:
+            infos[v['video_file']] = probe_source(v['video_file'])
+    if not all(info.supports_copy for info in infos.values()):
+        return False
+    if concat and len({(info.size, info.timescale, tuple(info.edge_encode_args()))
+                       for info in infos.values()}) > 1:
+        # Joining without decoding needs matching streams
+        return False
+
+    windows_by_source = {}
+    for clip_index, v in enumerate(video_data):
+        info = infos[v['video_file']]
+        start, end = v['timestamps']
+        windows_by_source.setdefault(v['video_file'], []).append(
+            (clip_index, info.start_time + start, info.start_time + end))
+
+    os.makedirs(os.path.dirname(os.path.abspath(out_paths[0])), exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=os.path.dirname(os.path.abspath(out_paths[0]))) as workdir:
+        pieces_by_clip = {}
+        # Each source is opened once per run of nearby windows
+        for video_file, windows in windows_by_source.items():
+            for run in _group_windows(windows):
+                _cut_run(video_file, infos[video_file], run, workdir, pieces_by_clip)
+
+        ordered = [sorted(pieces_by_clip[i]) for i in range(len(video_data))]
+        timescales = [infos[v['video_file']].timescale for v in video_data]
+        # Decoding only where pieces meet keeps the check far cheaper than the cut it replaces
+        windows = [check_windows([(kind, start, end) for start, end, kind, _ in pieces],
+                                 infos[v['video_file']].keyframes)
+                   for pieces, v in zip(ordered, video_data)]
+        if concat:
+            _concat([piece[3] for pieces in ordered for piece in pieces], out_paths[0], workdir, timescales[0])
+            offset, joined = 0.0, []
+            for pieces, clip_windows in zip(ordered, windows):
+                joined += [(offset + window_offset, seconds) for window_offset, seconds in clip_windows]
+                offset += sum(piece_end - piece_start for piece_start, piece_end, _, _ in pieces)
+            checks = [(out_paths[0], joined)]
+        else:
+            for pieces, out_path, timescale in zip(ordered, out_paths, timescales):
+                _concat([piece[3] for piece in pieces], out_path, workdir, timescale)
+            checks = list(zip(out_paths, windows))
+    return all(decodes_cleanly(out_path, clip_windows) for out_path, clip_windows in checks)
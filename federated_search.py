@@ -0,0 +1,147 @@
+import time
+from concurrent.futures import wait
+from dataclasses import dataclass, field
+
+from constants import (FEDERATED_SEARCH_WORKERS, FEDERATED_SHARD_TIMEOUT_SECONDS, FEDERATED_TOP_K,
+                       FEDERATED_LOAD_EVENTS)
+from index_registry import get_index_registry
+from recall_utils import get_thread_pool
+from retrieval_cache import cached_search_knowledge_base, normalize_query
+
+# Cross-event search: the query is sent to the index of each event in
+# parallel, each shard within a shared deadline, and the per-event results
+# are merged on their similarity scores so only the overall top-k reach the LLM.
+# Not every index fits in memory, so the answer says how many events were searched.
+
+ALL_EVENTS_LABEL = "All events"
+# Score given to docs a shard returns without one
+UNSCORED_PRIOR = 0.0
+
+
+@dataclass
+class FederatedResult:
+    text_docs: list
+    img_docs: list
+    # media_label of each returned doc, in the same order
+    text_labels: list
+    img_labels: list
+    indexes: dict
+    report: dict = field(default_factory=dict)
+
+
+def shard_scores(docs):
+    """Similarity score of each doc, ranking unscored docs below every scored one.
+
+    Raw scores are comparable across shards since every index is built with the
+    same embedding model.
+    """
+    scores = []
+    for doc in docs:
+        score = getattr(doc, "score", None)
+        scores.append(UNSCORED_PRIOR if score is None else score)
+    return scores
+
+
+def _merge(shard_docs, top_k):
+    ranked = []
+    for media_label, docs in shard_docs.items():
+        ranked.extend((score, media_label, doc) for score, doc in zip(shard_scores(docs), docs))
+    # Stable, so ties keep knowledge base order and each shard's own ranking
+    ranked.sort(key=lambda entry: -entry[0])
+    ranked = ranked[:top_k]
+    return [doc for _, _, doc in ranked], [media_label for _, media_label, _ in ranked]
+
+
+def load_candidates(query, knowledge_base, missing, limit=FEDERATED_LOAD_EVENTS):
+    """The missing events whose tags or title share the most words with the query"""
+    words = set(normalize_query(query).split())
+    scored = []
+    for media_label in missing:
+        event_text = " ".join([media_label, *knowledge_base[media_label].get("tags", [])])
+        event_words = set(normalize_query(event_text).split())
+        scored.append((len(words & event_words), media_label))
+    # Stable, so ties keep knowledge base order
+    scored.sort(key=lambda entry: -entry[0])
+    return [media_label for _, media_label in scored[:limit]]
+
+
+def _search_shard(registry, query, media_label, version, index=None):
+    # Indexes that are not resident are loaded first, on the shard's own thread
+    if index is None:
+        index = registry.get(media_label, version)
+    img_docs, text_docs = cached_search_knowledge_base(query, media_label, {media_label: index}, version)
+    return index, img_docs, text_docs
+
+
+def coverage_note(report):
+    """One line telling the user how much of the knowledge base answered"""
+    note = f"Searched {report['searched']} of {report['events']} events"
+    unanswered = [f"{count} {reason}" for count, reason in (
+        (len(report["timed_out"]), "timed out"),
+        (len(report["failed"]), "failed"),
+        (report["skipped"], "not loaded to stay within the memory budget"),
+    ) if count]
+    return note + (f" ({', '.join(unanswered)})." if unanswered else ".")
+
+
+def federated_search(query, knowledge_base, top_k=FEDERATED_TOP_K, timeout=FEDERATED_SHARD_TIMEOUT_SECONDS):
+    """Search the events of the knowledge base and return the merged top-k documents.
+
+    Every event with a resident index is searched. Of the others, the best
+    matches for the query are loaded as long as they fit the registry's
+    memory budget; the report counts the events that were skipped. Shards
+    that miss the deadline are left out; their indexes and results are still
+    kept for the next query.
+    """
+    registry = get_index_registry()
+    executor = get_thread_pool("federated-search", FEDERATED_SEARCH_WORKERS)
+    started = time.perf_counter()
+    futures = {}
+    missing = []
+    for media_label, event_data in knowledge_base.items():
+        version = event_data.get("index_version")
+        # A stale index would have its results cached under the new version
+        index = registry.peek(media_label, version)
+        if index is None:
+            if registry.peek(media_label) is not None:
+                # It already takes its share of the budget, so its replacement starts building
+                registry.prefetch(media_label, version)
+            missing.append(media_label)
+            continue
+        futures[executor.submit(_search_shard, registry, query, media_label, version, index)] = media_label
+    # Loading every missing index would evict the resident ones, so only a few are loaded
+    loaded = []
+    for media_label in load_candidates(query, knowledge_base, missing, FEDERATED_LOAD_EVENTS):
+        if not registry.has_room(len(loaded) + 1):
+            break
+        version = knowledge_base[media_label].get("index_version")
+        futures[executor.submit(_search_shard, registry, query, media_label, version)] = media_label
+        loaded.append(media_label)
+    done, not_done = wait(futures, timeout=timeout)
+    text_shards, img_shards = {}, {}
+    indexes = {}
+    failed = []
+    for future in done:
+        media_label = futures[future]
+        try:
+            indexes[media_label], img_docs, text_docs = future.result()
+        except Exception as e:
+            print(f"Search of {media_label} failed: {e}")
+            failed.append(media_label)
+            continue
+        text_shards[media_label] = text_docs or []
+        img_shards[media_label] = img_docs or []
+    text_docs, text_labels = _merge(text_shards, top_k)
+    img_docs, img_labels = _merge(img_shards, top_k)
+    report = {
+        "events": len(knowledge_base),
+        "searched": len(text_shards),
+        "loaded": loaded,
+        "skipped": len(missing) - len(loaded),
+        "timed_out": sorted(futures[future] for future in not_done),
+        "failed": failed,
+        "seconds": round(time.perf_counter() - started, 3),
+    }
+    contributing = set(text_labels) | set(img_labels)
+    return FederatedResult(text_docs, img_docs, text_labels, img_labels,
+                           {media_label: indexes[media_label] for media_label in contributing}, report)
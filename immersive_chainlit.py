@@ -1,14 +1,19 @@
 import os
 import asyncio
+import inspect
 
 import chainlit as cl
 from uuid import uuid4
+from chainlit.context import context_var
 from chainlit.logger import logger
 from video_index.video_processing.immersive_tools import update_video_message
 from video_index.video_processing.immersive_server import manager
 from recall_utils import load_state
-from video_index.rags.text_rag import create_new_index
-from constants import KNOWLEDGE_BASE_PATH, immersive_demo_labels
+from index_registry import get_index_registry
+from constants import KNOWLEDGE_BASE_PATH, REALTIME_URL, AUDIO_RELAY_OUTPUT_BUFFER_MS, immersive_demo_labels
+from tracing import start_turn, format_percentiles
+from realtime_pool import PooledSession, get_realtime_pool
+from audio_relay import AudioRelay
 import sys
 
 # File is used to support OAI realtime api
@@ -23,10 +28,54 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+TRACE_APP = "immersive"
+
+
+def begin_turn():
+    """Start tracing a user turn, ending the previous one if it never completed"""
+    if previous := cl.user_session.get("turn"):
+        previous.end(completed=False)
+    turn = start_turn(TRACE_APP, cl.user_session.get("id"), ", ".join(sorted(immersive_demo_labels)))
+    cl.user_session.set("turn", turn)
+    return turn
+
+
+def traced_tool(name, handler):
+    async def wrapper(*args, **kwargs):
+        turn = cl.user_session.get("turn")
+        if turn is None:
+            turn = begin_turn()
+        # Tools search the indexes, which may still be loading for a new chat
+        if (loading := cl.user_session.get("indexes_task")) and not loading.done():
+            with turn.span("index_wait"):
+                await loading
+        with turn.span(f"tool:{name}"):
+            result = handler(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+    return wrapper
+
 async def setup_openai_realtime():
-    """Instantiate and configure the OpenAI Realtime Client"""
-    openai_realtime = RealtimeClient(api_key=os.getenv("OPENAI_API_KEY"))
-    cl.user_session.set("track_id", str(uuid4()))
+    """Instantiate, configure and connect an OpenAI Realtime Client for the session pool.
+
+    The client is created outside of any chat, so its handlers run in the
+    chainlit context of the chat that claims the session.
+    """
+    openai_realtime = RealtimeClient(url=REALTIME_URL, api_key=os.getenv("OPENAI_API_KEY"))
+    session = PooledSession(openai_realtime)
+
+    def in_chat(handler):
+        async def wrapper(*args, **kwargs):
+            if session.context is None:
+                return None
+            context_var.set(session.context)
+            result = handler(*args, **kwargs)
+            if inspect.isawaitable(result):
+                result = await result
+            return result
+        return wrapper
+
     async def handle_conversation_updated(event):
         item = event.get("item")
         delta = event.get("delta")
@@ -35,7 +84,9 @@ async def setup_openai_realtime():
             # Only one of the following will be populated for any given event
             if 'audio' in delta:
                 audio = delta['audio']  # Int16Array, audio added
-                await cl.context.emitter.send_audio_chunk(cl.OutputAudioChunk(mimeType="pcm16", data=audio, track=cl.user_session.get("track_id")))
+                if turn := cl.user_session.get("turn"):
+                    turn.mark_once("first_audio")
+                await cl.user_session.get("audio_out").put(audio)
             if 'transcript' in delta:
                 transcript = delta['transcript']  # string, transcript added
                 print("Debug>>transcript =", transcript)
@@ -47,26 +98,82 @@ async def setup_openai_realtime():
     async def handle_item_completed(item):
         """Used to populate the chat context with transcription once an item is completed."""
         # print(item) # TODO
-        pass
+        completed = item.get("item", item) if isinstance(item, dict) else {}
+        if completed.get("role") == "assistant" and (turn := cl.user_session.get("turn")):
+            turn.end()
+            cl.user_session.set("turn", None)
+
+    async def handle_realtime_event(realtime_event):
+        # Voice turns start when the server detects the end of the user's speech
+        event = realtime_event.get("event", {})
+        if realtime_event.get("source") == "server" and event.get("type") == "input_audio_buffer.speech_stopped":
+            begin_turn()
     
     async def handle_conversation_interrupt(event):
         """Used to cancel the client previous audio playback."""
         cl.user_session.set("track_id", str(uuid4()))
+        cl.user_session.get("audio_out").clear()
         await cl.context.emitter.send_audio_interrupt()
         
     async def handle_error(event):
         logger.error(event)
         
     
-    openai_realtime.on('conversation.updated', handle_conversation_updated)
-    openai_realtime.on('conversation.item.completed', handle_item_completed)
-    openai_realtime.on('conversation.interrupted', handle_conversation_interrupt)
+    openai_realtime.on('conversation.updated', in_chat(handle_conversation_updated))
+    openai_realtime.on('conversation.item.completed', in_chat(handle_item_completed))
+    openai_realtime.on('conversation.interrupted', in_chat(handle_conversation_interrupt))
     openai_realtime.on('error', handle_error)
+    openai_realtime.on('realtime.event', in_chat(handle_realtime_event))
 
-    cl.user_session.set("openai_realtime", openai_realtime)
-    coros = [openai_realtime.add_tool(tool_def, tool_handler) for tool_def, tool_handler in tools]
-    print("coros = ", coros)
+    coros = [openai_realtime.add_tool(tool_def, in_chat(traced_tool(tool_def.get("name", "tool"), tool_handler)))
+             for tool_def, tool_handler in tools]
     await asyncio.gather(*coros)
+    await openai_realtime.connect()
+    return session
+
+
+async def ensure_realtime_session():
+    """Claim a realtime session for the chat unless it already holds a connected one"""
+    openai_realtime: RealtimeClient = cl.user_session.get("openai_realtime")
+    if openai_realtime and openai_realtime.is_connected():
+        return openai_realtime
+    setup = start_turn(TRACE_APP, cl.user_session.get("id"), ", ".join(sorted(immersive_demo_labels)))
+    with setup.span("realtime_claim"):
+        openai_realtime = await claim_realtime_session()
+    setup.end(stage="setup")
+    return openai_realtime
+
+
+async def claim_realtime_session():
+    """Take a connected session from the pool and bind it to the current chat"""
+    session = await get_realtime_pool(setup_openai_realtime).claim(context_var.get())
+    cl.user_session.set("track_id", str(uuid4()))
+    cl.user_session.set("realtime_session", session)
+    cl.user_session.set("openai_realtime", session.client)
+    await open_audio_relays(session.client)
+    return session.client
+
+
+async def open_audio_relays(openai_realtime):
+    """Coalesce the audio of this chat into frames in both directions"""
+    await close_audio_relays()
+
+    async def send_output(frame):
+        await cl.context.emitter.send_audio_chunk(
+            cl.OutputAudioChunk(mimeType="pcm16", data=frame, track=cl.user_session.get("track_id")))
+
+    cl.user_session.set("audio_in", AudioRelay(openai_realtime.append_input_audio, "audio_in"))
+    # Answers arrive faster than real time: rather than dropping their start, the
+    # realtime handler waits in put until the browser has taken some of the buffer
+    cl.user_session.set("audio_out", AudioRelay(send_output, "audio_out", max_buffer_ms=AUDIO_RELAY_OUTPUT_BUFFER_MS))
+
+
+async def close_audio_relays():
+    # The remaining input is still sent so the end of the user's speech is heard
+    if audio_in := cl.user_session.get("audio_in"):
+        await audio_in.close()
+    if audio_out := cl.user_session.get("audio_out"):
+        await audio_out.close(flush=False)
 
 
 @cl.on_chat_start
@@ -82,41 +189,54 @@ async def start():
     # apex_message.elements = elements
     # cl.user_session.set("apex_message", apex_message)
     # await apex_message.send()
-    await setup_openai_realtime()
+    # Warm the pool as soon as the first chat opens, so its first claim finds a connected session
+    get_realtime_pool(setup_openai_realtime)
+    setup = start_turn(TRACE_APP, cl.user_session.get("id"), ", ".join(sorted(immersive_demo_labels)))
+    # The chat is usable while the indexes load; tool calls wait for them
+    cl.user_session.set("indexes", {})
+    indexes_task = asyncio.create_task(load_indexes(setup))
+    cl.user_session.set("indexes_task", indexes_task)
+    # The realtime session is only claimed once the user speaks or types, so
+    # idle chats do not hold a connection of the pool
+    indexes_task.add_done_callback(lambda _: setup.end(stage="setup"))
 
+async def load_indexes(turn):
+    """Load the immersive indexes off the event loop, so other chats keep streaming"""
     if not cl.user_session.get("knowledge_base"):
-        cl.user_session.set("knowledge_base", load_state(KNOWLEDGE_BASE_PATH))
-    if not cl.user_session.get("indexes"):
-        cl.user_session.set("indexes", {})
-    if not cl.user_session.get("futures"):
-        cl.user_session.set("futures", {})
-
-    media_labels = []
-
-    for media_label in immersive_demo_labels:
-        if media_label not in cl.user_session.get("indexes"):
-            # TODO: Remove the following if block after the Demo
-            print(f"Index for {media_label} does not exist. Need to create or load one.")
-            cl.user_session.get("indexes")[media_label] = create_new_index(media_label)
-        else:
-            print(f"Index for {media_label} exists in future or index")
+        cl.user_session.set("knowledge_base", await asyncio.to_thread(load_state, KNOWLEDGE_BASE_PATH))
+
+    # Indexes are built once per process and shared by every chat
+    index_registry = get_index_registry()
+    knowledge_base = cl.user_session.get("knowledge_base")
+    with turn.span("index_load"):
+        await asyncio.gather(*(index_registry.aget(media_label, knowledge_base.get(media_label, {}).get("index_version"))
+                               for media_label in immersive_demo_labels))
+    cl.user_session.set("indexes", index_registry.view(immersive_demo_labels))
 
 @cl.on_message
 async def on_message(message: cl.Message):
-    openai_realtime: RealtimeClient = cl.user_session.get("openai_realtime")
-    if openai_realtime and openai_realtime.is_connected():
-    
-        # TODO: Try image processing with message.elements
-        await openai_realtime.send_user_message_content([{ "type": 'input_text', "text": message.content }])
-    else:
-        await cl.Message(content="Please activate voice mode before sending messages!").send()
+    if message.content.strip() == "/latency":
+        pool_stats = get_realtime_pool(setup_openai_realtime).stats()
+        relay_stats = {name: relay.stats() for name in ("audio_in", "audio_out")
+                       if (relay := cl.user_session.get(name))}
+        await cl.Message(content=f"{format_percentiles(TRACE_APP)}\n\nRealtime pool: {pool_stats}\n\n"
+                                 f"Audio relays: {relay_stats}").send()
+        return
+    try:
+        openai_realtime = await ensure_realtime_session()
+    except Exception as e:
+        await cl.ErrorMessage(content=f"Failed to connect to OpenAI realtime: {e}").send()
+        return
+    # TODO: Try image processing with message.elements
+    begin_turn()
+    await openai_realtime.send_user_message_content([{ "type": 'input_text', "text": message.content }])
 
 @cl.on_audio_start
 async def on_audio_start():
     cl.user_session.set("recall_websocket", manager.latest_socket)
     try:
-        openai_realtime: RealtimeClient = cl.user_session.get("openai_realtime")
-        await openai_realtime.connect()
+        # Sessions are claimed here and released when the recording ends
+        await ensure_realtime_session()
         logger.info("Connected to OpenAI realtime")
         # TODO: might want to recreate items to restore context
         # openai_realtime.create_conversation_item(item)
@@ -127,9 +247,9 @@ async def on_audio_start():
 
 @cl.on_audio_chunk
 async def on_audio_chunk(chunk: cl.InputAudioChunk):
-    openai_realtime: RealtimeClient = cl.user_session.get("openai_realtime")            
-    if openai_realtime.is_connected():
-        await openai_realtime.append_input_audio(chunk.data)
+    openai_realtime: RealtimeClient = cl.user_session.get("openai_realtime")
+    if openai_realtime and openai_realtime.is_connected():
+        cl.user_session.get("audio_in").push(chunk.data)
     else:
         logger.info("RealtimeClient is not connected")
 
@@ -137,6 +257,7 @@ async def on_audio_chunk(chunk: cl.InputAudioChunk):
 @cl.on_chat_end
 @cl.on_stop
 async def on_end():
-    openai_realtime: RealtimeClient = cl.user_session.get("openai_realtime")
-    if openai_realtime and openai_realtime.is_connected():
-        await openai_realtime.disconnect()
+    await close_audio_relays()
+    if session := cl.user_session.get("realtime_session"):
+        cl.user_session.set("realtime_session", None)
+        await get_realtime_pool(setup_openai_realtime).release(session)
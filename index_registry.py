@@ -0,0 +1,245 @@
+import asyncio
+import sys
+import threading
+import types
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from constants import INDEX_REGISTRY_MEMORY_BUDGET_MB, INDEX_REGISTRY_BUILD_WORKERS
+from video_index.rags.text_rag import create_new_index
+
+# Process-wide registry of event indexes. Streamlit and Chainlit import this
+# module once per process, so every session shares the same built indexes.
+
+# Python floats in embedding lists cost a pointer plus the float object
+PY_FLOAT_BYTES = 8 + sys.getsizeof(0.0)
+# Containers up to this size are structure and are searched for vectors;
+# larger ones are data, e.g. node stores, and are only sized as vectors
+MAX_STRUCTURE_ITEMS = 16
+MAX_SIZE_DEPTH = 6
+# Attributes that hold objects shared between indexes, like embedding models
+_SHARED_ATTR_HINTS = ("model", "llm", "client", "callback", "tokenizer")
+
+
+def _vector_bytes(value):
+    """Bytes of a vector or a collection of vectors, or None when value is neither"""
+    if hasattr(value, "dtype") and hasattr(value, "nbytes"):
+        return value.nbytes
+    if isinstance(value, (list, tuple)) and value and isinstance(value[0], float):
+        return len(value) * PY_FLOAT_BYTES
+    if isinstance(value, dict) and value:
+        first = next(iter(value.values()))
+        if _vector_bytes(first) is not None and not isinstance(first, dict):
+            # All vectors of an index share the embedding dimensions
+            return len(value) * _vector_bytes(first)
+    if isinstance(value, (list, tuple)) and value and _vector_bytes(value[0]) is not None:
+        return len(value) * _vector_bytes(value[0])
+    return None
+
+
+def estimate_size(index):
+    """Approximate the bytes held by an index from its stored vectors, count x dims x item size.
+
+    Only the attributes of the index and of small containers are searched, so
+    shared models and the documents themselves are not walked.
+    """
+    seen = set()
+    pending = [(index, 0)]
+    total = 0
+    while pending:
+        current, depth = pending.pop()
+        if id(current) in seen or depth > MAX_SIZE_DEPTH or isinstance(current, (str, bytes, int, float)):
+            continue
+        seen.add(id(current))
+        vectors = _vector_bytes(current)
+        if vectors is not None:
+            total += vectors
+        elif isinstance(current, dict):
+            if len(current) <= MAX_STRUCTURE_ITEMS:
+                pending.extend((value, depth + 1) for value in current.values())
+        elif isinstance(current, (list, tuple, set)):
+            if len(current) <= MAX_STRUCTURE_ITEMS:
+                pending.extend((value, depth + 1) for value in current)
+        elif hasattr(current, "__dict__") and not isinstance(current, type):
+            pending.extend((value, depth + 1) for name, value in vars(current).items()
+                           if not any(hint in name.lower() for hint in _SHARED_ATTR_HINTS))
+    return total
+
+
+class IndexRegistry:
+    """Builds each index once, shares it across sessions and evicts the least
+    recently used ones when the memory budget is exceeded.
+    """
+
+    def __init__(self, builder=create_new_index, memory_budget_mb=INDEX_REGISTRY_MEMORY_BUDGET_MB,
+                 max_workers=INDEX_REGISTRY_BUILD_WORKERS, size_fn=estimate_size):
+        self._builder = builder
+        self._size_fn = size_fn
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._lock = threading.Lock()
+        self._indexes = OrderedDict()  # media_label -> (index, size, version)
+        self._pending = {}  # (media_label, version) -> Future
+        # Bumped when an index is put or invalidated, so builds started before are not stored
+        self._generations = {}  # media_label -> int
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="index-build")
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _build(self, media_label, version, generation):
+        print(f"Building index for {media_label}")
+        try:
+            index = self._builder(media_label)
+            size = self._size_fn(index)
+        except Exception:
+            with self._lock:
+                self._pending.pop((media_label, version), None)
+            raise
+        with self._lock:
+            self._pending.pop((media_label, version), None)
+            stored = self._supersedes(media_label, version, generation)
+            if stored:
+                self._store(media_label, index, size, version)
+        if stored:
+            print(f"Index for {media_label} is ready ({size / (1024 * 1024):.1f} MB)")
+        else:
+            # Still returned to the callers waiting for this build
+            print(f"Index for {media_label} was replaced while building, not keeping it")
+        return index
+
+    def _supersedes(self, media_label, version, generation):
+        # Caller must hold the lock
+        if self._generations.get(media_label, 0) != generation:
+            return False
+        entry = self._indexes.get(media_label)
+        # A build for an older version may finish after the newer one
+        return entry is None or entry[2] is None or version is None or entry[2] <= version
+
+    def _store(self, media_label, index, size, version):
+        # Caller must hold the lock
+        self._indexes[media_label] = (index, size, version)
+        self._indexes.move_to_end(media_label)
+        used = sum(entry[1] for entry in self._indexes.values())
+        while used > self.memory_budget and len(self._indexes) > 1:
+            evicted_label, (_, evicted_size, _) = self._indexes.popitem(last=False)
+            used -= evicted_size
+            self.evictions += 1
+            print(f"Evicted index for {evicted_label} to stay within the memory budget")
+
+    def _is_current(self, media_label, version):
+        # Caller must hold the lock. A version of None accepts any resident index.
+        entry = self._indexes.get(media_label)
+        return entry is not None and (version is None or entry[2] == version)
+
+    def _building(self, media_label, version):
+        # Caller must hold the lock. A version of None accepts a build of any version.
+        if version is None:
+            return next((future for (label, _), future in self._pending.items() if label == media_label), None)
+        return self._pending.get((media_label, version))
+
+    def _submit(self, media_label, version):
+        # Caller must hold the lock
+        future = self._building(media_label, version)
+        if future is None:
+            self.misses += 1
+            future = self._executor.submit(self._build, media_label, version, self._generations.get(media_label, 0))
+            self._pending[(media_label, version)] = future
+        else:
+            self.hits += 1
+        return future
+
+    def prefetch(self, media_label, version=None):
+        """Start building an index in the background unless it is current or already building.
+        A stale index keeps being served until its replacement is ready.
+        """
+        with self._lock:
+            if self._is_current(media_label, version):
+                return None
+            return self._building(media_label, version) or self._submit(media_label, version)
+
+    def get(self, media_label, version=None):
+        """Return the shared index for a label, building it once if needed.
+        version is the event's index_version; a resident index of another version is rebuilt.
+        """
+        with self._lock:
+            if self._is_current(media_label, version):
+                self.hits += 1
+                self._indexes.move_to_end(media_label)
+                return self._indexes[media_label][0]
+            future = self._submit(media_label, version)
+        return future.result()
+
+    async def aget(self, media_label, version=None):
+        """Like get, for event loops: the build runs on the registry's threads while the loop keeps serving"""
+        with self._lock:
+            if self._is_current(media_label, version):
+                self.hits += 1
+                self._indexes.move_to_end(media_label)
+                return self._indexes[media_label][0]
+            future = self._submit(media_label, version)
+        return await asyncio.wrap_future(future)
+
+    def has_room(self, count=1):
+        """True when count more indexes of the average resident size fit the budget without evictions"""
+        with self._lock:
+            if not self._indexes:
+                return True
+            used = sum(entry[1] for entry in self._indexes.values())
+            return used + count * used / len(self._indexes) <= self.memory_budget
+
+    def peek(self, media_label, version=None):
+        """Return the index if it is resident, without building or counting a lookup.
+        With a version, an index of another version is not returned.
+        """
+        with self._lock:
+            return self._indexes[media_label][0] if self._is_current(media_label, version) else None
+
+    def put(self, media_label, index, version=None):
+        """Replace the shared index for a label, e.g. after new media was ingested"""
+        size = self._size_fn(index)
+        with self._lock:
+            self._generations[media_label] = self._generations.get(media_label, 0) + 1
+            self._store(media_label, index, size, version)
+
+    def invalidate(self, media_label):
+        """Drop the resident index; builds already running for it are not kept"""
+        with self._lock:
+            self._generations[media_label] = self._generations.get(media_label, 0) + 1
+            self._indexes.pop(media_label, None)
+
+    def view(self, media_labels):
+        """Read-only mapping of the requested labels to their resident indexes"""
+        with self._lock:
+            indexes = {}
+            for media_label in media_labels:
+                if media_label in self._indexes:
+                    self._indexes.move_to_end(media_label)
+                    indexes[media_label] = self._indexes[media_label][0]
+        return types.MappingProxyType(indexes)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "resident": list(self._indexes.keys()),
+                "building": sorted({media_label for media_label, _ in self._pending}),
+                "memory_bytes": sum(entry[1] for entry in self._indexes.values()),
+                "memory_budget_bytes": self.memory_budget,
+            }
+
+
+_registry = None
+_registry_lock = threading.Lock()
+
+
+def get_index_registry():
+    """Return the registry shared by the whole process"""
+    global _registry
+    with _registry_lock:
+        if _registry is None:
+            _registry = IndexRegistry()
+        return _registry
@@ -0,0 +1,126 @@
+import json
+import os
+import threading
+import time
+
+from constants import INGEST_JOBS_DB_PATH, INGEST_WORKER_STALE_SECONDS
+from kb_store import open_connection
+
+# SQLite job queue shared by the Streamlit app, which submits ingestion jobs,
+# and the ingest_worker.py processes, which claim them and report progress.
+
+_local = threading.local()
+
+
+def _connect(db_path=INGEST_JOBS_DB_PATH):
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    if db_path not in conns:
+        conn = open_connection(db_path)
+        conn.row_factory = _dict_row
+        conn.execute("""CREATE TABLE IF NOT EXISTS jobs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            media_label TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'queued',
+            stage TEXT,
+            percent REAL NOT NULL DEFAULT 0,
+            error TEXT,
+            worker_id TEXT,
+            created_at REAL NOT NULL,
+            started_at REAL,
+            finished_at REAL)""")
+        conn.execute("""CREATE TABLE IF NOT EXISTS workers (
+            worker_id TEXT PRIMARY KEY,
+            heartbeat_at REAL NOT NULL)""")
+        conns[db_path] = conn
+    return conns[db_path]
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+def submit_job(media_label, sources, storage_path, fingerprints=None, reused=None):
+    """Queue an ingestion job and return its id without waiting for it.
+
+    fingerprints maps a source location to its media fingerprint, reused lists
+    the (video_path, audio_path, text_path) of already processed media to attach.
+    """
+    payload = json.dumps({"sources": sources, "storage_path": storage_path,
+                          "fingerprints": fingerprints or {}, "reused": reused or []})
+    cursor = _connect().execute(
+        "INSERT INTO jobs (media_label, payload, stage, created_at) VALUES (?, ?, 'queued', ?)",
+        (media_label, payload, time.time()))
+    return cursor.lastrowid
+
+
+def claim_next_job(worker_id):
+    """Atomically move the oldest queued job to running for this worker"""
+    conn = _connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _requeue_orphaned_jobs(conn)
+        job = conn.execute("SELECT * FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1").fetchone()
+        if job:
+            conn.execute("UPDATE jobs SET status = 'running', stage = 'starting', worker_id = ?, started_at = ? "
+                         "WHERE id = ?", (worker_id, time.time(), job["id"]))
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+    if job:
+        job.update(status="running", worker_id=worker_id, **json.loads(job.pop("payload")))
+    return job
+
+
+def _requeue_orphaned_jobs(conn):
+    # Caller must hold a write transaction. Jobs of workers that stopped
+    # sending heartbeats are put back in the queue.
+    cutoff = time.time() - INGEST_WORKER_STALE_SECONDS
+    conn.execute("""UPDATE jobs SET status = 'queued', stage = 'requeued', worker_id = NULL
+        WHERE status = 'running' AND worker_id NOT IN
+        (SELECT worker_id FROM workers WHERE heartbeat_at >= ?)""", (cutoff,))
+
+
+def update_progress(job_id, stage, percent):
+    _connect().execute("UPDATE jobs SET stage = ?, percent = ? WHERE id = ?", (stage, percent, job_id))
+
+
+def finish_job(job_id, error=None):
+    status = "failed" if error else "done"
+    _connect().execute(
+        "UPDATE jobs SET status = ?, stage = ?, percent = CASE WHEN ? THEN percent ELSE 100 END, "
+        "error = ?, finished_at = ? WHERE id = ?",
+        (status, status, bool(error), error, time.time(), job_id))
+
+
+def heartbeat(worker_id):
+    _connect().execute("INSERT OR REPLACE INTO workers (worker_id, heartbeat_at) VALUES (?, ?)",
+                       (worker_id, time.time()))
+
+
+def remove_worker(worker_id):
+    _connect().execute("DELETE FROM workers WHERE worker_id = ?", (worker_id,))
+
+
+def active_workers():
+    cutoff = time.time() - INGEST_WORKER_STALE_SECONDS
+    return [row["worker_id"] for row in
+            _connect().execute("SELECT worker_id FROM workers WHERE heartbeat_at >= ?", (cutoff,))]
+
+
+def queue_depth():
+    return _connect().execute("SELECT COUNT(*) AS depth FROM jobs WHERE status = 'queued'").fetchone()["depth"]
+
+
+def recent_jobs(limit=20):
+    """Latest jobs first, without their payload"""
+    return _connect().execute(
+        "SELECT id, media_label, status, stage, percent, error, created_at, started_at, finished_at "
+        "FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()
+
+
+def default_worker_id(index):
+    return f"{os.uname().nodename}-{os.getpid()}-{index}"
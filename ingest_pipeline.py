@@ -0,0 +1,89 @@
+import multiprocessing
+import pickle
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from constants import INGEST_DOWNLOAD_WORKERS, INGEST_PROCESS_WORKERS, INGEST_MAX_PENDING
+from video_index.video_processing.ingest_video import Video
+
+# Staged ingestion: downloads run on threads, transcription and frame
+# extraction run in a process pool, and a semaphore bounds how many
+# downloaded videos may wait for processing so disk and memory stay bounded.
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def get_process_pool():
+    """Process pool shared by every ingestion in this process"""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            # Spawn so workers do not inherit the threads of the web server
+            _process_pool = ProcessPoolExecutor(max_workers=INGEST_PROCESS_WORKERS,
+                                                mp_context=multiprocessing.get_context("spawn"))
+        return _process_pool
+
+
+def process_video(video, storage_path):
+    """CPU heavy stage: audio and transcript extraction, then frame extraction"""
+    video_path, audio_path, text_path = video.process_video_with_index(storage_path)
+    video.extract_images_with_index(storage_path)
+    return video_path, audio_path, text_path
+
+
+def _load_video(source):
+    kind, location = source
+    if kind == "youtube":
+        video = Video.from_url(location)
+        video.download()
+    else:
+        video = Video.from_file(location)
+    return video
+
+
+def ingest_sources(sources, storage_path, max_pending=INGEST_MAX_PENDING, on_stage=None):
+    """Ingest ("youtube", url) or ("file", path) sources concurrently.
+
+    Yields (source, paths, error) in completion order, where paths is the
+    (video_path, audio_path, text_path) tuple of a finished video. on_stage is
+    called with (source, stage) from the download threads as a video moves
+    through "waiting", "downloading" and "processing".
+    """
+    on_stage = on_stage or (lambda source, stage: None)
+    results = queue.Queue()
+    slots = threading.BoundedSemaphore(max_pending)
+    process_pool = get_process_pool()
+
+    def finish(source, future):
+        slots.release()
+        error = future.exception()
+        results.put((source, None if error else future.result(), error))
+
+    def download_and_submit(source, threads):
+        # Backpressure: wait until fewer than max_pending videos are downloaded or processing
+        on_stage(source, "waiting")
+        slots.acquire()
+        try:
+            on_stage(source, "downloading")
+            video = _load_video(source)
+            on_stage(source, "processing")
+            try:
+                pickle.dumps(video)
+                future = process_pool.submit(process_video, video, storage_path)
+            except (pickle.PicklingError, TypeError, AttributeError):
+                print(f"Video for {source[1]} cannot be sent to a worker process, processing on a thread")
+                future = threads.submit(process_video, video, storage_path)
+            future.add_done_callback(lambda f: finish(source, f))
+        except Exception as e:
+            slots.release()
+            results.put((source, None, e))
+
+    # Downloads may wait on the semaphore, so processing fallbacks get their own threads
+    with ThreadPoolExecutor(max_workers=INGEST_DOWNLOAD_WORKERS, thread_name_prefix="ingest-download") as downloads, \
+            ThreadPoolExecutor(max_workers=INGEST_PROCESS_WORKERS, thread_name_prefix="ingest-process") as threads:
+        for source in sources:
+            downloads.submit(download_and_submit, source, threads)
+        for _ in sources:
+            yield results.get()
@@ -0,0 +1,243 @@
+"""Background ingestion worker.
+
+Claims jobs queued by the Media Processor page and runs them outside the
+Streamlit process, so a page refresh or a dropped websocket does not kill
+the work. Run one or more of these next to the web apps:
+
+    python ingest_worker.py --workers 2
+"""
+import argparse
+import signal
+import threading
+import time
+import traceback
+
+from constants import (KNOWLEDGE_BASE_PATH, INGEST_JOB_WORKERS, INCREMENTAL_EVENT_TAGS, EVENT_TAGS_MODEL,
+                       EVENT_TAGS_TRANSCRIPT_CHARS)
+from event_tags import merge_event_tags, seed_legacy_candidates
+from index_registry import get_index_registry
+from ingest_jobs import claim_next_job, update_progress, finish_job, heartbeat, remove_worker, default_worker_id
+from ingest_pipeline import ingest_sources
+from media_fingerprints import fingerprint_source, lookup, record
+from thumbnails import title_thumbnail
+from recall_utils import load_state, update_event
+from video_index.rags.text_rag import save_processed_document, generate_tags_and_images
+
+HEARTBEAT_INTERVAL_SECONDS = 10
+# Tags asked per appended video when the event has none yet
+DEFAULT_TAG_COUNT = 8
+# Share of a video's progress reached when it enters each stage
+STAGE_WEIGHTS = {"waiting": 0.0, "downloading": 0.1, "processing": 0.3, "indexing": 0.8, "done": 1.0, "failed": 1.0}
+
+
+def media_tag_candidates(media_paths, tag_count):
+    """Tags for each new video, from its transcript.
+
+    The event index is already built by then, so the candidates come from the
+    text the index was built from instead of a second index per video. They
+    have no title image; the event keeps the image of a video that has one.
+    """
+    from openai import OpenAI
+    candidates = {}
+    for video_path, text_path in zip(media_paths["video_paths"], media_paths["text_paths"]):
+        with open(text_path, "r", errors="replace") as f:
+            transcript = f.read(EVENT_TAGS_TRANSCRIPT_CHARS)
+        response = OpenAI().chat.completions.create(model=EVENT_TAGS_MODEL, messages=[
+            {"role": "system", "content": f"List the {tag_count} main topics of this talk as short tags of one "
+                                          "to three words. Answer with the tags only, separated by commas."},
+            {"role": "user", "content": transcript},
+        ])
+        tags = [tag.strip() for tag in response.choices[0].message.content.split(",") if tag.strip()]
+        candidates[video_path] = {"tags": tags[:tag_count], "title_image": None}
+    return candidates
+
+
+def add_media_to_knowledge_base(media_label, media_paths):
+    """Index new media for an event and persist the updated event"""
+    # Cheap check on the latest snapshot; the write below merges with the stored event again
+    event_data = load_state(KNOWLEDGE_BASE_PATH).get(media_label, {})
+    if set(media_paths["video_paths"]) <= set(event_data.get("video_paths", [])):
+        print(f"{media_paths['video_paths']} already in {media_label}, skipping")
+        return
+    is_new_event = not event_data.get("video_paths")
+    index_registry = get_index_registry()
+    indexes = {}
+    if (index := index_registry.peek(media_label)) is not None:
+        indexes[media_label] = index
+    save_processed_document(media_label, media_paths["video_paths"], indexes)
+
+    event_tags = None
+    new_media_tags = {}
+    if not INCREMENTAL_EVENT_TAGS:
+        event_tags = generate_tags_and_images(media_label, indexes)
+    elif is_new_event and len(media_paths["video_paths"]) == 1:
+        # The event index only holds the new video, so it doubles as its candidate
+        tags_and_imgs = generate_tags_and_images(media_label, indexes)
+        new_media_tags[media_paths["video_paths"][0]] = {"tags": tags_and_imgs["tags"],
+                                                         "title_image": tags_and_imgs["title_image"]}
+    else:
+        new_media_tags = media_tag_candidates(media_paths, len(event_data.get("tags", [])) or DEFAULT_TAG_COUNT)
+
+    # Thumbnails are encoded before the write transaction, which only records their paths.
+    # The title image is picked inside it, from these candidates and the stored ones.
+    title_images = {event_data.get("title_image")}
+    title_images.update(tags.get("title_image") for tags in (event_data.get("media_tags") or {}).values())
+    title_images.update(tags.get("title_image") for tags in new_media_tags.values())
+    if event_tags is not None:
+        title_images.add(event_tags["title_image"])
+    thumbnails = {image: title_thumbnail(image) for image in title_images if image}
+
+    def merge(event_data):
+        # Runs inside the store's write transaction, on the event as other jobs left it
+        media_tags = seed_legacy_candidates(event_data)
+        for media_type, paths in media_paths.items():
+            known = set(event_data.get(media_type, []))
+            event_data.setdefault(media_type, []).extend(path for path in paths if path not in known)
+        # Lets the web apps know their copy of this index is stale
+        event_data["index_version"] = event_data.get("index_version", 0) + 1
+        if event_tags is not None:
+            event_data["tags"] = event_tags["tags"]
+            event_data["title_image"] = event_tags["title_image"]
+        else:
+            media_tags.update(new_media_tags)
+            tags, title_image, image_scores = merge_event_tags(media_tags)
+            for video_path, score in image_scores.items():
+                media_tags[video_path]["image_score"] = score
+            event_data["media_tags"] = media_tags
+            event_data["tags"] = tags
+            event_data["title_image"] = title_image
+        event_data["title_thumbnail"] = thumbnails.get(event_data.get("title_image"))
+        return event_data
+
+    event_data = update_event(KNOWLEDGE_BASE_PATH, media_label, merge)
+    if event_data.get("title_image") and event_data["title_image"] not in thumbnails:
+        # Another job changed the candidates meanwhile: encode its thumbnail now and record it
+        # unless the title image changed again
+        title_image = event_data["title_image"]
+        if thumbnail := title_thumbnail(title_image):
+            update_event(KNOWLEDGE_BASE_PATH, media_label, lambda current: (
+                {**current, "title_thumbnail": thumbnail} if current.get("title_image") == title_image else None))
+    if media_label in indexes:
+        index_registry.put(media_label, indexes[media_label], event_data["index_version"])
+
+
+def media_paths_for(paths):
+    video_path, audio_path, text_path = paths
+    media_paths = {
+        "text_paths": [text_path]
+    }
+    if audio_path != video_path:
+        media_paths["video_paths"] = [video_path]
+    if text_path != audio_path:
+        media_paths["audio_paths"] = [audio_path]
+    return media_paths
+
+
+def run_job(job):
+    job_id, media_label = job["id"], job["media_label"]
+    fingerprints = job.get("fingerprints", {})
+    reused = [tuple(paths) for paths in job.get("reused", [])]
+    sources = []
+    for source in (tuple(source) for source in job["sources"]):
+        location = source[1]
+        try:
+            if location not in fingerprints:
+                fingerprints[location] = fingerprint_source(source)
+        except OSError as e:
+            print(f"Job {job_id}: cannot fingerprint {location}: {e}")
+        # A job with the same media may have finished since this one was queued
+        if known := lookup(fingerprints.get(location)):
+            reused.append(known)
+        else:
+            sources.append(source)
+    stages = {source: "waiting" for source in sources}
+    stages.update({("reused", paths[0]): "indexing" for paths in reused})
+    lock = threading.Lock()
+
+    def report(source, stage):
+        with lock:
+            stages[source] = stage
+            counts = {}
+            for s in stages.values():
+                counts[s] = counts.get(s, 0) + 1
+            percent = 100 * sum(STAGE_WEIGHTS[s] for s in stages.values()) / len(stages)
+            summary = ", ".join(f"{count} {s}" for s, count in counts.items())
+        update_progress(job_id, summary, percent)
+
+    def attach(source, paths):
+        report(source, "indexing")
+        try:
+            add_media_to_knowledge_base(media_label, media_paths_for(paths))
+            report(source, "done")
+        except Exception as e:
+            traceback.print_exc()
+            errors.append(f"{source[1]}: {e}")
+            report(source, "failed")
+
+    print(f"Job {job_id}: ingesting {len(sources)} video(s) and reusing {len(reused)} for {media_label}")
+    errors = []
+    for paths in reused:
+        attach(("reused", paths[0]), paths)
+    for source, paths, error in ingest_sources(sources, job["storage_path"], on_stage=report):
+        if error:
+            print(f"Job {job_id}: error processing {source[1]}: {error}")
+            errors.append(f"{source[1]}: {error}")
+            report(source, "failed")
+            continue
+        record(fingerprints.get(source[1]), paths)
+        attach(source, paths)
+    finish_job(job_id, "\n".join(errors) or None)
+    print(f"Job {job_id}: finished with {len(errors)} error(s)")
+
+
+def work(worker_id, stop, poll_interval):
+    while not stop.is_set():
+        job = claim_next_job(worker_id)
+        if not job:
+            stop.wait(poll_interval)
+            continue
+        try:
+            run_job(job)
+        except Exception as e:
+            traceback.print_exc()
+            finish_job(job["id"], str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background ingestion workers")
+    parser.add_argument("--workers", type=int, default=INGEST_JOB_WORKERS, help="jobs processed concurrently")
+    parser.add_argument("--poll-interval", type=float, default=2.0)
+    args = parser.parse_args()
+
+    stop = threading.Event()
+
+    def request_stop(signum, frame):
+        if not stop.is_set():
+            print("Stopping after the current jobs finish...")
+        stop.set()
+
+    # systemd stops the service with SIGTERM; finish the running jobs first
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    worker_ids = [default_worker_id(i) for i in range(args.workers)]
+    for worker_id in worker_ids:
+        heartbeat(worker_id)
+    threads = [threading.Thread(target=work, args=(worker_id, stop, args.poll_interval), name=worker_id)
+               for worker_id in worker_ids]
+    for thread in threads:
+        thread.start()
+    print(f"Started {args.workers} ingestion worker(s)")
+    try:
+        # Keep sending heartbeats until the running jobs are done, otherwise
+        # other workers would requeue them
+        while any(thread.is_alive() for thread in threads):
+            time.sleep(HEARTBEAT_INTERVAL_SECONDS)
+            for worker_id in worker_ids:
+                heartbeat(worker_id)
+    finally:
+        for worker_id in worker_ids:
+            remove_worker(worker_id)
+
+
+if __name__ == "__main__":
+    main()
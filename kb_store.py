@@ -0,0 +1,149 @@
+import copy
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# SQLite backed knowledge base store. Every event is one row, so updates are
+# atomic per event and WAL mode lets the Streamlit and Chainlit processes read
+# while another process writes.
+
+
+def open_connection(db_path):
+    """Autocommit connection in WAL mode; callers open explicit transactions"""
+    conn = sqlite3.connect(db_path, timeout=30, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def db_path_for(file_path):
+    root, _ = os.path.splitext(file_path)
+    return root + ".db"
+
+
+class KnowledgeBaseStore:
+    """Per-event upserts with a cached snapshot that is only reloaded when the
+    store version changes. The legacy JSON file is imported on first use.
+    """
+
+    def __init__(self, json_path):
+        self.json_path = json_path
+        self.db_path = db_path_for(json_path)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._snapshot = {}
+        self._version = -1
+        self._init_db()
+
+    def _connect(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = open_connection(self.db_path)
+        return conn
+
+    def _init_db(self):
+        conn = self._connect()
+        conn.execute("""CREATE TABLE IF NOT EXISTS events (
+            media_label TEXT PRIMARY KEY,
+            data TEXT NOT NULL,
+            version INTEGER NOT NULL,
+            updated_at REAL NOT NULL)""")
+        conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('version', 0)")
+        self._migrate_json(conn)
+
+    def _migrate_json(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            migrated = conn.execute("SELECT value FROM meta WHERE key = 'json_migrated'").fetchone()
+            if not migrated and os.path.exists(self.json_path):
+                with open(self.json_path, "r") as f:
+                    legacy_state = json.load(f)
+                print(f"Migrating {len(legacy_state)} events from {self.json_path} to {self.db_path}")
+                self._write_events(conn, legacy_state)
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('json_migrated', 1)")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _write_events(self, conn, events):
+        # Caller must hold a write transaction
+        conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+        version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+        now = time.time()
+        conn.executemany(
+            """INSERT INTO events (media_label, data, version, updated_at) VALUES (?, ?, ?, ?)
+            ON CONFLICT(media_label) DO UPDATE SET data = excluded.data, version = excluded.version,
+            updated_at = excluded.updated_at""",
+            [(media_label, json.dumps(event_data), version, now) for media_label, event_data in events.items()])
+
+    def version(self):
+        return self._connect().execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def upsert_events(self, events):
+        """Atomically insert or replace the given events, leaving the others untouched"""
+        if not events:
+            return
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._write_events(conn, events)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def upsert_event(self, media_label, event_data):
+        self.upsert_events({media_label: event_data})
+
+    def update_event(self, media_label, update):
+        """Read-modify-write one event in a single write transaction.
+
+        update receives the stored event (an empty dict for a new one) and
+        returns the event to write, or None to leave it unchanged. Concurrent
+        writers wait for the transaction, so no update is lost.
+        """
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute("SELECT data FROM events WHERE media_label = ?", (media_label,)).fetchone()
+            event_data = update(json.loads(row[0]) if row else {})
+            if event_data is not None:
+                self._write_events(conn, {media_label: event_data})
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return event_data
+
+    def snapshot(self):
+        """Return a copy of all events, reading only the rows changed since the last call"""
+        with self._lock:
+            if self.version() != self._version:
+                conn = self._connect()
+                conn.execute("BEGIN")
+                try:
+                    version = conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+                    rows = conn.execute("SELECT media_label, data FROM events WHERE version > ?",
+                                        (self._version,)).fetchall()
+                finally:
+                    conn.execute("COMMIT")
+                for media_label, data in rows:
+                    self._snapshot[media_label] = json.loads(data)
+                self._version = version
+            return copy.deepcopy(self._snapshot)
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_store(file_path):
+    """Return the store for a knowledge base path, shared by the whole process"""
+    with _stores_lock:
+        if file_path not in _stores:
+            _stores[file_path] = KnowledgeBaseStore(file_path)
+        return _stores[file_path]
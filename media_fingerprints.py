@@ -0,0 +1,156 @@
+import hashlib
+import os
+import threading
+import time
+from urllib.parse import urlparse, parse_qs
+
+from constants import MEDIA_FINGERPRINTS_DB_PATH
+from kb_store import open_connection
+
+# Content fingerprints of ingested media, so a YouTube video or an uploaded
+# file that was processed before is attached from its existing transcript,
+# audio and frames instead of being downloaded and processed again.
+# Fingerprints are "youtube:<video id>" or "sha256:<hex digest of the bytes>".
+
+_YOUTUBE_ID_LENGTH = 11
+_HASH_CHUNK_BYTES = 1 << 20
+_local = threading.local()
+
+
+def _connect(db_path=MEDIA_FINGERPRINTS_DB_PATH):
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    if db_path not in conns:
+        conn = open_connection(db_path)
+        conn.execute("""CREATE TABLE IF NOT EXISTS fingerprints (
+            fingerprint TEXT PRIMARY KEY,
+            video_path TEXT NOT NULL,
+            audio_path TEXT NOT NULL,
+            text_path TEXT NOT NULL,
+            created_at REAL NOT NULL)""")
+        conns[db_path] = conn
+    return conns[db_path]
+
+
+def youtube_video_id(url):
+    """Video id of a watch, youtu.be, shorts, embed or live URL, else None"""
+    url = url.strip()
+    if "://" not in url:
+        url = "https://" + url
+    parsed = urlparse(url)
+    host = parsed.netloc.lower().split(":")[0]
+    if host.startswith("www."):
+        host = host[4:]
+    parts = [part for part in parsed.path.split("/") if part]
+    video_id = None
+    if host == "youtu.be" and parts:
+        video_id = parts[0]
+    elif host in {"youtube.com", "youtube-nocookie.com"} or host.endswith(".youtube.com"):
+        if parts[:1] == ["watch"]:
+            video_id = parse_qs(parsed.query).get("v", [None])[0]
+        elif len(parts) >= 2 and parts[0] in {"shorts", "embed", "live", "v"}:
+            video_id = parts[1]
+    if video_id and len(video_id) == _YOUTUBE_ID_LENGTH:
+        return video_id
+    return None
+
+
+def fingerprint_youtube(url):
+    video_id = youtube_video_id(url)
+    return f"youtube:{video_id}" if video_id else None
+
+
+def fingerprint_file(file_obj):
+    """Hash a binary file object in chunks and rewind it for the next reader"""
+    digest = hashlib.sha256()
+    file_obj.seek(0)
+    while chunk := file_obj.read(_HASH_CHUNK_BYTES):
+        digest.update(chunk)
+    file_obj.seek(0)
+    return f"sha256:{digest.hexdigest()}"
+
+
+class HashingReader:
+    """Wraps an uploaded file so the bytes are hashed while they are saved.
+
+    Reads are hashed in order; if the saver skips or rereads bytes, or does
+    not read them all, fingerprint() hashes the file again.
+    """
+
+    def __init__(self, file_obj):
+        self._file = file_obj
+        self._digest = hashlib.sha256()
+        self._hashed = 0
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def _update(self, position, data):
+        if position <= self._hashed < position + len(data):
+            self._digest.update(data[self._hashed - position:])
+            self._hashed = position + len(data)
+
+    def read(self, size=-1):
+        position = self._file.tell()
+        data = self._file.read(size)
+        self._update(position, data)
+        return data
+
+    def getvalue(self):
+        data = self._file.getvalue()
+        self._update(0, data)
+        return data
+
+    def getbuffer(self):
+        data = self._file.getbuffer()
+        self._update(0, data)
+        return data
+
+    def fingerprint(self):
+        position = self._file.tell()
+        size = self._file.seek(0, os.SEEK_END)
+        self._file.seek(position)
+        if self._hashed != size:
+            return fingerprint_file(self._file)
+        return f"sha256:{self._digest.hexdigest()}"
+
+
+def fingerprint_path(path):
+    with open(path, "rb") as f:
+        return fingerprint_file(f)
+
+
+def fingerprint_source(source):
+    kind, location = source
+    if kind == "youtube":
+        return fingerprint_youtube(location)
+    return fingerprint_path(location)
+
+
+def lookup(fingerprint):
+    """(video_path, audio_path, text_path) of already processed media, or None"""
+    if not fingerprint:
+        return None
+    row = _connect().execute("SELECT video_path, audio_path, text_path FROM fingerprints WHERE fingerprint = ?",
+                             (fingerprint,)).fetchone()
+    if row is None:
+        return None
+    if not all(os.path.exists(path) for path in row):
+        # The artifacts were deleted, the media has to be processed again
+        forget(fingerprint)
+        return None
+    return tuple(row)
+
+
+def record(fingerprint, paths):
+    if not fingerprint:
+        return
+    video_path, audio_path, text_path = paths
+    _connect().execute(
+        "INSERT OR REPLACE INTO fingerprints (fingerprint, video_path, audio_path, text_path, created_at) "
+        "VALUES (?, ?, ?, ?, ?)", (fingerprint, video_path, audio_path, text_path, time.time()))
+
+
+def forget(fingerprint):
+    _connect().execute("DELETE FROM fingerprints WHERE fingerprint = ?", (fingerprint,))
@@ -6,11 +6,22 @@ import time
 import asyncio
 from pathlib import Path
 import speech_recognition as sr
-from concurrent.futures import ThreadPoolExecutor
-from constants import KNOWLEDGE_BASE_PATH, demo_media_labels
-from recall_utils import load_state, generate_videoclips
-from video_index.rags.text_rag import search_knowledge_base, create_new_index, get_llm_response, get_mm_llm_response, get_media_indices, get_llm_tts_response
-from video_index.rags.scraper import perform_web_search
+from uuid import uuid4
+from constants import (KNOWLEDGE_BASE_PATH, CHAT_WORKERS, TRACE_DEBUG_PANEL, TTS_STREAMING, EVENT_GRID_PAGE_SIZE,
+                       CHAT_HISTORY_EAGER_TURNS, demo_media_labels)
+from recall_utils import load_state, generate_videoclips, get_thread_pool
+from index_registry import get_index_registry
+from tracing import get_tracer, start_turn
+from speech_stream import SentenceSpeaker
+from stt_service import get_stt_service
+from event_catalog import get_catalog
+from chat_store import append_message, clear_messages, load_messages, reset_messages, turn_count
+from chat_context import build_context, summarize_in_background
+from session_loop import EventLoopGuard, cancel_pending_tasks, close_event_loop
+from federated_search import ALL_EVENTS_LABEL, coverage_note, federated_search
+from retrieval_cache import get_retrieval_cache, cached_search_knowledge_base, cached_get_media_indices
+from video_index.rags.text_rag import get_llm_response, get_mm_llm_response, get_llm_tts_response
+from web_search import get_web_search
 from streamlit_extras.bottom_container import bottom
 from streamlit_mic_recorder import mic_recorder
 
@@ -71,31 +82,32 @@ st.markdown("""
 # Initialize session state for the current app phase
 if "phase" not in st.session_state:
     st.session_state.phase = "starters"  # The initial phase is the starter prompts
-if "messages" not in st.session_state:
-    st.session_state.messages = []  # Store chat history
 if "knowledge_base" not in st.session_state:
     st.session_state.knowledge_base = load_state(KNOWLEDGE_BASE_PATH)
-if "indexes" not in st.session_state:
-    st.session_state.indexes = {}
-if "futures" not in st.session_state:
-    st.session_state.futures = {}
+if "index_versions" not in st.session_state:
+    # media_label -> index_version of the chat's indexes, resolved through the registry on each turn
+    st.session_state.index_versions = {}
+
+if "session_id" not in st.session_state:
+    # Also keys the chat history, which lives in the chat store instead of the session state
+    st.session_state.session_id = uuid4().hex[:12]
 
 if "recognizer" not in st.session_state:
        st.session_state.recognizer = sr.Recognizer()
 if "recording" not in st.session_state:
        st.session_state.recording = False
 
-for media_label in st.session_state.knowledge_base.keys():
-    if media_label not in st.session_state.indexes and media_label not in st.session_state.futures:
-        # TODO: Remove the following if block after the Demo
-        if media_label not in demo_media_labels:
-            continue
-        print(f"Index for {media_label} does not exist. Need to add to futures")
-        tp_executor = ThreadPoolExecutor(max_workers=1)
-        future = tp_executor.submit(create_new_index, media_label)
-        st.session_state.futures[media_label] = [future, tp_executor]
-    else:
-        print(f"Index for {media_label} exists in future or index")
+# Starts loading the shared Whisper model before the first recording
+get_stt_service()
+
+index_registry = get_index_registry()
+for media_label, event_data in st.session_state.knowledge_base.items():
+    # TODO: Remove the following if block after the Demo
+    if media_label not in demo_media_labels:
+        continue
+    # Indexes are built once per process and shared by every session. They are
+    # rebuilt when an ingestion worker bumps the event's index_version.
+    index_registry.prefetch(media_label, event_data.get("index_version"))
         
 def recognize_speech_with_whisper(progress_bar):
     # Use the microphone as the audio source
@@ -105,7 +117,7 @@ def recognize_speech_with_whisper(progress_bar):
         progress_bar.progress(50, text="Listening...")
         audio_data = st.session_state.recognizer.listen(source)
         progress_bar.progress(70, text="Processing user input...")
-        text = st.session_state.recognizer.recognize_whisper(audio_data)
+        text = get_stt_service().transcribe(audio_data.get_wav_data()).text
         progress_bar.progress(100, text="Processing user input...")
         return text
 
@@ -114,27 +126,51 @@ def record_audio(progress_bar):
 
     return transcript
 
-def process_audio(progress_bar, audio_input):
-    #sound_bytes = io.BytesIO(audio_input['bytes'])
-    audio_filename = 'temp.wav'
-    with open(audio_filename, 'wb') as f:
-        f.write(audio_input['bytes'])
-    with sr.AudioFile(audio_filename) as source:
-        progress_bar.progress(30, text="Processing audio...")
-        audio_data = st.session_state.recognizer.record(source)
-        progress_bar.progress(35, text="Transcribing...")
-        text = st.session_state.recognizer.recognize_whisper(audio_data)
-        progress_bar.progress(100, text="Audio transcribed...")
-    return text    
+def process_audio(progress_bar, audio_input, turn=None):
+    # The recording stays in memory and is transcribed by the shared Whisper model
+    progress_bar.progress(35, text="Transcribing...")
+    result = get_stt_service().transcribe(audio_input['bytes'])
+    progress_bar.progress(100, text="Audio transcribed...")
+    print(f"Transcribed in {result.inference_seconds:.2f}s after {result.queue_seconds:.2f}s in queue "
+          f"(batch of {result.batch_size})")
+    if turn:
+        turn.record("stt_queue", result.queue_seconds)
+        turn.record("stt_inference", result.inference_seconds, batch_size=result.batch_size)
+    return result.text    
 
 # Function to generate a response from OpenAI GPT-3.5
-async def get_openai_response(user_query):
+async def get_openai_response(user_query, turn):
     print(f"User query: {user_query}")
     msg = {"role": "user", "content": user_query}
-    st.session_state.messages.append(msg)
+    add_message(msg)
     st.chat_message(msg["role"]).write(msg["content"])
     response_container = st.empty()
-    img_docs, text_docs = search_knowledge_base(user_query, st.session_state.media_label, st.session_state.indexes)
+    loop = asyncio.get_running_loop()
+    executor = get_thread_pool("chat", CHAT_WORKERS)
+    media_label = st.session_state.media_label
+    if media_label == ALL_EVENTS_LABEL:
+        # Fan the query out to every event and keep the best documents overall
+        result = await loop.run_in_executor(
+            executor, turn.traced("federated_search", federated_search), user_query, st.session_state.knowledge_base)
+        print(f"Federated search: {result.report}")
+        coverage = coverage_note(result.report)
+        st.caption(coverage)
+        img_docs, text_docs, indexes = result.img_docs, result.text_docs, result.indexes
+        # Clips and images come from the event with the best match
+        lookup_label = next(iter(result.text_labels + result.img_labels), None)
+        lookup_text_docs = [doc for doc, label in zip(text_docs, result.text_labels) if label == lookup_label]
+        lookup_img_docs = [doc for doc, label in zip(img_docs, result.img_labels) if label == lookup_label]
+        lookup_indexes = {lookup_label: indexes[lookup_label]} if lookup_label else {}
+    else:
+        coverage = None
+        indexes = await loop.run_in_executor(executor, resolve_indexes, dict(st.session_state.index_versions))
+        # Retrieval runs on the shared executor so the event loop stays free
+        img_docs, text_docs = await loop.run_in_executor(
+            executor, turn.traced("search", cached_search_knowledge_base), user_query, media_label, indexes,
+            st.session_state.knowledge_base[media_label].get("index_version"))
+        lookup_label, lookup_text_docs, lookup_img_docs, lookup_indexes = media_label, text_docs, img_docs, indexes
+    # Retrieval results are cached per event until new media bumps its index_version
+    index_version = st.session_state.knowledge_base.get(lookup_label, {}).get("index_version")
     # prompt = f"""
     #   Context:
     #    {text_docs}
@@ -144,17 +180,31 @@ async def get_openai_response(user_query):
     # Commenting out the sync API call
     # response_text, function_data = await get_llm_response_legacy(user_query, messages=st.session_state.messages, tools_call=False, response_container=response_container)
 
-    # Get images and text index in a separate thread
-    tp_executor = ThreadPoolExecutor(max_workers=1)
-    future = tp_executor.submit(get_media_indices, user_query, text_docs, img_docs, st.session_state.media_label, st.session_state.indexes)
-    response_text, function_data  = await get_mm_llm_response(user_query, text_docs, img_docs, st.session_state.media_label, st.session_state.indexes, response_container)
+    # Look up the images and video segments while the answer streams
+    if lookup_label:
+        media_future = loop.run_in_executor(
+            executor, turn.traced("media_lookup", cached_get_media_indices),
+            user_query, lookup_text_docs, lookup_img_docs, lookup_label, lookup_indexes, index_version)
+    else:
+        media_future = loop.create_future()
+        media_future.set_result(([], []))
+    stream_container = turn.first_token_probe(response_container, "llm_first_token")
+    speaker = None
+    if st.session_state.recording and TTS_STREAMING:
+        # Speak each sentence as soon as it is generated
+        speaker = SentenceSpeaker(stream_container, turn.traced("tts", get_llm_tts_response), executor, st.empty(),
+                                  on_first_audio=lambda: turn.mark_once("first_audio"))
+        stream_container = speaker
+    with turn.span("llm"):
+        response_text, function_data  = await get_mm_llm_response(
+            user_query, text_docs, img_docs, media_label, indexes, stream_container)
     if response_text:
-        st.session_state.messages.append({"role": "assistant", "content": response_text})
+        # A cross-event answer keeps saying how many events it covers
+        add_message({"role": "assistant", "content": f"{response_text}\n\n_{coverage}_" if coverage else response_text})
 
     # Ignore this if condition if the tools_call is set to False
     if function_data:
-        tp_executor = ThreadPoolExecutor(max_workers=len(function_data))
-        futures = []
+        searches = []
         for index, index_data in function_data.items():
             function_name = index_data["name"]
             if arguments := index_data["arguments"]:
@@ -162,31 +212,47 @@ async def get_openai_response(user_query):
             print("Function name: ", function_name)
             print("Arguments: ", arguments)
             if function_name == "perform_web_search":
-                futures.append(tp_executor.submit(perform_web_search, arguments["query"], arguments["media_label"]))
-                print("Web search results: added to threads")
+                searches.append((arguments["query"], arguments["media_label"]))
             else:
                 print("No function found in the response")
         try:
             response_container.markdown("Searching the web for more information...")
-            web_search_results = 'Context: ' + '\n'.join([future.result() for future in futures])
-            st.session_state.messages.append({"role": "system", "content": web_search_results})
+            # Cached and deduplicated; searches that miss the deadline are left out
+            web_search = get_web_search()
+            with turn.span("web_search", searches=len(searches)):
+                results = await loop.run_in_executor(executor, web_search.search_many, searches)
+            print(f"Web search: {len(results)} of {len(searches)} result(s), {web_search.stats()}")
+            web_search_results = 'Context: ' + '\n'.join(results)
+            add_message({"role": "system", "content": web_search_results})
             print("Web search results: added to message history")
         except Exception as e:
             print(f"Error performing web search: {e}")
-        tp_executor.shutdown()
-        response_text, function_data = await get_llm_response(user_query, messages=st.session_state.messages, tools_call=False, response_container=response_container)
+        # Recent turns within the token budget, older ones folded into a rolling summary
+        context_messages, context_report = build_context(st.session_state.session_id)
+        summarize_in_background(st.session_state.session_id, context_report, executor)
+        print(f"Context: {context_report}")
+        with turn.span("llm_followup", tokens=context_report["tokens"], turns_sent=context_report["turns_sent"]):
+            response_text, function_data = await get_llm_response(user_query, messages=context_messages, tools_call=False, response_container=stream_container)
         print("Response text in the if: ", response_text)
         print("Function data in the if: ", function_data)
         if response_text:
-            st.session_state.messages.append({"role": "assistant", "content": response_text})
+            add_message({"role": "assistant", "content": response_text})
         else:
-            st.session_state.messages.append({"role": "assistant", "content": "This is all the information I could gather for your question."})
-    if st.session_state.recording:
-        audio_path = get_llm_tts_response(response_text)
+            add_message({"role": "assistant", "content": "This is all the information I could gather for your question."})
+    if speaker:
+        speaker.close(response_text)
+    elif st.session_state.recording:
+        audio_path = await loop.run_in_executor(executor, turn.traced("tts", get_llm_tts_response), response_text)
         st.audio(audio_path, autoplay=True)
-    img_results, text_results = future.result()
-    tp_executor.shutdown()
+    img_results, text_results = await media_future
+    print(f"Retrieval cache: {get_retrieval_cache().stats()}")
+    with turn.span("media_render"):
+        show_media_results(img_results, text_results)
+    if speaker:
+        await speaker.wait()
+    return response_text
 
+def show_media_results(img_results, text_results):
     if text_results:
         new_video_path = './temp/video_clips'
         for doc in text_results[:1]:
@@ -196,12 +262,12 @@ async def get_openai_response(user_query):
             end_time = doc['timestamps'][-1][-1]
 
             #video_data = [{'video_file': video_path, 'timestamps': [start_time, end_time]}]
-            #clips, clip_paths = generate_videoclips(new_video_path, video_data)
+            #clips, clip_paths = generate_videoclips(new_video_path, video_data, fast=True)
             #st.video(clip_paths[0])
             if os.path.exists(video_path):
                 print(f"Adding video: {video_path} from {start_time} to {end_time}")
                 st.video(video_path, start_time=start_time, end_time=end_time)
-                st.session_state.messages.append(
+                add_message(
                     {"role": "assistant", "content": video_path, "is_video": True, "start_time": start_time, "end_time": end_time}
                     )
 
@@ -211,84 +277,150 @@ async def get_openai_response(user_query):
             if os.path.exists(new_img_path):
                 print(f"Displaying image for: {new_img_path}")
                 st.image(new_img_path)
-                st.session_state.messages.append({"role": "assistant", "content": new_img_path, "is_image": True})
+                add_message({"role": "assistant", "content": new_img_path, "is_image": True})
 
 
-    return response_text
 
 # Function to switch to the chat interface
 def switch_to_chat():
     print("Switching to chat on button click")
     st.session_state.phase = "chat"
-    if st.session_state["media_label"] in st.session_state.futures:
-        print(f"Processing index update for {st.session_state['media_label']}")
-        future, tp_executor = st.session_state.futures.pop(st.session_state['media_label'])
-        st.session_state.indexes[st.session_state["media_label"]] = future.result()
-        tp_executor.shutdown()
+    media_label = st.session_state["media_label"]
+    if media_label == ALL_EVENTS_LABEL:
+        # Federated search uses the resident indexes and loads a few others per query
+        st.session_state.index_versions = {}
+        return
+    print(f"Loading shared index for {media_label}")
+    version = st.session_state.knowledge_base[media_label].get("index_version")
+    # Loaded now so the first question does not wait for it
+    index_registry.get(media_label, version)
+    st.session_state.index_versions = {media_label: version}
+
+# Sessions keep labels and versions only: holding the indexes would keep
+# evicted ones alive, and the registry's budget would not bound the process
+def resolve_indexes(index_versions):
+    return {media_label: index_registry.get(media_label, version) for media_label, version in index_versions.items()}
+
+# One event loop per chat session, reused by every turn
+def session_event_loop():
+    loop = st.session_state.get("event_loop")
+    if loop is None or loop.is_closed():
+        loop = st.session_state.event_loop = asyncio.new_event_loop()
+        st.session_state.event_loop_guard = EventLoopGuard(loop)
+    asyncio.set_event_loop(loop)
+    return loop
 
 # Function to switch back to starter prompts
 def switch_to_starters():
     st.session_state.phase = "starters"
-    st.session_state.messages = []  # Optionally clear the chat history when going back
+    st.session_state.pop("event_loop_guard", None)
+    if loop := st.session_state.pop("event_loop", None):
+        close_event_loop(loop)
+    clear_messages(st.session_state.session_id)  # Optionally clear the chat history when going back
+
+def add_message(msg):
+    append_message(st.session_state.session_id, msg)
 
 def update_chat_history(topic):
     system_prompt = f"You are a helpful assistant that helps people answer questions about {topic}."
-    st.session_state["messages"] = [
+    reset_messages(st.session_state.session_id, [
         {"role": "system", "content": system_prompt},
         {"role": "assistant", "content": f"How can I help you answer your questions about \"{topic}\"?"}
-    ]
+    ])
+    st.session_state.history_turns = CHAT_HISTORY_EAGER_TURNS
+    st.session_state.expanded_media = set()
 
-# Display the current chat history in a chat-like format
+def display_media(msg):
+    if msg.get("is_image"):
+        st.image(msg["content"])
+    else:
+        st.video(msg["content"], start_time=msg["start_time"], end_time=msg["end_time"])
+
+# Display the current chat history in a chat-like format. Only the latest turns
+# are loaded, and media of earlier turns stays collapsed until it is clicked.
 def display_chat_history():
-    for msg in st.session_state.messages:
+    session_id = st.session_state.session_id
+    last_turn = turn_count(session_id)
+    first_turn = max(0, last_turn - st.session_state.get("history_turns", CHAT_HISTORY_EAGER_TURNS) + 1)
+    if first_turn > 0 and st.button(f"Show earlier messages ({first_turn} older question(s))"):
+        st.session_state.history_turns = st.session_state.get("history_turns", CHAT_HISTORY_EAGER_TURNS) + CHAT_HISTORY_EAGER_TURNS
+        st.rerun()
+    expanded_media = st.session_state.setdefault("expanded_media", set())
+    for seq, turn, msg in load_messages(session_id, first_turn):
         if msg["role"] in {"user", "assistant"}:
-            if msg.get("is_image"):
-                st.image(msg["content"])
-            elif msg.get("is_video"):
-                st.video(msg["content"], start_time=msg["start_time"], end_time=msg["end_time"])
+            if msg.get("is_image") or msg.get("is_video"):
+                if turn == last_turn or seq in expanded_media:
+                    display_media(msg)
+                    continue
+                if msg.get("is_video"):
+                    label = f"▶ Show video clip ({int(msg['start_time'])}s - {int(msg['end_time'])}s)"
+                else:
+                    label = "🖼 Show image"
+                if st.button(label, key=f"media_{seq}"):
+                    expanded_media.add(seq)
+                    display_media(msg)
             else:
                 st.chat_message(msg["role"]).write(msg["content"])
 
+# Latency of the chat stages in this process, enabled with ?debug=1
+def show_latency_panel():
+    tracer = get_tracer()
+    with st.sidebar.expander("Latency", expanded=True):
+        rows = [{"stage": stage, **{k: round(v, 3) if isinstance(v, float) else v for k, v in stats.items()}}
+                for (app, stage), stats in tracer.percentiles("knowledge_base").items()]
+        st.dataframe(rows, hide_index=True)
+        if turn_id := st.session_state.get("last_turn_id"):
+            st.caption("Last turn")
+            st.dataframe([{"stage": span["stage"], "seconds": span["seconds"]}
+                          for span in tracer.recent_spans(turn_id)], hide_index=True)
+
+# A rerun may have interrupted the previous turn with tasks still pending
+if "event_loop" in st.session_state:
+    cancel_pending_tasks(st.session_state.event_loop)
+
 # Streamlit layout
 st.title("Knowledge Base for Events")
 
 # PHASE: Starter Prompts
 if st.session_state.phase == "starters":
 
-    if st.session_state.setdefault("knowledge_base", load_state(KNOWLEDGE_BASE_PATH)):
-        starter_prompts = []
+    # Built once per knowledge base version and shared by every session
+    catalog = get_catalog(KNOWLEDGE_BASE_PATH)
+    st.session_state.knowledge_base = catalog.knowledge_base
+    if st.session_state.knowledge_base:
         #st.write("Chat with one of the events below to get more information about the event.")
-        for media_label, event_data in st.session_state.knowledge_base.items():
-            if event_data.get("title_image"):
-                image_path = os.path.join(os.getcwd(), event_data.get("title_image"))
-            else:
-                image_path = f"https://via.placeholder.com/150?text={media_label.replace(' ', '+')}"
-            starter_prompts.append({
-                "title": media_label,
-                "tags": event_data["tags"],
-                "image": image_path
-            })
-        # Extract all unique tags from the events data
-        all_tags = sorted(set(tag for event in starter_prompts for tag in event['tags']))
-
+        search_text = st.text_input("Search events", placeholder="Search event titles")
                 # Multi-select search bar with pre-filled tags
-        selected_tags = st.multiselect("Select filter(s) below to get the related events for your search", all_tags, default=[])
-
-        # Filter the events based on the selected tags
-        if selected_tags:
-            filtered_events = [event for event in starter_prompts if any(tag in event["tags"] for tag in selected_tags)]
-        else:
-            filtered_events = starter_prompts
-
-        subtitle = "Query Results" if selected_tags else "Events Information"
-        res_suffix = "result" if selected_tags else "event"
+        selected_tags = st.multiselect("Select filter(s) below to get the related events for your search", catalog.all_tags, default=[])
+        match_all = len(selected_tags) > 1 and st.toggle("Match all selected filters")
+
+        # Filter the events through the tag and title indexes
+        filtered_labels = catalog.query(selected_tags, match_all=match_all, text=search_text)
+        is_query = bool(selected_tags or search_text.strip())
+        # Go back to the first page whenever the filters change
+        filters = (search_text, tuple(selected_tags), match_all)
+        if st.session_state.get("grid_filters") != filters:
+            st.session_state.grid_filters = filters
+            st.session_state.grid_page = 0
+        page_count = max(1, -(-len(filtered_labels) // EVENT_GRID_PAGE_SIZE))
+        page = min(st.session_state.grid_page, page_count - 1)
+        filtered_events = [catalog.events[media_label] for media_label in
+                           filtered_labels[page * EVENT_GRID_PAGE_SIZE:(page + 1) * EVENT_GRID_PAGE_SIZE]]
+
+        subtitle = "Query Results" if is_query else "Events Information"
+        res_suffix = "result" if is_query else "event"
 
         st.markdown(f'<h3 class="query-results-title">{subtitle}</h3>', unsafe_allow_html=True)
         st.markdown('<h7 class="query-results-title">Chat with one of the events below to get more information about the event.</h7>', unsafe_allow_html=True)
+        if st.button("Or ask a question across all events", key="all_events"):
+            st.session_state["media_label"] = ALL_EVENTS_LABEL
+            update_chat_history("all the events in the knowledge base")
+            switch_to_chat()
+            st.rerun()
         st.markdown('<hr>', unsafe_allow_html=True)
 
         # Display number of results in a highlighted tag style
-        st.markdown(f'<span style="background-color:#E0F7FA; color:black; padding:3px 10px; border-radius:5px;">{len(filtered_events)} {res_suffix}(s)</span>', unsafe_allow_html=True)
+        st.markdown(f'<span style="background-color:#E0F7FA; color:black; padding:3px 10px; border-radius:5px;">{len(filtered_labels)} {res_suffix}(s)</span>', unsafe_allow_html=True)
 
         # Display filtered events
         cols = st.columns(3)  # Set up a multi-column layout
@@ -306,6 +438,17 @@ if st.session_state.phase == "starters":
                 tags_html = " ".join([f'<span class="app-tags">{tag}</span>' for tag in event["tags"]])
                 st.markdown(f'<div class="app-tags-container">{tags_html}</div>', unsafe_allow_html=True)
 
+        # Only the current page of cards is rendered
+        if page_count > 1:
+            prev_col, page_col, next_col = st.columns([0.2, 0.6, 0.2])
+            if prev_col.button("‹ Previous", key="grid_prev", disabled=page == 0):
+                st.session_state.grid_page = page - 1
+                st.rerun()
+            page_col.caption(f"Page {page + 1} of {page_count}")
+            if next_col.button("Next ›", key="grid_next", disabled=page >= page_count - 1):
+                st.session_state.grid_page = page + 1
+                st.rerun()
+
         # If no results found
         if not filtered_events:
             st.warning("No events found matching your search.")
@@ -320,6 +463,9 @@ if st.session_state.phase == "chat":
     go_back_button = st.button("Go Back to Knowledge Base")
     display_chat_history()
 
+    # Spans of this turn are tagged with the session and event
+    turn = start_turn("knowledge_base", st.session_state.session_id, st.session_state.media_label)
+
     # Display text input and mic
     with bottom():
         progress_bar  = st.empty()
@@ -335,7 +481,8 @@ if st.session_state.phase == "chat":
             audio_input = mic_recorder(start_prompt="🎤", stop_prompt="⏹️", format="wav", key='st_recorder')
             if audio_input:
                 progress_bar.progress(0, text="Processing audio...")
-                user_input = process_audio(progress_bar, audio_input)
+                with turn.span("transcription"):
+                    user_input = process_audio(progress_bar, audio_input, turn)
                 print("Result from Audio Processing: ", user_input)
                 progress_bar.empty()
                 st.session_state.recording = True
@@ -348,13 +495,18 @@ if st.session_state.phase == "chat":
             #     st.session_state.recording = True
 
     if user_input:
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(get_openai_response(user_input))
+        try:
+            session_event_loop().run_until_complete(get_openai_response(user_input, turn))
+        finally:
+            turn.end(voice=st.session_state.recording)
+        st.session_state.last_turn_id = turn.turn_id
         # st.rerun()  # Update the chat with the new message
         print("Setting recording back to False")
         st.session_state.recording = False
 
+    if TRACE_DEBUG_PANEL or st.query_params.get("debug") == "1":
+        show_latency_panel()
+
     # Button to go back to starter prompts
     if go_back_button:
         switch_to_starters()
@@ -4,73 +4,92 @@ import re
 import streamlit as st
 
 from constants import KNOWLEDGE_BASE_PATH
-from recall_utils import update_state
-from video_index.rags.text_rag import save_processed_document, generate_tags_and_images
-from video_index.video_processing.ingest_video import save_uploaded_media, Video
+from ingest_jobs import submit_job, recent_jobs, queue_depth, active_workers
+from media_fingerprints import HashingReader, fingerprint_youtube, lookup
+from recall_utils import load_state
+from video_index.video_processing.ingest_video import save_uploaded_media
 
 
-def provide_post_process_info(media_label, media_paths):
-    file_content = {'media_label': f"{media_label}", 'content': media_paths}
+def provide_post_process_info(media_label, job_id, sources):
+    file_content = {'media_label': f"{media_label}", 'job_id': job_id, 'content': sources}
     print(f'file_content: {file_content}')
-    st.success("Media uploaded successfully!")
-    st.info("You can now go to the knowledge base and ask questions about the media.")
-
-def update_knowledge_base(media_label, media_paths):
-    if "knowledge_base" not in st.session_state:
-        st.session_state.knowledge_base = {}
-    if "indexes" not in st.session_state:
-        st.session_state.indexes = {}
-    st.session_state.knowledge_base.setdefault(media_label, {})
-    for media_type, paths in media_paths.items():
-        st.session_state.knowledge_base[media_label].setdefault(media_type, []).extend(paths)
-    save_processed_document(media_label, media_paths["video_paths"], st.session_state.indexes)
-    tags_and_imgs = generate_tags_and_images(media_label, st.session_state.indexes)
-    st.session_state.knowledge_base[media_label]["tags"] = tags_and_imgs["tags"]
-    st.session_state.knowledge_base[media_label]["title_image"] = tags_and_imgs["title_image"]
-    update_state(KNOWLEDGE_BASE_PATH, st.session_state.knowledge_base)
+    st.success(f"Queued job #{job_id} for {len(sources)} video(s)!")
+    st.info("Processing continues in the background, even if you leave this page. "
+            "You can follow its progress below.")
 
 def process_content(is_youtube_link, media_label, content):
     storage_root_path='./events_kb'
     media_label_path = re.sub(r'[^a-zA-Z0-9]', '_', media_label)
     storage_path = os.path.join(storage_root_path, media_label_path)
-    video_paths = []
-    audio_paths = []
-    text_paths = []
-    
+    event_video_paths = set(load_state(KNOWLEDGE_BASE_PATH).get(media_label, {}).get("video_paths", []))
+    sources = []
+    fingerprints = {}
+    reused = []
+
+    def known_media(name, fingerprint):
+        """Existing artifacts of media processed before, so it is not ingested again"""
+        paths = lookup(fingerprint)
+        if paths is None:
+            return None
+        if paths[0] in event_video_paths:
+            st.info(f"{name} is already part of {media_label}, skipping it.")
+        else:
+            st.info(f"{name} was processed before, reusing its transcript and frames.")
+            reused.append(paths)
+        return paths
+
     if is_youtube_link:
         youtube_links = content.split(',')
-
         for youtube_link in youtube_links:
-            video = Video.from_url(youtube_link.strip())
-            video.download()
-            video_path, audio_path, text_path = video.process_video_with_index(storage_path)
-            video.extract_images_with_index(storage_path)
-
-            video_paths.append(video_path)
-            audio_paths.append(audio_path)
-            text_paths.append(text_path)
+            youtube_link = youtube_link.strip()
+            if not youtube_link:
+                continue
+            fingerprint = fingerprint_youtube(youtube_link)
+            if known_media(youtube_link, fingerprint):
+                continue
+            sources.append(("youtube", youtube_link))
+            if fingerprint:
+                fingerprints[youtube_link] = fingerprint
     else:
-        media_path, file_name, file_ext = save_uploaded_media(content)
-        if file_ext not in {"mp4"}:
-            st.error("Failed to process the uploaded media. Please make sure the media is in a supported format.")
-            return
-        video = Video.from_file(media_path)
-        video_path, audio_path, text_path = video.process_video_with_index(storage_path)
-        video.extract_images_with_index(storage_path)
-        
-        video_paths.append(video_path)
-        audio_paths.append(audio_path)
-        text_paths.append(text_path)
+        for uploaded_file in content:
+            # Hashed while it is saved, instead of reading the upload twice
+            upload = HashingReader(uploaded_file)
+            media_path, file_name, file_ext = save_uploaded_media([upload])
+            fingerprint = upload.fingerprint()
+            if known := known_media(uploaded_file.name, fingerprint):
+                # The new copy is not needed, unless it was saved over the known artifacts
+                if os.path.exists(media_path) and os.path.abspath(media_path) not in map(os.path.abspath, known):
+                    os.remove(media_path)
+                continue
+            if file_ext not in {"mp4"}:
+                st.error(f"Failed to process {uploaded_file.name}. Please make sure the media is in a supported format.")
+                continue
+            sources.append(("file", media_path))
+            fingerprints[media_path] = fingerprint
+
+    if not sources and not reused:
+        return
+    # The ingestion worker processes the job, so the page is not blocked
+    job_id = submit_job(media_label, sources, storage_path, fingerprints=fingerprints, reused=reused)
+    provide_post_process_info(media_label, job_id, sources + [("reused", paths[0]) for paths in reused])
 
-    media_paths = {
-        "text_paths": text_paths
-    }
-    if audio_paths != video_paths:
-        media_paths["video_paths"] = video_paths
-    if text_paths != audio_paths:
-        media_paths["audio_paths"] = audio_paths
-    provide_post_process_info(media_label, media_paths)
-    update_knowledge_base(media_label, media_paths)
+@st.fragment(run_every=2)
+def show_ingestion_progress():
+    jobs = recent_jobs(limit=10)
+    if not jobs:
+        return
+    workers = active_workers()
+    st.markdown("##### Ingestion jobs")
+    st.caption(f"{queue_depth()} job(s) queued, {len(workers)} worker(s) running")
+    if not workers:
+        st.warning("No ingestion worker is running. Start one with `python ingest_worker.py`.")
+    for job in jobs:
+        label = f"#{job['id']} {job['media_label']}: {job['status']}"
+        if job["stage"] and job["stage"] != job["status"]:
+            label += f" ({job['stage']})"
+        st.progress(int(job["percent"]), text=label)
+        if job["error"]:
+            st.error(job["error"])
 
 def setup_media_processor_page():
     app_header = st.container()
@@ -91,9 +110,9 @@ def setup_media_processor_page():
             if youtube_links:
                 print(f'media_label: {media_label}')
                 print(f'youtube_links: {youtube_links}')
-                with st.spinner("🔍 Extracting transcript...(might take a while)"):
-                    process_content(is_youtube_link=True, media_label=media_label, content=youtube_links)
+                process_content(is_youtube_link=True, media_label=media_label, content=youtube_links)
             if uploaded_media:
-                with st.spinner("🔍 Reading the media... (might take a while)"):
+                with st.spinner("🔍 Reading the media..."):
                     process_content(is_youtube_link=False, media_label=media_label, content=uploaded_media)
+    show_ingestion_progress()
 setup_media_processor_page()
@@ -0,0 +1,141 @@
+import asyncio
+import time
+from collections import deque
+
+from constants import REALTIME_POOL_SIZE, REALTIME_POOL_IDLE_SECONDS, REALTIME_POOL_CHECK_SECONDS
+
+# Pool of pre-connected realtime sessions for Immersive Mode. Sessions are
+# created, configured with their tools and connected in the background, so a
+# new chat claims one without paying for the websocket handshake. Claimed
+# sessions are never returned: their conversation belongs to that chat.
+
+
+class PooledSession:
+    def __init__(self, client):
+        self.client = client
+        self.created_at = time.monotonic()
+        # Chainlit context of the chat that claimed the session, used by its handlers
+        self.context = None
+
+    def healthy(self, idle_seconds):
+        return self.client.is_connected() and time.monotonic() - self.created_at < idle_seconds
+
+
+class RealtimePool:
+    """Keeps `size` connected sessions ready. create_session is a coroutine
+    function returning a connected PooledSession.
+    """
+
+    def __init__(self, create_session, size=REALTIME_POOL_SIZE, idle_seconds=REALTIME_POOL_IDLE_SECONDS,
+                 check_seconds=REALTIME_POOL_CHECK_SECONDS):
+        self._create_session = create_session
+        self.size = size
+        self.idle_seconds = idle_seconds
+        self.check_seconds = check_seconds
+        self._ready = deque()
+        self._filling = 0
+        self._wake = asyncio.Event()
+        # Set whenever a fill finishes, successful or not
+        self._filled = asyncio.Event()
+        self._task = None
+        self.claims = 0
+        self.exhausted = 0
+        self.failures = 0
+        self.expired = 0
+
+    def start(self):
+        # A maintenance task that died is replaced, so the pool keeps refilling
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._maintain())
+
+    async def _maintain(self):
+        while True:
+            try:
+                await self._sweep()
+            except Exception as e:
+                print(f"Realtime pool maintenance failed: {e}")
+            self._wake.clear()
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.check_seconds)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _sweep(self):
+        for session in [s for s in self._ready if not s.healthy(self.idle_seconds)]:
+            # A chat may have claimed it while an earlier session was being closed
+            if session not in self._ready:
+                continue
+            self._ready.remove(session)
+            self.expired += 1
+            await self._discard(session)
+        missing = self.size - len(self._ready) - self._filling
+        if missing > 0:
+            self._filling += missing
+            await asyncio.gather(*(self._fill() for _ in range(missing)))
+
+    async def _fill(self):
+        try:
+            self._ready.append(await self._create_session())
+        except Exception as e:
+            self.failures += 1
+            print(f"Could not pre-connect a realtime session: {e}")
+        finally:
+            self._filling -= 1
+            self._filled.set()
+
+    async def _discard(self, session):
+        try:
+            if session.client.is_connected():
+                await session.client.disconnect()
+        except Exception as e:
+            print(f"Error closing a realtime session: {e}")
+
+    async def claim(self, context=None):
+        """A connected session for a chat, created on the spot when the pool is empty"""
+        self.start()
+        # A session already connecting is ready sooner than a new one
+        while not self._ready and self._filling:
+            self._filled.clear()
+            await self._filled.wait()
+        session = None
+        while self._ready:
+            candidate = self._ready.popleft()
+            if candidate.healthy(self.idle_seconds):
+                session = candidate
+                break
+            self.expired += 1
+            await self._discard(candidate)
+        if session is None:
+            self.exhausted += 1
+            session = await self._create_session()
+        session.context = context
+        self.claims += 1
+        self._wake.set()
+        return session
+
+    async def release(self, session):
+        """Close a claimed session once its chat is done with it"""
+        await self._discard(session)
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "ready": len(self._ready),
+            "filling": self._filling,
+            "claims": self.claims,
+            "exhausted": self.exhausted,
+            "failures": self.failures,
+            "expired": self.expired,
+        }
+
+
+_pool = None
+
+
+def get_realtime_pool(create_session):
+    """Return the pool of this process; it must be called from the server's event loop"""
+    global _pool
+    if _pool is None:
+        _pool = RealtimePool(create_session)
+    _pool.start()
+    return _pool
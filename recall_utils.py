@@ -1,32 +1,41 @@
-import json
-import os
 import random
 import string
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-from moviepy.editor import VideoFileClip, concatenate_videoclips, AudioFileClip
+from moviepy.editor import VideoFileClip, concatenate_videoclips
+
+from clip_cache import clip_key, get_clip_cache
+from fast_clips import CUT_VERSION, cut_clips
+from kb_store import get_store
 
 # Set of utils
 
-# Function to load state
+# Function to load state. Returns a copy of the cached snapshot, which is
+# only reloaded from the store when another writer has changed it.
 def load_state(file_path):
-    if os.path.exists(file_path):
-        with open(file_path, "r") as f:
-            return json.load(f)
-    else:
-        return {}
+    return get_store(file_path).snapshot()
 
-# Function to update state
+# Function to update state. Only the events in new_state are written.
 def update_state(file_path, new_state):
-    current_state = {}
-    
-    if os.path.exists(file_path):
-        with open(file_path, "r") as f:
-            current_state = json.load(f)
-    
-    current_state.update(new_state)
-    
-    with open(file_path, "w") as f:
-        json.dump(current_state, f)
+    get_store(file_path).upsert_events(new_state)
+
+# Function to update one event atomically. update gets the stored event and
+# returns the new one, or None to keep it; the written event is returned.
+def update_event(file_path, media_label, update):
+    return get_store(file_path).update_event(media_label, update)
+
+_thread_pools = {}
+_thread_pools_lock = threading.Lock()
+
+# Thread pool shared by every session in the process, created on first use so
+# requests do not pay for starting and joining threads
+def get_thread_pool(name, max_workers):
+    with _thread_pools_lock:
+        if name not in _thread_pools:
+            _thread_pools[name] = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=name)
+        return _thread_pools[name]
 
 def generate_random_string(length):
     # Generate a random string of specified length using letters and digits
@@ -34,28 +43,51 @@ def generate_random_string(length):
     random_string = ''.join(random.choice(characters) for _ in range(length))
     return random_string
 
-def generate_videoclips(new_video_path, video_data, concat=False):
+def generate_videoclips(new_video_path, video_data, concat=False, fast=False):
     """Clip each video and its associated audio and then concatenate clips if required
+
+    Clips are cached in new_video_path by source file, timestamps and encoding, so
+    the same window is only rendered once. With fast=True the clips are cut by stream
+    copy on keyframe boundaries and only the partial GOPs at the edges are re-encoded;
+    sources that cannot be stream copied fall back to the moviepy path.
+    The returned clip list only holds the moviepy clips rendered by this call.
     """
+    clip_cache = get_clip_cache(new_video_path)
+    groups = [video_data] if concat else [[v] for v in video_data]
+    encoding = {"fast": fast, "codec": "libx264", "audio_codec": "aac", "cut_version": CUT_VERSION if fast else None}
+    keys = [clip_key(group, concat, encoding) for group in groups]
     clips = []
-    clip_paths = []
 
+    def render(pending):
+        # Render every missing clip in one pass so sources are only opened once
+        render_data = [v for position, _ in pending for v in groups[position]]
+        out_paths = [tmp_path for _, tmp_path in pending]
+        clips.extend(_render_videoclips(render_data, out_paths, concat, fast))
+
+    clip_paths = clip_cache.get_many(keys, render)
+    return clips, clip_paths
+
+def _render_videoclips(video_data, out_paths, concat, fast):
+    if fast:
+        try:
+            if cut_clips(video_data, out_paths, concat=concat):
+                return []
+            print("Clips cannot be stream copied cleanly, re-encoding them")
+        except subprocess.CalledProcessError as e:
+            print(f"Error cutting clips by stream copy, re-encoding instead: {e.stderr}")
+
+    clips = []
+    # Each source is opened once, with its audio, and every clip is cut from that reader
+    sources = {}
     for v in video_data:
-        clip = VideoFileClip(v['video_file']).subclip(*v['timestamps'])
-        audio = AudioFileClip(v['video_file']).subclip(*v['timestamps'])
-        clip.audio = audio
-        clips.append(clip)
+        if v['video_file'] not in sources:
+            sources[v['video_file']] = VideoFileClip(v['video_file'])
+        clips.append(sources[v['video_file']].subclip(*v['timestamps']))
     if concat:
         final_clip = concatenate_videoclips(clips)
-        rnd_str = generate_random_string(10)
-        final_path = os.path.join(new_video_path, rnd_str+'.mp4')
-        final_clip.write_videofile(final_path, audio_codec='aac', codec='libx264')
-        clip_paths.append(final_path)
-        return [final_clip], clip_paths
+        final_clip.write_videofile(out_paths[0], audio_codec='aac', codec='libx264')
+        return [final_clip]
     else:
-        for clip in clips:
-            rnd_str = generate_random_string(10)
-            clip_out_path = os.path.join(new_video_path, rnd_str+'.mp4')
+        for clip, clip_out_path in zip(clips, out_paths):
             clip.write_videofile(clip_out_path, audio_codec='aac', codec='libx264')
-            clip_paths.append(clip_out_path)
-        return clips, clip_paths
+        return clips
@@ -0,0 +1,178 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from constants import (RETRIEVAL_CACHE_TTL_SECONDS, RETRIEVAL_CACHE_MAX_ENTRIES, RETRIEVAL_CACHE_MAX_VERSIONS,
+                       RETRIEVAL_CACHE_SIMILARITY, RETRIEVAL_CACHE_EMBEDDING_MODEL)
+from video_index.rags.text_rag import search_knowledge_base, get_media_indices
+
+# Per-event cache of retrieval results, so repeated or paraphrased questions
+# skip search_knowledge_base and get_media_indices. Entries are kept per
+# (event, index_version): sessions still on an old index and sessions on the
+# new one each find their own results, and old versions age out.
+
+
+def normalize_query(query):
+    query = re.sub(r"[^\w\s]", " ", query.lower())
+    return " ".join(query.split())
+
+
+def openai_embed(text):
+    from openai import OpenAI
+    response = OpenAI().embeddings.create(model=RETRIEVAL_CACHE_EMBEDDING_MODEL, input=text)
+    return np.asarray(response.data[0].embedding, dtype=np.float32)
+
+
+class RetrievalCache:
+    """TTL cache of retrieval results per media_label.
+
+    Lookups match the normalized query exactly. When similarity is set, a miss
+    falls back to the cached query whose embedding is closest, if its cosine
+    similarity reaches the threshold.
+    """
+
+    def __init__(self, ttl_seconds=RETRIEVAL_CACHE_TTL_SECONDS, max_entries=RETRIEVAL_CACHE_MAX_ENTRIES,
+                 similarity=RETRIEVAL_CACHE_SIMILARITY, embed_fn=openai_embed,
+                 max_versions=RETRIEVAL_CACHE_MAX_VERSIONS):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_versions = max_versions
+        self.similarity = similarity
+        self._embed_fn = embed_fn
+        self._lock = threading.Lock()
+        # (media_label, index_version) -> OrderedDict of (kind, query) -> (value, seconds, expires_at),
+        # least recently used first
+        self._events = OrderedDict()
+        self._embeddings = OrderedDict()  # normalized query -> unit vector
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.seconds_saved = 0.0
+
+    def _entries(self, media_label, version):
+        # Caller must hold the lock
+        entries = self._events.get((media_label, version))
+        if entries is None:
+            entries = self._events[(media_label, version)] = OrderedDict()
+            while len(self._events) > self.max_versions:
+                self._events.popitem(last=False)
+        self._events.move_to_end((media_label, version))
+        return entries
+
+    def _embed(self, query):
+        with self._lock:
+            if query in self._embeddings:
+                self._embeddings.move_to_end(query)
+                return self._embeddings[query]
+        try:
+            vector = self._embed_fn(query)
+        except Exception as e:
+            print(f"Retrieval cache: embedding failed, exact matches only: {e}")
+            return None
+        vector = vector / (np.linalg.norm(vector) or 1.0)
+        with self._lock:
+            self._embeddings[query] = vector
+            while len(self._embeddings) > self.max_entries * 4:
+                self._embeddings.popitem(last=False)
+        return vector
+
+    def _lookup(self, media_label, version, kind, query):
+        now = time.monotonic()
+        with self._lock:
+            entries = self._entries(media_label, version)
+            for key in [key for key, (_, _, expires_at) in entries.items() if expires_at <= now]:
+                del entries[key]
+            if (kind, query) in entries:
+                entries.move_to_end((kind, query))
+                return entries[(kind, query)], False
+            candidates = [key[1] for key in entries if key[0] == kind]
+        if not self.similarity or not candidates:
+            return None, False
+        vector = self._embed(query)
+        if vector is None:
+            return None, False
+        best, best_score = None, self.similarity
+        for candidate in candidates:
+            candidate_vector = self._embed(candidate)
+            if candidate_vector is not None and float(vector @ candidate_vector) >= best_score:
+                best, best_score = candidate, float(vector @ candidate_vector)
+        with self._lock:
+            entry = self._entries(media_label, version).get((kind, best))
+        return entry, entry is not None
+
+    def get_or_compute(self, kind, media_label, version, query, compute):
+        """Cached value for (kind, event, query), computing and storing it on a miss"""
+        query = normalize_query(query)
+        entry, similar = self._lookup(media_label, version, kind, query)
+        if entry is not None:
+            value, seconds, _ = entry
+            with self._lock:
+                self.hits += 1
+                self.similar_hits += similar
+                self.seconds_saved += seconds
+            return value
+        start = time.perf_counter()
+        value = compute()
+        seconds = time.perf_counter() - start
+        with self._lock:
+            self.misses += 1
+            entries = self._entries(media_label, version)
+            entries[(kind, query)] = (value, seconds, time.monotonic() + self.ttl_seconds)
+            while len(entries) > self.max_entries:
+                entries.popitem(last=False)
+        return value
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "seconds_saved": round(self.seconds_saved, 3),
+                "entries": sum(len(entries) for entries in self._events.values()),
+                "versions": len(self._events),
+            }
+
+
+_retrieval_cache = None
+_retrieval_cache_lock = threading.Lock()
+
+
+def get_retrieval_cache():
+    """Return the retrieval cache shared by every session in this process"""
+    global _retrieval_cache
+    with _retrieval_cache_lock:
+        if _retrieval_cache is None:
+            _retrieval_cache = RetrievalCache()
+        return _retrieval_cache
+
+
+def cached_search_knowledge_base(query, media_label, indexes, version=None):
+    return get_retrieval_cache().get_or_compute(
+        "search", media_label, version, query, lambda: search_knowledge_base(query, media_label, indexes))
+
+
+def docs_digest(text_docs, img_docs):
+    """Digest of the retrieved documents, by node id where they have one"""
+    digest = hashlib.sha1()
+    for docs in (text_docs, img_docs):
+        for doc in docs or []:
+            doc_id = getattr(doc, "node_id", None)
+            digest.update(str(doc_id if doc_id is not None else getattr(doc, "text", repr(doc))).encode())
+            digest.update(b"\0")
+        digest.update(b"\1")
+    return digest.hexdigest()[:16]
+
+
+def cached_get_media_indices(query, text_docs, img_docs, media_label, indexes, version=None):
+    # The same question finds different media from another set of documents,
+    # e.g. the ones an event contributed to a cross-event search
+    return get_retrieval_cache().get_or_compute(
+        f"media:{docs_digest(text_docs, img_docs)}", media_label, version, query,
+        lambda: get_media_indices(query, text_docs, img_docs, media_label, indexes))
@@ -0,0 +1,58 @@
+import asyncio
+import threading
+import weakref
+
+# Event loops of the Knowledge Base chat sessions. Each session reuses one loop
+# across its turns; a rerun can interrupt a turn with tasks still pending, and
+# an abandoned session's loop is only found by the garbage collector, which
+# may run on any thread, including one that is running a loop of its own.
+
+
+def _thread_runs_a_loop():
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
+def cancel_pending_tasks(loop):
+    """Cancel the tasks a rerun interrupted, e.g. the playback of a SentenceSpeaker"""
+    if loop.is_closed() or loop.is_running():
+        return
+    tasks = asyncio.all_tasks(loop)
+    for task in tasks:
+        task.cancel()
+    # Waiting for them drives the loop, which a thread running another loop cannot do;
+    # they then finish cancelling the next time the loop runs
+    if tasks and not _thread_runs_a_loop():
+        loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+
+
+def _close(loop):
+    if loop.is_closed() or loop.is_running():
+        return
+    try:
+        cancel_pending_tasks(loop)
+        loop.run_until_complete(loop.shutdown_asyncgens())
+    except Exception as e:
+        print(f"Error closing a session event loop: {e}")
+    finally:
+        loop.close()
+
+
+def close_event_loop(loop):
+    """Close a session's loop, on a thread of its own when this thread is running another loop"""
+    if _thread_runs_a_loop():
+        threading.Thread(target=_close, args=(loop,), name="close-event-loop", daemon=True).start()
+    else:
+        _close(loop)
+
+
+class EventLoopGuard:
+    """Kept in the session state next to its loop. Sessions have no end event, so
+    the loop is closed when the abandoned session's state is garbage collected.
+    """
+
+    def __init__(self, loop):
+        weakref.finalize(self, close_event_loop, loop)
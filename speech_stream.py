@@ -0,0 +1,114 @@
+import asyncio
+import re
+
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from constants import TTS_MIN_SENTENCE_CHARS
+
+# Streaming TTS for voice answers: complete sentences are cut from the answer
+# while the LLM is still generating, synthesized on the shared executor and
+# played back in order, so speech starts after the first sentence instead of
+# after the whole answer.
+
+_SENTENCE_END_RE = re.compile(r"[.!?;:](?=\s)|\n")
+_MARKDOWN_RE = re.compile(r"[*_#`>|]")
+_STREAM_CURSOR = "▌"
+# Used when the synthesized file cannot be probed
+_CHARS_PER_SECOND = 15
+
+
+def speakable(text):
+    return " ".join(_MARKDOWN_RE.sub(" ", text).split())
+
+
+def audio_duration(path):
+    try:
+        return ffmpeg_parse_infos(path)["duration"]
+    except Exception as e:
+        print(f"Could not read the duration of {path}: {e}")
+        return None
+
+
+class SentenceSpeaker:
+    """Proxy for the streaming response container that speaks the answer as it streams.
+
+    Every write to the container is expected to hold the whole answer so far,
+    as streamed markdown does. A write that does not extend the previous text
+    starts a new answer.
+    """
+
+    _WRITE_METHODS = {"markdown", "write", "text"}
+
+    def __init__(self, container, synthesize, executor, audio_container, on_first_audio=None):
+        self._container = container
+        self._synthesize = synthesize
+        self._executor = executor
+        self._audio_container = audio_container
+        self._on_first_audio = on_first_audio or (lambda: None)
+        self._loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._text = ""
+        self._spoken = 0
+        self._closed = False
+        self._player = self._loop.create_task(self._play())
+
+    def __getattr__(self, name):
+        attr = getattr(self._container, name)
+        if name in self._WRITE_METHODS and callable(attr):
+            def write(body, *args, **kwargs):
+                if isinstance(body, str):
+                    self._feed(body.rstrip(_STREAM_CURSOR))
+                return attr(body, *args, **kwargs)
+            return write
+        return attr
+
+    def _feed(self, text):
+        if not text.startswith(self._text):
+            self._spoken = 0
+        self._text = text
+        start = self._spoken
+        for match in _SENTENCE_END_RE.finditer(text, self._spoken):
+            if len(text[start:match.end()].strip()) >= TTS_MIN_SENTENCE_CHARS:
+                self._speak(text[start:match.end()])
+                start = match.end()
+        self._spoken = start
+
+    def _speak(self, sentence):
+        if self._closed or not (sentence := speakable(sentence)):
+            return
+        self._queue.put_nowait((sentence, self._loop.run_in_executor(self._executor, self._synthesize, sentence)))
+
+    def close(self, final_text=None):
+        """Speak whatever is left of the answer; no more sentences are accepted after this.
+
+        final_text is spoken in full when nothing was streamed through the container.
+        """
+        if final_text and not self._text:
+            self._text = final_text
+        self._speak(self._text[self._spoken:])
+        self._spoken = len(self._text)
+        self._closed = True
+        self._queue.put_nowait(None)
+
+    async def wait(self):
+        """Wait until every sentence has been played"""
+        if not self._closed:
+            self.close()
+        await self._player
+
+    async def _play(self):
+        first = True
+        while (item := await self._queue.get()) is not None:
+            sentence, future = item
+            try:
+                audio_path = await future
+            except Exception as e:
+                print(f"Error synthesizing speech for {sentence!r}: {e}")
+                continue
+            self._audio_container.audio(audio_path, autoplay=True)
+            if first:
+                first = False
+                self._on_first_audio()
+            duration = await self._loop.run_in_executor(self._executor, audio_duration, audio_path)
+            # The next sentence replaces this player, so wait until it has been heard
+            await asyncio.sleep(duration or len(sentence) / _CHARS_PER_SECOND)
@@ -0,0 +1,139 @@
+import io
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass
+
+import numpy as np
+import speech_recognition as sr
+
+from constants import STT_WHISPER_MODEL, STT_MAX_BATCH, STT_BATCH_WAIT_MS
+
+# Process-wide speech-to-text. One worker thread keeps the Whisper model
+# resident and transcribes the recordings of every session, decoding
+# requests that arrive together as one batch.
+
+SAMPLE_RATE = 16000
+# Whisper decodes 30 second windows; longer recordings are transcribed alone
+_BATCH_MAX_SECONDS = 30
+# whisper.transcribe's defaults. A batch decode is greedy at temperature 0, so
+# results failing these checks are transcribed again with its temperature fallback.
+COMPRESSION_RATIO_THRESHOLD = 2.4
+LOGPROB_THRESHOLD = -1.0
+NO_SPEECH_THRESHOLD = 0.6
+
+
+@dataclass
+class Transcription:
+    text: str
+    queue_seconds: float
+    inference_seconds: float
+    batch_size: int
+
+
+def decode_audio(audio_bytes):
+    """16 kHz mono float32 samples of a WAV, AIFF or FLAC recording held in memory"""
+    with sr.AudioFile(io.BytesIO(audio_bytes)) as source:
+        audio_data = sr.Recognizer().record(source)
+    raw = audio_data.get_raw_data(convert_rate=SAMPLE_RATE, convert_width=2)
+    return np.frombuffer(raw, dtype=np.int16).astype(np.float32) / 32768.0
+
+
+class SpeechToTextService:
+    def __init__(self, model_name=STT_WHISPER_MODEL, max_batch=STT_MAX_BATCH, batch_wait_ms=STT_BATCH_WAIT_MS):
+        self.model_name = model_name
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait_ms / 1000
+        self._requests = queue.Queue()
+        self._model = None
+        self._thread = threading.Thread(target=self._run, name="stt", daemon=True)
+        self._thread.start()
+
+    def transcribe_async(self, audio_bytes):
+        """Queue a recording and return a Future of its Transcription"""
+        future = Future()
+        try:
+            samples = decode_audio(audio_bytes)
+        except Exception as e:
+            future.set_exception(e)
+            return future
+        self._requests.put((samples, future, time.perf_counter()))
+        return future
+
+    def transcribe(self, audio_bytes, timeout=None):
+        return self.transcribe_async(audio_bytes).result(timeout)
+
+    def _load_model(self):
+        import whisper
+        start = time.perf_counter()
+        self._model = whisper.load_model(self.model_name)
+        print(f"Loaded Whisper {self.model_name} in {time.perf_counter() - start:.1f}s")
+
+    def _next_batch(self):
+        batch = [self._requests.get()]
+        deadline = time.perf_counter() + self.batch_wait
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._requests.get(timeout=max(0.0, deadline - time.perf_counter())))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        try:
+            self._load_model()
+        except Exception as e:
+            print(f"Failed to load Whisper {self.model_name}: {e}")
+            while True:
+                _, future, _ = self._requests.get()
+                future.set_exception(e)
+        while True:
+            batch = self._next_batch()
+            started = time.perf_counter()
+            try:
+                texts = self._transcribe_batch([samples for samples, _, _ in batch])
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            inference_seconds = time.perf_counter() - started
+            for (_, future, enqueued), text in zip(batch, texts):
+                future.set_result(Transcription(text.strip(), started - enqueued, inference_seconds, len(batch)))
+
+    def _transcribe_batch(self, batch):
+        import torch
+        import whisper
+        fp16 = torch.cuda.is_available()
+        short = [i for i, samples in enumerate(batch) if len(samples) <= _BATCH_MAX_SECONDS * SAMPLE_RATE]
+        texts = [None] * len(batch)
+        if short:
+            mels = torch.stack([whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(batch[i])),
+                                                            n_mels=self._model.dims.n_mels)
+                                for i in short]).to(self._model.device)
+            results = whisper.decode(self._model, mels, whisper.DecodingOptions(fp16=fp16))
+            for i, result in zip(short, results):
+                if result.no_speech_prob > NO_SPEECH_THRESHOLD and result.avg_logprob < LOGPROB_THRESHOLD:
+                    # Silence, as transcribe would skip it
+                    texts[i] = ""
+                elif (result.compression_ratio <= COMPRESSION_RATIO_THRESHOLD
+                      and result.avg_logprob >= LOGPROB_THRESHOLD):
+                    texts[i] = result.text
+        # Long recordings, and short ones whose greedy decode looks repetitive or unsure
+        for i, samples in enumerate(batch):
+            if texts[i] is None:
+                texts[i] = self._model.transcribe(samples, fp16=fp16)["text"]
+        return texts
+
+
+_stt_service = None
+_stt_service_lock = threading.Lock()
+
+
+def get_stt_service():
+    """Return the speech-to-text service shared by every session; the model starts loading on first call"""
+    global _stt_service
+    with _stt_service_lock:
+        if _stt_service is None:
+            _stt_service = SpeechToTextService()
+        return _stt_service
@@ -0,0 +1,38 @@
+import os
+import sys
+import types
+
+# Unit tests for the shared caches and registries. The modules under test
+# import the video_index and moviepy packages at the top; when they are not
+# installed, minimal stand-ins are registered so the tests run without them.
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def _install(name, **attrs):
+    module = types.ModuleType(name)
+    module.__dict__.update(attrs)
+    sys.modules[name] = module
+    return module
+
+
+def _unavailable(*args, **kwargs):
+    raise RuntimeError("not available in unit tests")
+
+
+try:
+    import video_index.rags.text_rag  # noqa: F401
+except ImportError:
+    _install("video_index", __path__=[])
+    _install("video_index.rags", __path__=[])
+    _install("video_index.rags.text_rag", create_new_index=_unavailable, search_knowledge_base=_unavailable,
+             get_media_indices=_unavailable)
+    _install("video_index.rags.scraper", perform_web_search=_unavailable)
+
+try:
+    import moviepy.editor  # noqa: F401
+except ImportError:
+    _install("moviepy", __path__=[])
+    _install("moviepy.config", get_setting=lambda name: "ffmpeg")
+    _install("moviepy.editor", VideoFileClip=_unavailable, AudioFileClip=_unavailable,
+             concatenate_videoclips=_unavailable)
@@ -0,0 +1,173 @@
+import asyncio
+
+from audio_relay import AudioRelay
+
+# 2 bytes per ms at 1 kHz, so a 10 ms frame is 20 bytes
+
+
+class Receiver:
+    def __init__(self):
+        self.frames = []
+
+    async def __call__(self, frame):
+        self.frames.append(frame)
+
+
+def make_relay(receiver, max_buffer_ms=None):
+    return AudioRelay(receiver, "test", sample_rate=1000, frame_ms=10, max_wait_ms=5, max_buffer_ms=max_buffer_ms)
+
+
+def test_small_chunks_are_coalesced_into_frames():
+    async def run():
+        receiver = Receiver()
+        relay = make_relay(receiver)
+        for i in range(10):
+            relay.push(bytes([i]) * 4)
+        await relay.close()
+        return receiver, relay
+
+    receiver, relay = asyncio.run(run())
+    assert [len(frame) for frame in receiver.frames] == [20, 20]
+    assert b"".join(receiver.frames) == b"".join(bytes([i]) * 4 for i in range(10))
+    assert relay.stats()["frames"] == 2
+
+
+def test_bounded_relay_drops_the_oldest_audio():
+    async def run():
+        receiver = Receiver()
+        relay = make_relay(receiver, max_buffer_ms=20)
+        relay.push(bytes(range(60)))
+        await relay.close()
+        return receiver, relay
+
+    receiver, relay = asyncio.run(run())
+    assert b"".join(receiver.frames) == bytes(range(20, 60))
+    assert relay.stats()["dropped_ms"] == 10
+
+
+def test_unbounded_relay_never_drops():
+    async def run():
+        receiver = Receiver()
+        relay = make_relay(receiver)
+        data = bytes(range(256)) * 8
+        relay.push(data)
+        await relay.close()
+        return receiver, relay, data
+
+    receiver, relay, data = asyncio.run(run())
+    assert b"".join(receiver.frames) == data
+    assert relay.dropped_bytes == 0
+
+
+def test_half_samples_are_never_sent():
+    async def run():
+        receiver = Receiver()
+        relay = make_relay(receiver)
+        relay.push(b"abc")
+        await asyncio.sleep(0.05)
+        relay.push(b"d")
+        await asyncio.sleep(0.05)
+        relay.push(b"e")
+        await relay.close()
+        return receiver, relay
+
+    receiver, relay = asyncio.run(run())
+    assert receiver.frames == [b"ab", b"cd"]
+    # The lone byte left at close is dropped
+    assert relay.dropped_bytes == 1
+
+
+def test_clear_drops_buffered_audio():
+    async def run():
+        receiver = Receiver()
+        relay = make_relay(receiver)
+        relay.push(b"x" * 10)
+        relay.clear()
+        relay.push(b"y" * 20)
+        await relay.close()
+        relay.push(b"z" * 20)
+        return receiver, relay
+
+    receiver, relay = asyncio.run(run())
+    assert receiver.frames == [b"y" * 20]
+    assert relay.dropped_bytes == 10
+
+
+def test_close_without_flush_drops_the_rest():
+    async def run():
+        receiver = Receiver()
+        relay = make_relay(receiver)
+        relay.push(b"x" * 50)
+        await relay.close(flush=False)
+        return receiver, relay
+
+    receiver, relay = asyncio.run(run())
+    assert receiver.frames == []
+    assert relay.dropped_bytes == 50
+
+
+class SlowReceiver(Receiver):
+    """Takes a frame only when released, like a browser that has fallen behind"""
+
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Semaphore(0)
+
+    async def __call__(self, frame):
+        await self.release.acquire()
+        self.frames.append(frame)
+
+
+def test_put_waits_for_room_instead_of_dropping():
+    async def run():
+        receiver = SlowReceiver()
+        relay = make_relay(receiver, max_buffer_ms=20)
+        chunks = [bytes([i]) * 20 for i in range(6)]
+        producer = asyncio.gather(*(relay.put(chunk) for chunk in chunks))
+        await asyncio.sleep(0.05)
+        # Two frames fit the buffer and one is with the receiver, the producer waits
+        waiting = not producer.done() and relay.max_depth_bytes <= 40
+        for _ in chunks:
+            receiver.release.release()
+        await producer
+        await relay.close()
+        return receiver, relay, chunks, waiting
+
+    receiver, relay, chunks, waiting = asyncio.run(run())
+    assert waiting
+    assert receiver.frames == chunks
+    assert relay.dropped_bytes == 0
+    assert relay.waits > 0
+
+
+def test_put_queues_a_chunk_larger_than_the_buffer_whole():
+    async def run():
+        receiver = Receiver()
+        relay = make_relay(receiver, max_buffer_ms=10)
+        await relay.put(bytes(range(100)))
+        await relay.close()
+        return receiver, relay
+
+    receiver, relay = asyncio.run(run())
+    assert b"".join(receiver.frames) == bytes(range(100))
+    assert relay.dropped_bytes == 0
+
+
+def test_clear_drops_audio_waiting_in_put():
+    async def run():
+        receiver = SlowReceiver()
+        relay = make_relay(receiver, max_buffer_ms=20)
+        first = [relay.put(b"a" * 20), relay.put(b"b" * 20), relay.put(b"c" * 20)]
+        waiting = asyncio.gather(*first, relay.put(b"d" * 20))
+        await asyncio.sleep(0.05)
+        relay.clear()
+        await relay.put(b"e" * 20)
+        for _ in range(5):
+            receiver.release.release()
+        await waiting
+        await relay.close()
+        return receiver
+
+    receiver = asyncio.run(run())
+    # The frame already with the receiver is sent, the interrupted rest is dropped
+    assert receiver.frames == [b"a" * 20, b"e" * 20]
@@ -0,0 +1,85 @@
+import threading
+
+import pytest
+
+import chat_store
+from chat_context import SUMMARY_PREFIX, build_context, message_tokens
+
+
+@pytest.fixture
+def session(tmp_path, monkeypatch):
+    # The store opens chat_history.db in the working directory, one connection per thread
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(chat_store, "_local", threading.local())
+    session_id = "session"
+    chat_store.append_message(session_id, {"role": "system", "content": "You answer questions about events."})
+    chat_store.append_message(session_id, {"role": "assistant", "content": "Hi, ask me anything."})
+    return session_id
+
+
+def add_turn(session_id, question, answer):
+    turn = [{"role": "user", "content": question}, {"role": "assistant", "content": answer}]
+    for message in turn:
+        chat_store.append_message(session_id, message)
+    return turn
+
+
+def tokens(messages):
+    return sum(message_tokens(message) for message in messages)
+
+
+def head(session_id):
+    return [message for _, _, message in chat_store.load_messages(session_id, 0, 0)]
+
+
+def test_recent_turns_are_kept_within_the_budget(session):
+    turns = [add_turn(session, f"Question {i}?", f"Answer {i}. " * 20) for i in range(1, 5)]
+    budget = tokens(head(session) + turns[2] + turns[3])
+    messages, report = build_context(session, budget)
+    assert messages == head(session) + turns[2] + turns[3]
+    assert report["tokens"] == budget
+    assert (report["turns_sent"], report["turns_summarized"]) == (2, 2)
+    # Turns 1 and 2 are messages 3 to 6
+    assert report["dropped_through_seq"] == 6
+
+
+def test_current_turn_is_always_sent(session):
+    add_turn(session, "Earlier?", "Earlier answer.")
+    current = add_turn(session, "Long question? " * 100, "Long answer. " * 100)
+    messages, report = build_context(session, budget=1)
+    assert messages == head(session) + current
+    assert report["turns_sent"] == 1
+
+
+def test_older_unsummarized_turns_are_sent_when_they_fit(session):
+    first = add_turn(session, "First?", "Short.")
+    second = add_turn(session, "Second?", "Short.")
+    add_turn(session, "Third?", "Very long answer. " * 200)
+    fourth = add_turn(session, "Fourth?", "Short.")
+    budget = tokens(head(session) + first + second + fourth)
+    messages, report = build_context(session, budget)
+    assert messages == head(session) + first + second + fourth
+    assert report["dropped_through_seq"] == 8
+
+    # Once the summary covers them, only the window past the third turn is sent
+    assert chat_store.save_summary(session, 6, "They asked two questions.", report["generation"])
+    messages, report = build_context(session, budget)
+    summary = {"role": "system", "content": SUMMARY_PREFIX + "They asked two questions."}
+    assert messages == head(session) + [summary] + fourth
+    assert report["summary_through_seq"] == 6
+
+
+def test_images_and_videos_are_not_sent(session):
+    turn = add_turn(session, "Show me the demo", "Here it is.")
+    chat_store.append_message(session, {"role": "assistant", "content": "clips/demo.mp4", "is_video": True})
+    messages, _ = build_context(session, budget=10_000)
+    assert messages == head(session) + turn
+
+
+def test_summary_of_a_cleared_chat_is_dropped(session):
+    add_turn(session, "Question?", "Answer.")
+    _, report = build_context(session)
+    chat_store.clear_messages(session)
+    assert chat_store.conversation_generation(session) == report["generation"] + 1
+    assert not chat_store.save_summary(session, 4, "Stale summary.", report["generation"])
+    assert chat_store.load_summary(session) == (0, "")
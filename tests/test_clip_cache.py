@@ -0,0 +1,104 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pytest
+
+from clip_cache import ClipCache, is_abandoned_tmp
+
+
+def writer(calls, size=100):
+    def render(pending):
+        calls.append(len(pending))
+        for _, tmp_path in pending:
+            with open(tmp_path, "wb") as f:
+                f.write(b"x" * size)
+    return render
+
+
+def test_renders_missing_clips_once(tmp_path):
+    cache = ClipCache(str(tmp_path), 10_000)
+    calls = []
+    first = cache.get_many(["a", "b"], writer(calls))
+    second = cache.get_many(["b", "a", "c"], writer(calls))
+    assert calls == [2, 1]
+    assert second[:2] == [first[1], first[0]]
+    assert all(os.path.exists(path) for path in second)
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (2, 3)
+
+
+def test_concurrent_requests_share_one_render(tmp_path):
+    cache = ClipCache(str(tmp_path), 10_000)
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def slow_render(pending):
+        started.set()
+        release.wait(5)
+        writer(calls)(pending)
+
+    results = {}
+    owner = threading.Thread(target=lambda: results.update(owner=cache.get_many(["a"], slow_render)))
+    owner.start()
+    started.wait(5)
+    waiter = threading.Thread(target=lambda: results.update(waiter=cache.get_many(["a"], writer(calls))))
+    waiter.start()
+    time.sleep(0.05)
+    release.set()
+    owner.join(5)
+    waiter.join(5)
+    assert calls == [1]
+    assert results["owner"] == results["waiter"]
+    assert cache.stats()["coalesced"] == 1
+
+
+def test_failed_render_leaves_no_files(tmp_path):
+    cache = ClipCache(str(tmp_path), 10_000)
+
+    def broken(pending):
+        for _, tmp_path in pending:
+            open(tmp_path, "wb").close()
+        raise RuntimeError("render failed")
+
+    with pytest.raises(RuntimeError):
+        cache.get_many(["a"], broken)
+    assert os.listdir(tmp_path) == []
+    assert cache.get_many(["a"], writer([]))[0].endswith("a.mp4")
+
+
+def test_eviction_keeps_the_clips_of_the_current_call(tmp_path):
+    cache = ClipCache(str(tmp_path), 250, min_age=0)
+    paths = cache.get_many(["a", "b", "c"], writer([]))
+    # Over the quota, but every clip is about to be served
+    assert all(os.path.exists(path) for path in paths)
+    cache.get_many(["d"], writer([]))
+    assert sorted(os.listdir(tmp_path)) == ["c.mp4", "d.mp4"]
+
+
+def test_eviction_spares_recently_used_clips(tmp_path):
+    cache = ClipCache(str(tmp_path), 250, min_age=60)
+    cache.get_many(["a", "b"], writer([]))
+    cache.get_many(["c"], writer([]))
+    assert sorted(os.listdir(tmp_path)) == ["a.mp4", "b.mp4", "c.mp4"]
+    old = time.time() - 120
+    os.utime(tmp_path / "a.mp4", (old, old))
+    cache.get_many(["d"], writer([]))
+    assert sorted(os.listdir(tmp_path)) == ["b.mp4", "c.mp4", "d.mp4"]
+
+
+def test_only_abandoned_renders_are_removed_on_start(tmp_path):
+    gone = subprocess.Popen([sys.executable, "-c", "pass"])
+    gone.wait()
+    live = tmp_path / f"a.mp4.{os.getpid()}-1.tmp.mp4"
+    dead = tmp_path / f"b.mp4.{gone.pid}-1.tmp.mp4"
+    stale = tmp_path / f"c.mp4.{os.getpid()}-2.tmp.mp4"
+    for path in (live, dead, stale):
+        path.write_bytes(b"x")
+    old = time.time() - 7200
+    os.utime(stale, (old, old))
+    assert not is_abandoned_tmp(str(live), max_age=3600)
+    ClipCache(str(tmp_path), 10_000)
+    assert sorted(os.listdir(tmp_path)) == [live.name]
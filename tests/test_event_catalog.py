@@ -0,0 +1,53 @@
+from event_catalog import EventCatalog, get_catalog
+from kb_store import get_store
+
+KNOWLEDGE_BASE = {
+    "LLM Agents Bootcamp": {"tags": ["agents", "tools"]},
+    "Vector Search Summit": {"tags": ["retrieval", "embeddings"]},
+    "Agentic RAG Meetup": {"tags": ["agents", "retrieval"]},
+    "Pricing Workshop": {},
+}
+
+
+def catalog():
+    return EventCatalog(KNOWLEDGE_BASE, version=1)
+
+
+def test_no_filter_lists_every_event_in_knowledge_base_order():
+    assert catalog().query() == list(KNOWLEDGE_BASE)
+    assert catalog().all_tags == ["agents", "embeddings", "retrieval", "tools"]
+
+
+def test_tags_match_any_or_all():
+    assert catalog().query(tags=["agents", "embeddings"]) == \
+        ["LLM Agents Bootcamp", "Vector Search Summit", "Agentic RAG Meetup"]
+    assert catalog().query(tags=["agents", "retrieval"], match_all=True) == ["Agentic RAG Meetup"]
+    assert catalog().query(tags=["unknown"]) == []
+
+
+def test_every_word_of_the_text_prefixes_a_title_word():
+    assert catalog().query(text="agent") == ["LLM Agents Bootcamp", "Agentic RAG Meetup"]
+    assert catalog().query(text="AGENT boot") == ["LLM Agents Bootcamp"]
+    assert catalog().query(text="summit vec") == ["Vector Search Summit"]
+    assert catalog().query(text="gents") == []
+    assert catalog().query(text="   ") == list(KNOWLEDGE_BASE)
+
+
+def test_text_and_tags_combine():
+    assert catalog().query(tags=["retrieval"], text="agent") == ["Agentic RAG Meetup"]
+
+
+def test_events_without_an_image_get_a_placeholder():
+    assert catalog().events["Pricing Workshop"]["image"].endswith("text=Pricing+Workshop")
+
+
+def test_catalog_is_rebuilt_only_when_the_store_changes(tmp_path):
+    path = str(tmp_path / "knowledge_base.json")
+    store = get_store(path)
+    store.upsert_events({"LLM Agents Bootcamp": {"tags": ["agents"]}})
+    first = get_catalog(path)
+    assert get_catalog(path) is first
+    store.upsert_event("Pricing Workshop", {"tags": ["pricing"]})
+    second = get_catalog(path)
+    assert second is not first
+    assert second.query(tags=["pricing"]) == ["Pricing Workshop"]
@@ -0,0 +1,45 @@
+from event_tags import LEGACY_CANDIDATE_KEY, merge_event_tags, seed_legacy_candidates
+
+
+def test_tags_are_ranked_by_weighted_votes():
+    media_tags = {
+        "a.mp4": {"tags": ["Agents", "RAG", "Evals"], "title_image": "a.jpg"},
+        "b.mp4": {"tags": ["rag", "Pricing", "agents "], "title_image": "b.jpg"},
+        "c.mp4": {"tags": ["Pricing"], "title_image": "c.jpg", "weight": 3},
+    }
+    tags, title_image, scores = merge_event_tags(media_tags)
+    # Case and whitespace variants vote together and keep their first spelling
+    assert tags == ["Pricing", "Agents", "RAG"]
+    assert scores == {"a.mp4": 2 / 3, "b.mp4": 1.0, "c.mp4": 1.0}
+    # Ties between image scores keep the candidates' order
+    assert title_image == "b.jpg"
+
+
+def test_max_tags_defaults_to_the_longest_candidate():
+    media_tags = {"a.mp4": {"tags": ["x", "y"]}, "b.mp4": {"tags": ["z"]}}
+    assert merge_event_tags(media_tags)[0] == ["x", "y"]
+    assert merge_event_tags(media_tags, max_tags=3)[0] == ["x", "y", "z"]
+
+
+def test_title_image_skips_candidates_without_one():
+    media_tags = {"a.mp4": {"tags": ["x"]}, "b.mp4": {"tags": ["x", "y"], "title_image": "b.jpg"}}
+    assert merge_event_tags(media_tags)[1] == "b.jpg"
+    assert merge_event_tags({}) == ([], None, {})
+
+
+def test_appending_a_video_only_needs_its_candidates():
+    media_tags = {"a.mp4": {"tags": ["agents", "rag"], "title_image": "a.jpg"}}
+    before, _, _ = merge_event_tags(media_tags)
+    media_tags["b.mp4"] = {"tags": ["rag", "evals"], "title_image": "b.jpg"}
+    after, title_image, _ = merge_event_tags(media_tags)
+    assert before == ["agents", "rag"]
+    assert after == ["rag", "agents"]
+    assert title_image == "a.jpg"
+
+
+def test_legacy_events_seed_one_weighted_candidate():
+    event = {"tags": ["agents"], "title_image": "t.jpg", "video_paths": ["a.mp4", "b.mp4"]}
+    assert seed_legacy_candidates(event) == {
+        LEGACY_CANDIDATE_KEY: {"tags": ["agents"], "title_image": "t.jpg", "weight": 2}}
+    assert seed_legacy_candidates({"media_tags": {"a.mp4": {"tags": []}}, "tags": ["x"]}) == {"a.mp4": {"tags": []}}
+    assert seed_legacy_candidates({}) == {}
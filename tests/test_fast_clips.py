@@ -0,0 +1,24 @@
+import pytest
+
+from fast_clips import check_windows, plan_pieces
+
+KEYFRAMES = [0.0, 2.0, 4.0, 6.0, 8.0, 10.0]
+
+
+def test_plan_pieces_copies_between_keyframes():
+    assert plan_pieces(KEYFRAMES, 1.5, 8.5) == [("encode", 1.5, 2.0), ("copy", 2.0, 8.0), ("encode", 8.0, 8.5)]
+    # Edges shorter than MIN_EDGE_SECONDS are dropped
+    assert plan_pieces(KEYFRAMES, 1.98, 8.02) == [("copy", 2.0, 8.0)]
+    assert plan_pieces(KEYFRAMES, 2.5, 3.5) == [("encode", 2.5, 3.5)]
+
+
+def test_check_windows_decode_the_edges_and_the_first_gop_of_copies():
+    pieces = plan_pieces(KEYFRAMES, 1.5, 8.5)
+    windows = check_windows(pieces, KEYFRAMES)
+    assert windows == [(0.0, pytest.approx(0.5)), (0.5, 2.0), (6.5, pytest.approx(0.5))]
+    # Decoding covers far less than the clip
+    assert sum(seconds for _, seconds in windows) < (8.5 - 1.5) / 2
+
+
+def test_check_windows_of_a_copy_without_later_keyframes():
+    assert check_windows([("copy", 8.0, 10.0)], [0.0, 8.0]) == [(0.0, 2.0)]
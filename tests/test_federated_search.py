@@ -0,0 +1,134 @@
+from types import SimpleNamespace
+
+import pytest
+
+import federated_search as federated_search_module
+from federated_search import _merge, coverage_note, federated_search, load_candidates, shard_scores
+from index_registry import IndexRegistry
+
+
+def doc(name, score):
+    return SimpleNamespace(name=name, score=score)
+
+
+def names(docs):
+    return [d.name for d in docs]
+
+
+def test_three_shards_are_merged_on_raw_scores():
+    shard_docs = {
+        "a": [doc("a1", 0.91), doc("a2", 0.52)],
+        "b": [doc("b1", 0.87), doc("b2", 0.86), doc("b3", 0.40)],
+        "c": [doc("c1", 0.60)],
+    }
+    docs, labels = _merge(shard_docs, top_k=10)
+    assert names(docs) == ["a1", "b1", "b2", "c1", "a2", "b3"]
+    assert labels == ["a", "b", "b", "c", "a", "b"]
+
+
+def test_merge_keeps_only_the_top_k():
+    shard_docs = {
+        "a": [doc("a1", 0.5), doc("a2", 0.2)],
+        "b": [doc("b1", 0.9)],
+        "c": [doc("c1", 0.7), doc("c2", 0.1)],
+    }
+    docs, labels = _merge(shard_docs, top_k=3)
+    assert names(docs) == ["b1", "c1", "a1"]
+    assert labels == ["b", "c", "a"]
+
+
+def test_unscored_docs_rank_below_scored_ones():
+    shard_docs = {
+        "a": [doc("a1", None), doc("a2", 0.3)],
+        "b": [doc("b1", 0.1), SimpleNamespace(name="b2")],
+        "c": [doc("c1", None)],
+    }
+    assert shard_scores(shard_docs["a"]) == [0.0, 0.3]
+    docs, labels = _merge(shard_docs, top_k=10)
+    # Ties keep knowledge base order and each shard's own ranking
+    assert names(docs) == ["a2", "b1", "a1", "b2", "c1"]
+    assert labels == ["a", "b", "a", "b", "c"]
+
+
+def test_empty_shards_are_skipped():
+    docs, labels = _merge({"a": [], "b": [doc("b1", 0.4)], "c": []}, top_k=5)
+    assert (names(docs), labels) == (["b1"], ["b"])
+
+
+def test_load_candidates_prefer_events_matching_the_query():
+    knowledge_base = {
+        "LLM Agents Bootcamp": {"tags": ["agents", "tool use"]},
+        "Vector Search Summit": {"tags": ["embeddings", "retrieval"]},
+        "Pricing Workshop": {"tags": ["pricing"]},
+    }
+    missing = list(knowledge_base)
+    assert load_candidates("How do agents use tools?", knowledge_base, missing, limit=3)[0] == "LLM Agents Bootcamp"
+    assert load_candidates("Embeddings for retrieval", knowledge_base, missing, limit=1) == ["Vector Search Summit"]
+    # Ties keep knowledge base order
+    assert load_candidates("pricing", knowledge_base, missing, limit=3) == \
+        ["Pricing Workshop", "LLM Agents Bootcamp", "Vector Search Summit"]
+    assert load_candidates("pricing", knowledge_base, ["Pricing Workshop"], limit=0) == []
+
+
+@pytest.fixture
+def shards(monkeypatch):
+    """A registry of fake indexes and a search that records the index versions it was given"""
+    built = []
+
+    def build(media_label):
+        built.append(media_label)
+        return {"label": media_label, "build": len(built)}
+
+    registry = IndexRegistry(builder=build, memory_budget_mb=100, max_workers=2, size_fn=lambda index: 1024)
+    searches = []
+
+    def search(query, media_label, indexes, version=None):
+        index = indexes[media_label]
+        searches.append((media_label, index["build"], version))
+        return [], [doc(f"{media_label}:{index['build']}", 0.5)]
+
+    monkeypatch.setattr(federated_search_module, "get_index_registry", lambda: registry)
+    monkeypatch.setattr(federated_search_module, "cached_search_knowledge_base", search)
+    return SimpleNamespace(registry=registry, built=built, searches=searches)
+
+
+def test_stale_resident_indexes_are_not_searched_under_the_new_version(shards):
+    shards.registry.put("a", {"label": "a", "build": "old"}, 1)
+    shards.registry.get("b", 1)
+    knowledge_base = {"a": {"index_version": 2}, "b": {"index_version": 1}}
+    federated_search("question", knowledge_base, timeout=5)
+    assert ("a", "old", 2) not in shards.searches
+    assert ("b", 1, 1) in shards.searches
+
+
+def test_events_that_are_not_resident_are_loaded_and_searched(shards, monkeypatch):
+    monkeypatch.setattr(federated_search_module, "FEDERATED_LOAD_EVENTS", 2)
+    knowledge_base = {label: {"index_version": 1, "tags": [label]} for label in ("a", "b", "c", "d")}
+    shards.registry.get("a", 1)
+    result = federated_search("about c", knowledge_base, timeout=5)
+    assert result.report["searched"] == 3
+    assert result.report["loaded"] == ["c", "b"]
+    assert result.report["skipped"] == 1
+    assert sorted(result.text_labels) == ["a", "b", "c"]
+    assert sorted(shards.registry.stats()["resident"]) == ["a", "b", "c"]
+    assert coverage_note(result.report) == \
+        "Searched 3 of 4 events (1 not loaded to stay within the memory budget)."
+
+
+def test_loading_stops_at_the_memory_budget(shards):
+    shards.registry.memory_budget = 2 * 1024
+    knowledge_base = {label: {"index_version": 1} for label in ("a", "b", "c")}
+    shards.registry.get("a", 1)
+    result = federated_search("question", knowledge_base, timeout=5)
+    # One more index of the resident size fits, two do not
+    assert result.report["loaded"] == ["b"]
+    assert result.report["skipped"] == 1
+    assert shards.registry.stats()["evictions"] == 0
+
+
+def test_coverage_note_of_a_complete_search():
+    report = {"events": 2, "searched": 2, "timed_out": [], "failed": [], "skipped": 0}
+    assert coverage_note(report) == "Searched 2 of 2 events."
+    report = {"events": 5, "searched": 2, "timed_out": ["c"], "failed": ["d"], "skipped": 1}
+    assert coverage_note(report) == ("Searched 2 of 5 events (1 timed out, 1 failed, "
+                                     "1 not loaded to stay within the memory budget).")
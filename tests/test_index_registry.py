@@ -0,0 +1,147 @@
+import asyncio
+import threading
+
+import numpy as np
+
+from index_registry import PY_FLOAT_BYTES, IndexRegistry, estimate_size
+
+MB = 1024 * 1024
+
+
+class GatedBuilder:
+    """Builds an index per call, each blocked until its gate for the label is opened"""
+
+    def __init__(self):
+        self.calls = []
+        self.gates = {}
+        self.lock = threading.Lock()
+
+    def gate(self, media_label):
+        with self.lock:
+            return self.gates.setdefault(media_label, threading.Event())
+
+    def __call__(self, media_label):
+        with self.lock:
+            self.calls.append(media_label)
+            build = len(self.calls)
+        self.gate(media_label).wait(5)
+        return {"label": media_label, "build": build}
+
+
+def make_registry(builder, budget_mb=100, size=10 * MB):
+    return IndexRegistry(builder=builder, memory_budget_mb=budget_mb, max_workers=4, size_fn=lambda index: size)
+
+
+def test_builds_once_and_shares_the_index():
+    builder = GatedBuilder()
+    builder.gate("a").set()
+    registry = make_registry(builder)
+    first = registry.get("a", 1)
+    assert registry.get("a", 1) is first
+    assert asyncio.run(registry.aget("a", 1)) is first
+    assert builder.calls == ["a"]
+    assert registry.stats()["hits"] == 2
+
+
+def test_concurrent_gets_share_one_build():
+    builder = GatedBuilder()
+    registry = make_registry(builder)
+    futures = [registry.prefetch("a", 1) for _ in range(3)]
+    assert futures[0] is futures[1] is futures[2]
+    builder.gate("a").set()
+    assert registry.get("a", 1) is futures[0].result()
+    assert builder.calls == ["a"]
+
+
+def test_evicts_least_recently_used_beyond_budget():
+    builder = GatedBuilder()
+    for label in "abc":
+        builder.gate(label).set()
+    registry = make_registry(builder, budget_mb=25)
+    registry.get("a")
+    registry.get("b")
+    registry.get("a")
+    registry.get("c")
+    stats = registry.stats()
+    assert stats["resident"] == ["a", "c"]
+    assert stats["evictions"] == 1
+
+
+def test_builds_of_different_versions_are_kept_apart():
+    builder = GatedBuilder()
+    registry = make_registry(builder)
+    old = registry.prefetch("a", 1)
+    new = registry.prefetch("a", 2)
+    assert old is not new
+    builder.gate("a").set()
+    assert new.result()["build"] != old.result()["build"]
+    assert registry.get("a", 2) is new.result()
+
+
+def test_older_build_finishing_late_does_not_replace_newer_version():
+    builder = GatedBuilder()
+    registry = make_registry(builder)
+    old = registry.prefetch("a", 1)
+    registry.put("a", {"label": "a", "build": "put"}, 2)
+    builder.gate("a").set()
+    old.result()
+    assert registry.peek("a") == {"label": "a", "build": "put"}
+
+
+def test_build_racing_with_invalidate_is_not_stored():
+    builder = GatedBuilder()
+    registry = make_registry(builder)
+    future = registry.prefetch("a", 1)
+    registry.invalidate("a")
+    builder.gate("a").set()
+    # Callers waiting for the build still get it
+    assert future.result()["label"] == "a"
+    assert registry.peek("a") is None
+    assert registry.get("a", 1)["build"] == 2
+
+
+def test_has_room_uses_the_average_resident_size():
+    builder = GatedBuilder()
+    for label in "ab":
+        builder.gate(label).set()
+    registry = make_registry(builder, budget_mb=25)
+    assert registry.has_room()
+    registry.get("a")
+    assert registry.has_room()
+    registry.get("b")
+    assert not registry.has_room()
+
+
+class EmbedModel:
+    def __init__(self):
+        self.weights = np.zeros((1000, 1000))
+
+
+class VectorStore:
+    def __init__(self, count, dims):
+        self.embedding_dict = {f"node{i}": [0.5] * dims for i in range(count)}
+
+
+class FakeIndex:
+    def __init__(self, count, dims):
+        self.vector_store = VectorStore(count, dims)
+        self.image_vectors = np.zeros((count, 64), dtype=np.float32)
+        self.embed_model = EmbedModel()
+        self.docstore = {f"node{i}": {"text": "x" * 1000} for i in range(count)}
+
+
+def test_estimate_size_counts_vectors_and_skips_shared_models():
+    size = estimate_size(FakeIndex(100, 32))
+    assert size == 100 * 32 * PY_FLOAT_BYTES + 100 * 64 * 4
+
+
+def test_peek_with_a_version_ignores_stale_indexes():
+    builder = GatedBuilder()
+    builder.gate("a").set()
+    registry = make_registry(builder)
+    index = registry.get("a", 1)
+    assert registry.peek("a") is index
+    assert registry.peek("a", 1) is index
+    assert registry.peek("a", 2) is None
+    assert registry.peek("b") is None
+    assert registry.stats()["hits"] == 0
@@ -0,0 +1,75 @@
+import json
+import threading
+
+import pytest
+
+from kb_store import KnowledgeBaseStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return KnowledgeBaseStore(str(tmp_path / "knowledge_base.json"))
+
+
+def test_legacy_json_is_imported_once(tmp_path):
+    path = tmp_path / "knowledge_base.json"
+    path.write_text(json.dumps({"Event": {"tags": ["a"]}}))
+    assert KnowledgeBaseStore(str(path)).snapshot() == {"Event": {"tags": ["a"]}}
+    path.write_text(json.dumps({"Other": {}}))
+    assert KnowledgeBaseStore(str(path)).snapshot() == {"Event": {"tags": ["a"]}}
+
+
+def test_upserts_only_touch_the_given_events(store):
+    store.upsert_events({"a": {"n": 1}, "b": {"n": 1}})
+    store.upsert_event("b", {"n": 2})
+    assert store.snapshot() == {"a": {"n": 1}, "b": {"n": 2}}
+    # Snapshots are copies
+    store.snapshot()["a"]["n"] = 99
+    assert store.snapshot()["a"] == {"n": 1}
+
+
+def test_update_event_creates_and_updates(store):
+    def add_video(event):
+        event.setdefault("video_paths", []).append("v.mp4")
+        return event
+
+    assert store.update_event("a", add_video) == {"video_paths": ["v.mp4"]}
+    assert store.update_event("a", add_video) == {"video_paths": ["v.mp4", "v.mp4"]}
+    assert store.snapshot()["a"]["video_paths"] == ["v.mp4", "v.mp4"]
+
+
+def test_update_event_returning_none_writes_nothing(store):
+    store.upsert_event("a", {"n": 1})
+    version = store.version()
+    assert store.update_event("a", lambda event: None) is None
+    assert store.version() == version
+
+
+def test_failed_update_is_rolled_back(store):
+    store.upsert_event("a", {"n": 1})
+
+    def broken(event):
+        raise ValueError("bad merge")
+
+    with pytest.raises(ValueError):
+        store.update_event("a", broken)
+    # The connection is usable again and nothing was written
+    store.update_event("a", lambda event: {**event, "n": event["n"] + 1})
+    assert store.snapshot()["a"] == {"n": 2}
+
+
+def test_concurrent_updates_are_not_lost(tmp_path):
+    path = str(tmp_path / "knowledge_base.json")
+    # One store per thread, like separate worker processes on the same database
+    stores = [KnowledgeBaseStore(path) for _ in range(4)]
+
+    def increment(store):
+        for _ in range(10):
+            store.update_event("a", lambda event: {"count": event.get("count", 0) + 1})
+
+    threads = [threading.Thread(target=increment, args=(store,)) for store in stores]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert KnowledgeBaseStore(path).snapshot()["a"]["count"] == 40
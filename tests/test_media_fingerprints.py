@@ -0,0 +1,90 @@
+import hashlib
+import io
+
+import pytest
+
+import media_fingerprints
+from media_fingerprints import HashingReader, fingerprint_file, lookup, record, youtube_video_id
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+
+@pytest.mark.parametrize("url", [
+    f"https://www.youtube.com/watch?v={VIDEO_ID}&t=42s",
+    f"youtube.com/watch?v={VIDEO_ID}",
+    f"https://m.youtube.com/watch?v={VIDEO_ID}",
+    f"https://youtu.be/{VIDEO_ID}?si=abc",
+    f"https://www.youtube.com/shorts/{VIDEO_ID}",
+    f"https://www.youtube-nocookie.com/embed/{VIDEO_ID}",
+    f"https://youtube.com/live/{VIDEO_ID}",
+])
+def test_youtube_video_id_of_supported_urls(url):
+    assert youtube_video_id(url) == VIDEO_ID
+
+
+@pytest.mark.parametrize("url", [
+    f"https://notyoutube.com/watch?v={VIDEO_ID}",
+    f"https://youtube.com.example.org/watch?v={VIDEO_ID}",
+    f"https://evil-youtu.be/{VIDEO_ID}",
+    "https://www.youtube.com/watch?v=short",
+    "https://www.youtube.com/channel/UCabcdefghijk",
+])
+def test_youtube_video_id_rejects_other_hosts_and_ids(url):
+    assert youtube_video_id(url) is None
+
+
+def sha256(data):
+    return f"sha256:{hashlib.sha256(data).hexdigest()}"
+
+
+def test_fingerprint_file_rewinds():
+    upload = io.BytesIO(b"video bytes" * 1000)
+    assert fingerprint_file(upload) == sha256(b"video bytes" * 1000)
+    assert upload.tell() == 0
+
+
+def test_hashing_reader_hashes_the_bytes_as_they_are_saved():
+    data = bytes(range(256)) * 1000
+    upload = HashingReader(io.BytesIO(data))
+    saved = bytearray()
+    while chunk := upload.read(4096):
+        saved += chunk
+    assert saved == data
+    assert upload.fingerprint() == sha256(data)
+
+
+def test_hashing_reader_with_a_saver_that_takes_the_buffer():
+    data = b"x" * 10_000
+    upload = HashingReader(io.BytesIO(data))
+    assert bytes(upload.getbuffer()) == data
+    assert upload.fingerprint() == sha256(data)
+
+
+def test_hashing_reader_falls_back_when_bytes_are_skipped_or_reread():
+    data = bytes(range(256)) * 10
+    upload = HashingReader(io.BytesIO(data))
+    upload.read(100)
+    upload.seek(0)
+    upload.read(50)
+    upload.seek(500)
+    upload.read()
+    assert upload.fingerprint() == sha256(data)
+    untouched = HashingReader(io.BytesIO(data))
+    assert untouched.fingerprint() == sha256(data)
+
+
+def test_known_media_is_forgotten_when_its_artifacts_are_gone(tmp_path, monkeypatch):
+    # The index lives in the working directory, one connection per thread
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(media_fingerprints, "_local", media_fingerprints.threading.local())
+    paths = []
+    for name in ("video.mp4", "audio.mp3", "transcript.txt"):
+        (tmp_path / name).write_bytes(b"x")
+        paths.append(str(tmp_path / name))
+    record("youtube:" + VIDEO_ID, paths)
+    assert lookup("youtube:" + VIDEO_ID) == tuple(paths)
+    assert lookup(None) is None
+    (tmp_path / "audio.mp3").unlink()
+    assert lookup("youtube:" + VIDEO_ID) is None
+    (tmp_path / "audio.mp3").write_bytes(b"x")
+    assert lookup("youtube:" + VIDEO_ID) is None
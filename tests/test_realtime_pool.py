@@ -0,0 +1,90 @@
+import asyncio
+
+from realtime_pool import PooledSession, RealtimePool
+
+
+class FakeClient:
+    def __init__(self, pool_log, connected=True):
+        self.log = pool_log
+        self.connected = connected
+
+    def is_connected(self):
+        return self.connected
+
+    async def disconnect(self):
+        # Yields, so a claim can run while the pool closes a session
+        await asyncio.sleep(0.01)
+        self.connected = False
+        self.log.append("disconnect")
+
+
+def make_pool(size=2, delay=0.0):
+    log = []
+
+    async def create_session():
+        await asyncio.sleep(delay)
+        log.append("create")
+        return PooledSession(FakeClient(log))
+
+    return RealtimePool(create_session, size=size, idle_seconds=60, check_seconds=0.01), log
+
+
+def test_fills_on_start_and_claims_without_connecting():
+    async def run():
+        pool, log = make_pool()
+        pool.start()
+        await asyncio.sleep(0.05)
+        session = await pool.claim("chat")
+        await asyncio.sleep(0.05)
+        return pool, log, session
+
+    pool, log, session = asyncio.run(run())
+    assert session.context == "chat"
+    assert log == ["create"] * 3
+    assert pool.stats()["exhausted"] == 0
+    assert pool.stats()["ready"] == 2
+
+
+def test_claim_waits_for_a_session_being_connected():
+    async def run():
+        pool, log = make_pool(size=1, delay=0.05)
+        pool.start()
+        await asyncio.sleep(0)
+        await pool.claim()
+        return pool
+
+    assert asyncio.run(run()).stats()["exhausted"] == 0
+
+
+def test_sweep_survives_claims_of_expiring_sessions():
+    async def run():
+        pool, log = make_pool(size=3)
+        pool.start()
+        await asyncio.sleep(0.05)
+        for session in pool._ready:
+            session.created_at -= 120
+        # The sweep closes the first expired session while the chat takes the next ones
+        pool._wake.set()
+        await asyncio.sleep(0)
+        for _ in range(2):
+            await pool.claim()
+        await asyncio.sleep(0.1)
+        return pool, pool._task.done()
+
+    pool, died = asyncio.run(run())
+    assert not died
+    assert pool.stats()["ready"] == 3
+
+
+def test_start_replaces_a_dead_maintenance_task():
+    async def run():
+        pool, log = make_pool(size=1)
+        pool._task = asyncio.get_running_loop().create_task(asyncio.sleep(0))
+        await pool._task
+        pool.start()
+        await asyncio.sleep(0.05)
+        return pool, pool._task.done()
+
+    pool, died = asyncio.run(run())
+    assert not died
+    assert pool.stats()["ready"] == 1
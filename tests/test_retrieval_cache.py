@@ -0,0 +1,106 @@
+import time
+from types import SimpleNamespace
+
+import numpy as np
+
+import retrieval_cache
+from retrieval_cache import RetrievalCache, normalize_query
+
+
+class Counter:
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.calls
+
+
+def test_normalize_query():
+    assert normalize_query("  What's   NEW, in agents?") == "what s new in agents"
+
+
+def test_exact_hits_on_the_normalized_query():
+    cache = RetrievalCache(similarity=0)
+    compute = Counter()
+    assert cache.get_or_compute("search", "event", 1, "Agents?", compute) == 1
+    assert cache.get_or_compute("search", "event", 1, "agents", compute) == 1
+    # Kinds and events are cached separately
+    assert cache.get_or_compute("media", "event", 1, "agents", compute) == 2
+    assert cache.get_or_compute("search", "other", 1, "agents", compute) == 3
+    assert cache.stats()["hits"] == 1
+
+
+def test_index_versions_do_not_evict_each_other():
+    cache = RetrievalCache(similarity=0)
+    compute = Counter()
+    for version in (1, 2, 1, 2):
+        cache.get_or_compute("search", "event", version, "agents", compute)
+    assert compute.calls == 2
+    assert cache.stats()["versions"] == 2
+
+
+def test_least_recently_used_versions_are_dropped():
+    cache = RetrievalCache(similarity=0, max_versions=2)
+    compute = Counter()
+    cache.get_or_compute("search", "event", 1, "agents", compute)
+    cache.get_or_compute("search", "event", 2, "agents", compute)
+    cache.get_or_compute("search", "event", 1, "agents", compute)
+    cache.get_or_compute("search", "event", 3, "agents", compute)
+    assert compute.calls == 3
+    # Version 2 was the least recently used
+    cache.get_or_compute("search", "event", 1, "agents", compute)
+    assert compute.calls == 3
+    cache.get_or_compute("search", "event", 2, "agents", compute)
+    assert compute.calls == 4
+
+
+def test_entries_expire_and_are_bounded():
+    cache = RetrievalCache(similarity=0, ttl_seconds=0.05, max_entries=2)
+    compute = Counter()
+    cache.get_or_compute("search", "event", 1, "a", compute)
+    time.sleep(0.1)
+    cache.get_or_compute("search", "event", 1, "a", compute)
+    assert compute.calls == 2
+    cache.get_or_compute("search", "event", 1, "b", compute)
+    cache.get_or_compute("search", "event", 1, "c", compute)
+    cache.get_or_compute("search", "event", 1, "a", compute)
+    assert compute.calls == 5
+    assert cache.stats()["entries"] == 2
+
+
+def test_similar_queries_hit_through_embeddings():
+    vectors = {"who spoke about agents": [1.0, 0.0], "which speaker covered agents": [0.99, 0.14],
+               "what about pricing": [0.0, 1.0]}
+    cache = RetrievalCache(similarity=0.9, embed_fn=lambda text: np.asarray(vectors[text]))
+    compute = Counter()
+    cache.get_or_compute("search", "event", 1, "Who spoke about agents?", compute)
+    assert cache.get_or_compute("search", "event", 1, "Which speaker covered agents?", compute) == 1
+    assert cache.get_or_compute("search", "event", 1, "What about pricing?", compute) == 2
+    assert cache.stats()["similar_hits"] == 1
+
+
+def test_failed_embeddings_fall_back_to_exact_matches():
+    def broken(text):
+        raise RuntimeError("no network")
+
+    cache = RetrievalCache(similarity=0.5, embed_fn=broken)
+    compute = Counter()
+    cache.get_or_compute("search", "event", 1, "a", compute)
+    assert cache.get_or_compute("search", "event", 1, "b", compute) == 2
+    assert cache.get_or_compute("search", "event", 1, "a", compute) == 1
+
+
+def test_media_lookups_are_cached_per_document_set(monkeypatch):
+    calls = []
+    monkeypatch.setattr(retrieval_cache, "get_retrieval_cache", lambda: cache)
+    monkeypatch.setattr(retrieval_cache, "get_media_indices",
+                        lambda query, text_docs, img_docs, media_label, indexes: calls.append(text_docs) or len(calls))
+    cache = RetrievalCache(similarity=0)
+    event_docs = [SimpleNamespace(node_id="n1"), SimpleNamespace(node_id="n2")]
+    federated_docs = [SimpleNamespace(node_id="n2")]
+    assert retrieval_cache.cached_get_media_indices("agents", event_docs, [], "event", {}, 1) == 1
+    assert retrieval_cache.cached_get_media_indices("agents", federated_docs, [], "event", {}, 1) == 2
+    assert retrieval_cache.cached_get_media_indices("agents", list(event_docs), [], "event", {}, 1) == 1
+    # Text and image documents are told apart
+    assert retrieval_cache.cached_get_media_indices("agents", [], federated_docs, "event", {}, 1) == 3
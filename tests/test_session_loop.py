@@ -0,0 +1,53 @@
+import asyncio
+import gc
+import time
+
+from session_loop import EventLoopGuard, cancel_pending_tasks, close_event_loop
+
+
+def loop_with_pending_task():
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(asyncio.sleep(3600))
+    return loop, task
+
+
+def test_cancel_pending_tasks_of_an_interrupted_run():
+    loop, task = loop_with_pending_task()
+    cancel_pending_tasks(loop)
+    assert task.cancelled()
+    assert not asyncio.all_tasks(loop)
+    # The loop stays usable for the next turn
+    assert loop.run_until_complete(asyncio.sleep(0, result="next")) == "next"
+    loop.close()
+
+
+def test_close_event_loop():
+    loop, task = loop_with_pending_task()
+    close_event_loop(loop)
+    assert task.cancelled()
+    assert loop.is_closed()
+
+
+def test_guard_closes_the_loop_when_collected():
+    loop, task = loop_with_pending_task()
+    guard = EventLoopGuard(loop)
+    del guard
+    gc.collect()
+    assert loop.is_closed()
+    assert task.cancelled()
+
+
+def test_guard_collected_while_another_loop_runs():
+    loop, task = loop_with_pending_task()
+
+    async def collect_in_a_running_loop():
+        guard = EventLoopGuard(loop)
+        del guard
+        gc.collect()
+        deadline = time.monotonic() + 5
+        while not loop.is_closed() and time.monotonic() < deadline:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(collect_in_a_running_loop())
+    assert loop.is_closed()
+    assert task.cancelled()
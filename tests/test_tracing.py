@@ -0,0 +1,35 @@
+import json
+
+from tracing import Tracer, percentile
+
+
+def span(i):
+    return {"app": "test", "stage": "llm", "seconds": i / 100, "turn_id": f"turn{i}"}
+
+
+def test_percentile_is_nearest_rank():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile([], 50) is None
+
+
+def test_file_export_is_off_by_default(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tracer = Tracer(metrics_port=0)
+    tracer.record(span(1))
+    assert list(tmp_path.iterdir()) == []
+    assert tracer.percentiles("test")[("test", "llm")]["count"] == 1
+
+
+def test_trace_file_is_rotated_past_its_size_cap(tmp_path):
+    path = tmp_path / "traces.jsonl"
+    tracer = Tracer(log_path=str(path), metrics_port=0, log_max_mb=1 / 1024)
+    for i in range(100):
+        tracer.record(span(i))
+    rotated = tmp_path / "traces.jsonl.1"
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["traces.jsonl", "traces.jsonl.1"]
+    assert rotated.stat().st_size <= 1024 + 200
+    lines = (rotated.read_text() + path.read_text()).splitlines()
+    # The most recent spans are kept, in order
+    assert [json.loads(line)["turn_id"] for line in lines][-1] == "turn99"
@@ -0,0 +1,146 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from web_search import PooledSession, WebSearch, with_pooled_session
+
+
+class GatedSearch:
+    """Search that blocks each query until it is released"""
+
+    def __init__(self):
+        self.calls = []
+        self.gates = {}
+        self.lock = threading.Lock()
+
+    def gate(self, query):
+        with self.lock:
+            return self.gates.setdefault(query, threading.Event())
+
+    def __call__(self, query, media_label):
+        with self.lock:
+            self.calls.append((query, media_label))
+        self.gate(query).wait(5)
+        if query == "broken":
+            raise RuntimeError("search failed")
+        return f"{query} @ {media_label}"
+
+
+@pytest.fixture
+def executor():
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        yield executor
+
+
+def make_search(search_fn, executor, **kwargs):
+    return WebSearch(search_fn=search_fn, executor=executor, **kwargs)
+
+
+def test_results_are_cached_per_normalized_query_and_event(executor):
+    search_fn = GatedSearch()
+    for query in ("Agents?", "agents"):
+        search_fn.gate(query).set()
+    web_search = make_search(search_fn, executor)
+    assert web_search.search_many([("Agents?", "event")]) == ["Agents? @ event"]
+    assert web_search.search_many([("agents", "event")]) == ["Agents? @ event"]
+    assert web_search.search_many([("agents", "other")]) == ["agents @ other"]
+    assert len(search_fn.calls) == 2
+    assert web_search.stats()["hits"] == 1
+
+
+def test_entries_expire_after_their_ttl(executor):
+    search_fn = GatedSearch()
+    search_fn.gate("agents").set()
+    web_search = make_search(search_fn, executor, ttl_seconds=0.05)
+    web_search.search_many([("agents", "event")])
+    time.sleep(0.1)
+    web_search.search_many([("agents", "event")])
+    assert len(search_fn.calls) == 2
+
+
+def test_identical_searches_in_flight_share_one_call(executor):
+    search_fn = GatedSearch()
+    web_search = make_search(search_fn, executor)
+    futures = [web_search.submit("agents", "event") for _ in range(3)]
+    assert futures[0] is futures[1] is futures[2]
+    search_fn.gate("agents").set()
+    assert {future.result(5) for future in futures} == {"agents @ event"}
+    assert search_fn.calls == [("agents", "event")]
+    assert web_search.stats()["coalesced"] == 2
+
+
+def test_slow_and_failed_searches_are_left_out(executor):
+    search_fn = GatedSearch()
+    search_fn.gate("fast").set()
+    search_fn.gate("broken").set()
+    web_search = make_search(search_fn, executor, timeout=0.1)
+    results = web_search.search_many([("fast", "event"), ("slow", "event"), ("broken", "event")])
+    assert results == ["fast @ event"]
+    stats = web_search.stats()
+    assert (stats["timeouts"], stats["errors"]) == (1, 1)
+    # The slow search keeps running and fills the cache for the next turn
+    search_fn.gate("slow").set()
+    web_search.submit("slow", "event").result(5)
+    assert web_search.search_many([("slow", "event")]) == ["slow @ event"]
+    assert search_fn.calls.count(("slow", "event")) == 1
+    # Failures are not cached
+    web_search.search_many([("broken", "event")])
+    assert search_fn.calls.count(("broken", "event")) == 2
+
+
+def test_cache_is_bounded(executor):
+    search_fn = GatedSearch()
+    for query in "abc":
+        search_fn.gate(query).set()
+    web_search = make_search(search_fn, executor, max_entries=2)
+    web_search.search_many([("a", "event"), ("b", "event"), ("c", "event")])
+    assert web_search.stats()["entries"] == 2
+
+
+def test_search_functions_get_a_pooled_session_per_thread():
+    sessions = []
+
+    def search(query, media_label, session=None):
+        sessions.append(session)
+        return f"{query} @ {media_label}"
+
+    pooled = with_pooled_session(search)
+    assert pooled("agents", "event") == "agents @ event"
+    pooled("pricing", "event")
+    worker = threading.Thread(target=pooled, args=("agents", "event"))
+    worker.start()
+    worker.join()
+    assert all(isinstance(session, PooledSession) for session in sessions)
+    assert sessions[0] is sessions[1]
+    assert sessions[2] is not sessions[0]
+
+
+def test_search_functions_without_a_session_are_left_alone():
+    def search(query, media_label):
+        return query
+
+    assert with_pooled_session(search) is search
+
+
+def test_pooled_session_sets_a_default_timeout(monkeypatch):
+    seen = {}
+
+    def send(self, request, **kwargs):
+        seen.update(kwargs)
+        raise ConnectionError("offline")
+
+    monkeypatch.setattr("requests.Session.send", send)
+    session = PooledSession(timeout=1.5)
+    for kwargs in ({}, {"timeout": None}):
+        try:
+            session.get("http://example.invalid/", **kwargs)
+        except ConnectionError:
+            pass
+        assert seen["timeout"] == 1.5
+    try:
+        session.get("http://example.invalid/", timeout=4)
+    except ConnectionError:
+        pass
+    assert seen["timeout"] == 4
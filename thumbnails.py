@@ -0,0 +1,93 @@
+"""Thumbnails of event title images for the Knowledge Base grid.
+
+Thumbnails are written to a thumbnails/ directory next to the title image and
+named by a hash of the image content and thumbnail settings, so a changed
+image gets a new thumbnail and identical images share one. Backfill the
+events ingested before thumbnails existed with:
+
+    python thumbnails.py --backfill
+"""
+import argparse
+import hashlib
+import os
+import threading
+
+from PIL import Image, ImageOps
+
+from constants import KNOWLEDGE_BASE_PATH, THUMBNAIL_SIZE, THUMBNAIL_QUALITY
+
+_memo = {}  # (path, size, mtime_ns) -> thumbnail path
+_memo_lock = threading.Lock()
+
+
+def thumbnail_path(image_path, size=THUMBNAIL_SIZE, quality=THUMBNAIL_QUALITY):
+    digest = hashlib.sha256()
+    with open(image_path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    digest.update(f"{size[0]}x{size[1]}q{quality}".encode())
+    return os.path.join(os.path.dirname(image_path), "thumbnails", f"{digest.hexdigest()[:32]}.jpg")
+
+
+def make_thumbnail(image_path, size=THUMBNAIL_SIZE, quality=THUMBNAIL_QUALITY):
+    """Return the thumbnail of an image, creating it on first use"""
+    stat = os.stat(image_path)
+    key = (image_path, size, stat.st_mtime_ns)
+    with _memo_lock:
+        if key in _memo and os.path.exists(_memo[key]):
+            return _memo[key]
+    path = thumbnail_path(image_path, size, quality)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with Image.open(image_path) as image:
+            image = ImageOps.exif_transpose(image).convert("RGB")
+            image.thumbnail(size, Image.LANCZOS)
+            tmp_path = f"{path}.tmp.{os.getpid()}"
+            image.save(tmp_path, "JPEG", quality=quality, optimize=True, progressive=True)
+        os.replace(tmp_path, path)
+    with _memo_lock:
+        _memo[key] = path
+    return path
+
+
+def event_thumbnail(event_data):
+    """Thumbnail of an event's title image, or None when it has no usable image"""
+    return title_thumbnail(event_data.get("title_image"))
+
+
+def title_thumbnail(title_image):
+    if not title_image or not os.path.exists(title_image):
+        return None
+    try:
+        return make_thumbnail(title_image)
+    except OSError as e:
+        print(f"Could not create a thumbnail for {title_image}: {e}")
+        return None
+
+
+def backfill(file_path=KNOWLEDGE_BASE_PATH):
+    from recall_utils import load_state, update_state
+    updated = {}
+    for media_label, event_data in load_state(file_path).items():
+        thumbnail = event_thumbnail(event_data)
+        if thumbnail and event_data.get("title_thumbnail") != thumbnail:
+            event_data["title_thumbnail"] = thumbnail
+            updated[media_label] = event_data
+            print(f"{media_label}: {thumbnail}")
+    update_state(file_path, updated)
+    print(f"Updated thumbnails of {len(updated)} event(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event title image thumbnails")
+    parser.add_argument("--backfill", action="store_true", help="create missing thumbnails for every event")
+    parser.add_argument("--knowledge-base", default=KNOWLEDGE_BASE_PATH)
+    args = parser.parse_args()
+    if args.backfill:
+        backfill(args.knowledge_base)
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+from constants import TRACE_WINDOW, TRACE_LOG_PATH, TRACE_LOG_MAX_MB, TRACE_METRICS_PORT
+
+# Per-stage latency tracing for chat turns. Every stage of a turn is recorded
+# as a span tagged with the app, session and media_label. Spans feed rolling
+# percentiles kept in process, an opt-in JSONL file sink that keeps one
+# rotated file and, when a port is set, a Prometheus endpoint.
+
+PERCENTILES = (50, 95, 99)
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-pct * len(sorted_values) // 100))
+    return sorted_values[rank - 1]
+
+
+class Tracer:
+    def __init__(self, window=TRACE_WINDOW, log_path=TRACE_LOG_PATH, metrics_port=TRACE_METRICS_PORT,
+                 log_max_mb=TRACE_LOG_MAX_MB):
+        self.window = window
+        self._lock = threading.Lock()
+        self._durations = {}  # (app, stage) -> deque of seconds
+        self._recent = deque(maxlen=200)
+        self.log_path = log_path
+        self.log_max_bytes = int(log_max_mb * 1024 * 1024)
+        self._log = open(log_path, "a", buffering=1) if log_path else None
+        self._histogram = self._start_metrics(metrics_port) if metrics_port else None
+
+    def _start_metrics(self, port):
+        try:
+            from prometheus_client import Histogram, start_http_server
+            histogram = Histogram("recall_stage_seconds", "Latency of chat turn stages", ["app", "stage"],
+                                  buckets=(.05, .1, .25, .5, 1, 2, 4, 8, 16, 32, 64))
+            start_http_server(port)
+            print(f"Serving latency metrics on :{port}/metrics")
+            return histogram
+        except (ImportError, OSError) as e:
+            print(f"Latency metrics endpoint disabled: {e}")
+            return None
+
+    def record(self, span):
+        key = (span["app"], span["stage"])
+        with self._lock:
+            self._durations.setdefault(key, deque(maxlen=self.window)).append(span["seconds"])
+            self._recent.append(span)
+            if self._log:
+                self._log.write(json.dumps(span) + "\n")
+                if self._log.tell() > self.log_max_bytes:
+                    self._rotate()
+        if self._histogram:
+            self._histogram.labels(*key).observe(span["seconds"])
+
+    def _rotate(self):
+        # Caller must hold the lock. Only the previous file is kept.
+        self._log.close()
+        os.replace(self.log_path, self.log_path + ".1")
+        self._log = open(self.log_path, "a", buffering=1)
+
+    def percentiles(self, app=None):
+        """{(app, stage): {"count", "p50", "p95", "p99", "max"}} over the rolling window"""
+        with self._lock:
+            durations = {key: sorted(values) for key, values in self._durations.items()
+                         if app is None or key[0] == app}
+        return {key: {"count": len(values),
+                      **{f"p{pct}": percentile(values, pct) for pct in PERCENTILES},
+                      "max": values[-1]}
+                for key, values in durations.items()}
+
+    def recent_spans(self, turn_id=None, limit=50):
+        with self._lock:
+            spans = [span for span in self._recent if turn_id is None or span["turn_id"] == turn_id]
+        return spans[-limit:]
+
+    def start_turn(self, app, session_id, media_label=None):
+        return Turn(self, app, session_id, media_label)
+
+
+class Turn:
+    """Spans of one chat turn. Safe to use from executor threads."""
+
+    def __init__(self, tracer, app, session_id, media_label):
+        self.tracer = tracer
+        self.app = app
+        self.session_id = session_id
+        self.media_label = media_label
+        self.turn_id = uuid.uuid4().hex[:12]
+        self.started = time.perf_counter()
+        self.ended = False
+        self._marked = set()
+
+    def record(self, stage, seconds, **attrs):
+        self.tracer.record({"app": self.app, "stage": stage, "seconds": round(seconds, 4),
+                            "turn_id": self.turn_id, "session_id": self.session_id,
+                            "media_label": self.media_label, "ts": time.time(), **attrs})
+
+    def mark(self, stage, **attrs):
+        """Record the time elapsed since the turn started, e.g. time to first audio"""
+        self.record(stage, time.perf_counter() - self.started, **attrs)
+
+    def mark_once(self, stage, **attrs):
+        if stage not in self._marked:
+            self._marked.add(stage)
+            self.mark(stage, **attrs)
+
+    @contextmanager
+    def span(self, stage, **attrs):
+        start = time.perf_counter()
+        error = None
+        try:
+            yield
+        except BaseException as e:
+            error = type(e).__name__
+            raise
+        finally:
+            if error:
+                attrs["error"] = error
+            self.record(stage, time.perf_counter() - start, **attrs)
+
+    def traced(self, stage, fn):
+        """Wrap fn so each call is recorded as a span, for run_in_executor"""
+        def wrapper(*args, **kwargs):
+            with self.span(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+
+    def first_token_probe(self, container, stage):
+        """Wrap a streaming container to record the time until its first write"""
+        probe_start = time.perf_counter()
+        return FirstTokenProbe(container, lambda: self.record(stage, time.perf_counter() - probe_start))
+
+    def end(self, stage="turn", **attrs):
+        """Record the whole span from start to end under stage, once"""
+        if not self.ended:
+            self.ended = True
+            self.record(stage, time.perf_counter() - self.started, **attrs)
+
+
+class FirstTokenProbe:
+    """Proxy for a streaming output container that reports the first write"""
+
+    _WRITE_METHODS = {"markdown", "write", "write_stream", "text", "code"}
+
+    def __init__(self, container, on_first_write):
+        self._container = container
+        self._on_first_write = on_first_write
+        self._fired = False
+
+    def __getattr__(self, name):
+        attr = getattr(self._container, name)
+        if name in self._WRITE_METHODS and callable(attr):
+            def write(*args, **kwargs):
+                if not self._fired:
+                    self._fired = True
+                    self._on_first_write()
+                return attr(*args, **kwargs)
+            return write
+        return attr
+
+
+_tracer = None
+_tracer_lock = threading.Lock()
+
+
+def get_tracer():
+    """Return the tracer shared by every session in this process"""
+    global _tracer
+    with _tracer_lock:
+        if _tracer is None:
+            _tracer = Tracer()
+        return _tracer
+
+
+def start_turn(app, session_id, media_label=None):
+    return get_tracer().start_turn(app, session_id, media_label)
+
+
+def format_percentiles(app=None):
+    """Markdown table of the rolling stage percentiles"""
+    lines = ["| stage | count | p50 | p95 | p99 |", "|---|---|---|---|---|"]
+    for (_, stage), stats in sorted(get_tracer().percentiles(app).items()):
+        lines.append(f"| {stage} | {stats['count']} | {stats['p50']:.3f} | {stats['p95']:.3f} | {stats['p99']:.3f} |")
+    return "\n".join(lines)
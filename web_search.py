@@ -0,0 +1,161 @@
+import inspect
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import Future, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from constants import (WEB_SEARCH_CACHE_TTL_SECONDS, WEB_SEARCH_CACHE_MAX_ENTRIES, WEB_SEARCH_TIMEOUT_SECONDS,
+                       WEB_SEARCH_WORKERS, WEB_SEARCH_HTTP_TIMEOUT_SECONDS, WEB_SEARCH_HTTP_POOL_SIZE)
+from recall_utils import get_thread_pool
+from retrieval_cache import normalize_query
+from tracing import percentile
+from video_index.rags import scraper
+
+# Web searches requested by the chat LLM. Results are cached per (query, event),
+# identical searches in flight share one call, and a turn only waits until its
+# deadline: slower searches keep running and fill the cache for the next turn.
+
+
+class PooledSession(requests.Session):
+    """Session with keep-alive connection pools and a default timeout, so calls cannot hang"""
+
+    def __init__(self, pool_size=WEB_SEARCH_HTTP_POOL_SIZE, timeout=WEB_SEARCH_HTTP_TIMEOUT_SECONDS):
+        super().__init__()
+        self.timeout = timeout
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.mount("http://", adapter)
+        self.mount("https://", adapter)
+
+    def request(self, method, url, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().request(method, url, **kwargs)
+
+
+def with_pooled_session(search_fn):
+    """search_fn called with a PooledSession of the calling thread, since sessions
+    are not thread-safe. A search function without a session parameter is
+    returned as is and opens its own connections.
+    """
+    if "session" not in inspect.signature(search_fn).parameters:
+        print(f"{getattr(search_fn, '__name__', search_fn)} takes no session, its connections are not pooled")
+        return search_fn
+    local = threading.local()
+
+    def search(query, media_label):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = PooledSession()
+        return search_fn(query, media_label, session=session)
+
+    return search
+
+
+class WebSearch:
+    """TTL cache with single-flight calls in front of a web search function"""
+
+    def __init__(self, search_fn=scraper.perform_web_search, ttl_seconds=WEB_SEARCH_CACHE_TTL_SECONDS,
+                 max_entries=WEB_SEARCH_CACHE_MAX_ENTRIES, timeout=WEB_SEARCH_TIMEOUT_SECONDS,
+                 executor=None):
+        self._search_fn = search_fn
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._executor = executor or get_thread_pool("web_search", WEB_SEARCH_WORKERS)
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (query, media_label) -> (result, expires_at)
+        self._in_flight = {}  # (query, media_label) -> Future
+        self._latencies = deque(maxlen=500)
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def submit(self, query, media_label):
+        """Future of the search result, already done on a cache hit"""
+        key = (normalize_query(query), media_label)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > time.monotonic():
+                self.hits += 1
+                self._entries.move_to_end(key)
+                future = Future()
+                future.set_result(entry[0])
+                return future
+            if key in self._in_flight:
+                self.coalesced += 1
+                return self._in_flight[key]
+            self.misses += 1
+            future = self._in_flight[key] = self._executor.submit(self._search, key, query, media_label)
+        return future
+
+    def _search(self, key, query, media_label):
+        start = time.perf_counter()
+        try:
+            result = self._search_fn(query, media_label)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+                self._in_flight.pop(key, None)
+            raise
+        with self._lock:
+            self._latencies.append(time.perf_counter() - start)
+            self._in_flight.pop(key, None)
+            self._entries[key] = (result, time.monotonic() + self.ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return result
+
+    def search_many(self, searches, timeout=None):
+        """Results of the (query, media_label) searches finished before the deadline.
+
+        Searches that failed or are still running are left out.
+        """
+        futures = [self.submit(query, media_label) for query, media_label in searches]
+        done, not_done = wait(futures, timeout=self.timeout if timeout is None else timeout)
+        with self._lock:
+            self.timeouts += len(not_done)
+        results = []
+        for (query, _), future in zip(searches, futures):
+            if future not in done:
+                print(f"Web search for {query!r} missed the deadline")
+            elif future.exception() is not None:
+                print(f"Web search for {query!r} failed: {future.exception()}")
+            else:
+                results.append(future.result())
+        return results
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.coalesced + self.misses
+            latencies = sorted(self._latencies)
+            return {
+                "hits": self.hits,
+                "coalesced": self.coalesced,
+                "misses": self.misses,
+                "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+                "timeouts": self.timeouts,
+                "errors": self.errors,
+                "in_flight": len(self._in_flight),
+                "entries": len(self._entries),
+                "p50_seconds": percentile(latencies, 50),
+                "p95_seconds": percentile(latencies, 95),
+            }
+
+
+_web_search = None
+_web_search_lock = threading.Lock()
+
+
+def get_web_search():
+    """Return the web search layer shared by every session in this process"""
+    global _web_search
+    with _web_search_lock:
+        if _web_search is None:
+            _web_search = WebSearch(search_fn=with_pooled_session(scraper.perform_web_search))
+        return _web_search